@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+'''
+Batch (non-GUI) commands of morphologist, driving a study and its runner
+directly. They print their results as JSON on the standard output.
+
+This module must not import Qt or anatomist, directly or not.
+'''
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import sys
+import csv
+import json
+import optparse
+
+from morphologist.core.settings import settings
+
+
+COMMANDS = ('run', 'plan', 'status', 'wait', 'stop', 'export-morphometry')
+
+
+class BatchError(Exception):
+    pass
+
+
+def status_name(status):
+    from morphologist.core.runner import Runner
+    names = {Runner.NOT_STARTED: 'not_started',
+             Runner.RUNNING: 'running',
+             Runner.FAILED: 'failed',
+             Runner.SUCCESS: 'success',
+             Runner.STOPPED_BY_USER: 'stopped',
+             Runner.UNKNOWN: 'unknown',
+             Runner.ABORTED_NOTRUN: 'aborted',
+             Runner.INTERRUPTED: 'interrupted'}
+    return names.get(status, 'unknown')
+
+
+def option_parser(command):
+    parser = optparse.OptionParser(
+        usage='%%prog %s -s STUDY_DIRECTORY [options]' % command)
+    parser.add_option('-s', '--study', dest='study_directory',
+                      metavar='STUDY_DIRECTORY', default=None,
+                      help='study directory')
+    parser.add_option('--backend', dest='backend', default=None,
+                      help='runner backend: soma_workflow or local_pool '
+                      '(default: from the settings)')
+    parser.add_option('--mock', action='store_true', dest='mock',
+                      default=False,
+                      help='Test mode, runs mock intra analysis')
+    if command in ('run', 'plan', 'status', 'stop', 'export-morphometry'):
+        parser.add_option('-S', '--subject', action='append',
+                          dest='subject_ids', default=None,
+                          metavar='SUBJECT_ID',
+                          help='subject id (group-name), may be repeated '
+                          '(default: all subjects)')
+    if command in ('run', 'plan', 'stop'):
+        parser.add_option('--steps', dest='step_ids', default=None,
+                          help='comma separated list of pipeline steps to '
+                          'run, or to stop (default: all)')
+    if command == 'plan':
+        parser.add_option('-n', '--processes', dest='processes_n',
+                          type='int', default=None,
+                          help='number of processing units to estimate the '
+                          'run duration for (default: from the settings)')
+    if command == 'run':
+        parser.add_option('--incremental', action='store_true',
+                          dest='incremental', default=False,
+                          help='add subjects to the running analyses '
+                          'instead of restarting them')
+        parser.add_option('--no-wait', action='store_true', dest='no_wait',
+                          default=False,
+                          help='return once jobs are submitted '
+                          '(soma_workflow backend only)')
+    if command == 'export-morphometry':
+        parser.add_option('-o', '--output', dest='output',
+                          default=None, help='output CSV file')
+    return parser
+
+
+def load_study(options):
+    if options.study_directory is None:
+        raise BatchError('a study directory must be given (-s)')
+    if options.mock:
+        settings.commandline.mock = True
+        from morphologist.core.tests.mocks.study import MockStudy
+        study_cls = MockStudy
+    else:
+        # registers IntraAnalysis in the AnalysisFactory
+        import morphologist.intra_analysis
+        from morphologist.core.study import Study
+        study_cls = Study
+    return study_cls.from_study_directory(options.study_directory)
+
+
+def selected_subject_ids(study, options):
+    subject_ids = getattr(options, 'subject_ids', None)
+    if not subject_ids:
+        return list(study.subjects.keys())
+    unknown = [subject_id for subject_id in subject_ids
+               if subject_id not in study.subjects]
+    if unknown:
+        raise BatchError('unknown subjects: %s' % ', '.join(unknown))
+    return subject_ids
+
+
+def create_attached_runner(study, options):
+    from morphologist.core.runner import create_runner
+    runner = create_runner(study, options.backend)
+    attached = runner.attach()
+    return runner, attached
+
+
+def study_status(study, runner, subject_ids):
+    runner_status = runner.get_status()
+    subjects = {}
+    for subject_id in subject_ids:
+        analysis = study.analyses[subject_id]
+        if analysis.has_all_results():
+            results = 'complete'
+        elif analysis.has_some_results():
+            results = 'partial'
+        else:
+            results = 'none'
+        subjects[subject_id] = {
+            'status': status_name(runner.get_status(subject_id,
+                                                    update_status=False)),
+            'running_steps': sorted(runner.get_running_step_ids(
+                subject_id, update_status=False)),
+            'failed_steps': sorted(runner.get_failed_step_ids(
+                subject_id, update_status=False)),
+            'results': results}
+    result = {'study': study.study_name,
+              'status': status_name(runner_status),
+              'subjects': subjects}
+    if study.pipeline_pool is not None:
+        result['pipeline_pool'] = study.pipeline_pool.statistics()
+    return result
+
+
+def selected_step_ids(options):
+    if not options.step_ids:
+        return None
+    return [step_id.strip() for step_id in options.step_ids.split(',')]
+
+
+def run_command(study, options):
+    from morphologist.core.runner import MissingInputFileError
+    subject_ids = selected_subject_ids(study, options)
+    step_ids = selected_step_ids(options)
+    runner, attached = create_attached_runner(study, options)
+    if attached and runner.is_running() and not options.incremental:
+        raise BatchError('the study is already running '
+                         '(use --incremental to add subjects)')
+    if options.no_wait and not runner.DETACHABLE:
+        # the jobs would be lost when this process exits
+        raise BatchError('--no-wait is not supported by this runner backend')
+    try:
+        runner.run(subject_ids, incremental=options.incremental,
+                   step_ids=step_ids)
+    except MissingInputFileError as e:
+        raise BatchError('missing input files: %s' % e)
+    if not options.no_wait:
+        try:
+            runner.wait()
+        except KeyboardInterrupt:
+            runner.stop()
+            raise
+    result = study_status(study, runner, subject_ids)
+    return result, int(bool(runner.has_failed()))
+
+
+def plan_command(study, options):
+    from morphologist.core.runner import create_runner
+    subject_ids = selected_subject_ids(study, options)
+    runner = create_runner(study, options.backend)
+    plan = runner.plan(subject_ids, selected_step_ids(options),
+                       options.processes_n)
+    result = plan.to_dict()
+    result['study'] = study.study_name
+    return result, 0
+
+
+def status_command(study, options):
+    subject_ids = selected_subject_ids(study, options)
+    runner, _ = create_attached_runner(study, options)
+    return study_status(study, runner, subject_ids), 0
+
+
+def wait_command(study, options):
+    runner, attached = create_attached_runner(study, options)
+    if attached:
+        runner.wait()
+    result = study_status(study, runner, list(study.subjects.keys()))
+    return result, int(bool(runner.has_failed()))
+
+
+def stop_command(study, options):
+    runner, attached = create_attached_runner(study, options)
+    stopped = attached and runner.is_running()
+    if not stopped:
+        return {'study': study.study_name, 'stopped': False}, 0
+    step_ids = selected_step_ids(options)
+    if not options.subject_ids and step_ids is None:
+        runner.stop()
+    else:
+        # only the selected subjects and / or steps, the others keep running
+        subject_ids = options.subject_ids and \
+            selected_subject_ids(study, options) or [None]
+        for subject_id in subject_ids:
+            for step_id in step_ids or [None]:
+                if runner.is_running():
+                    runner.stop(subject_id, step_id)
+    result = study_status(study, runner, list(study.subjects.keys()))
+    result['stopped'] = True
+    return result, 0
+
+
+def export_morphometry_command(study, options):
+    from morphologist.intra_analysis.parameters \
+        import IntraAnalysisParameterNames
+    if options.output is None:
+        raise BatchError('an output file must be given (-o)')
+    subject_ids = selected_subject_ids(study, options)
+    exported = []
+    missing = []
+    header = None
+    with open(options.output, 'w') as output:
+        writer = None
+        for subject_id in subject_ids:
+            analysis = study.analyses[subject_id]
+            analysis.propagate_parameters()
+            filename = getattr(analysis.pipeline,
+                               IntraAnalysisParameterNames.MORPHOMETRY_CSV,
+                               None)
+            try:
+                with open(filename) as f:
+                    lines = f.readlines()
+            except (IOError, OSError, TypeError):
+                missing.append(subject_id)
+                continue
+            if not lines:
+                missing.append(subject_id)
+                continue
+            dialect = csv.Sniffer().sniff(lines[0], delimiters=';,\t ')
+            rows = list(csv.reader(lines, dialect))
+            if writer is None:
+                header = rows[0]
+                writer = csv.writer(output, delimiter=dialect.delimiter)
+                writer.writerow(['subject_id'] + header)
+            for row in rows[1:]:
+                writer.writerow([subject_id] + row)
+            exported.append(subject_id)
+    return {'study': study.study_name, 'output': options.output,
+            'exported_subjects': exported, 'missing_subjects': missing}, 0
+
+
+_commands = {
+    'run': run_command,
+    'plan': plan_command,
+    'status': status_command,
+    'wait': wait_command,
+    'stop': stop_command,
+    'export-morphometry': export_morphometry_command,
+}
+
+
+def main(argv):
+    ''' argv: [program, command, options...] '''
+    command = argv[1]
+    parser = option_parser(command)
+    options, args = parser.parse_args(argv[2:])
+    if args:
+        parser.error('unexpected arguments: %s' % ' '.join(args))
+    if not settings.are_valid():
+        print("Warning: invalid settings! User settings will be ignored.",
+              file=sys.stderr)
+        settings.load_default()
+    try:
+        study = load_study(options)
+        result, exit_code = _commands[command](study, options)
+    except BatchError as e:
+        result = {'error': str(e)}
+        exit_code = 2
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return exit_code
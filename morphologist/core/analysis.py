@@ -3,17 +3,25 @@ from __future__ import print_function
 from __future__ import absolute_import
 import copy
 import os
+import json
+import hashlib
 import shutil
 import traits.api as traits
 import sys
 import six
 
 from morphologist.core.utils import OrderedDict
+from morphologist.core.steps import StepResources
+from morphologist.core.format_conversion import FormatConverter, \
+    FORMATS_EXTENSIONS, VOLUMES_FORMATS, MESHES_FORMATS
+from morphologist.core.manifest import OutputManifest
+from morphologist.core.provenance import StepsProvenance
+from morphologist.core.pipeline_pool import PipelinePool
+from morphologist.core.settings import settings
 # CAPSUL
 from capsul.pipeline import pipeline_tools
+from capsul.pipeline.pipeline import Pipeline
 from capsul.attributes.completion_engine import ProcessCompletionEngine
-# AIMS
-from soma import aims
 
 class AnalysisFactory(object):
     _registered_analyses = {}
@@ -51,6 +59,9 @@ class Analysis(six.with_metaclass(AnalysisMetaClass, object)):
     # XXX the metaclass automatically registers the Analysis class in the
     # AnalysisFactory and initializes the param_template_map
 
+    # step_id -> StepResources
+    steps_resources = {}
+
     def __init__(self, study):
         self._init_steps()
         self._init_step_ids()
@@ -70,6 +81,13 @@ class Analysis(six.with_metaclass(AnalysisMetaClass, object)):
     def step_from_id(self, step_id):
         return self._step_ids.get(step_id)
 
+    @classmethod
+    def get_step_resources(cls, step_id):
+        resources = cls.steps_resources.get(step_id)
+        if resources is None:
+            resources = StepResources()
+        return resources
+
     def import_data(self, subject):
         raise NotImplementedError("Analysis is an Abstract class. import_data must be redefined.")
 
@@ -88,6 +106,30 @@ class Analysis(six.with_metaclass(AnalysisMetaClass, object)):
     def has_some_results(self, step_ids=None):
         raise NotImplementedError("Analysis is an Abstract class. has_some_results must be redefined.")
 
+    def get_subject_directory(self):
+        ''' directory of the data of the subject '''
+        return os.path.join(self.study.output_directory,
+                            self.subject.groupname, self.subject.name)
+
+    def write_output_manifest(self, step_ids=(), checksums=False):
+        ''' snapshot of the results of the subject, written by the runners
+        when steps complete (see OutputManifest). Analyses without manifest
+        do nothing.
+        '''
+        pass
+
+    def steps_provenance(self):
+        ''' StepsProvenance of the subject, None if the analysis does not
+        record the provenance of its steps
+        '''
+        return None
+
+    def record_steps_provenance(self, step_ids):
+        ''' the runs of the steps have completed (see StepsProvenance) '''
+        steps_provenance = self.steps_provenance()
+        if steps_provenance is not None:
+            steps_provenance.record(step_ids)
+
     def has_all_results(self, step_ids=None):
         raise NotImplementedError("Analysis is an Abstract class. has_all_results must be redefined.")
 
@@ -103,6 +145,7 @@ class Analysis(six.with_metaclass(AnalysisMetaClass, object)):
                     os.remove(f)
                 elif os.path.isdir(f):
                     shutil.rmtree(f)
+        self.study.file_index.invalidate(self.study.output_directory)
 
     def _files_for_format(self, filename):
         ext_map = {
@@ -119,32 +162,24 @@ class Analysis(six.with_metaclass(AnalysisMetaClass, object)):
         return [fname_base + ext for ext in exts] + [filename + '.minf']
 
     def convert_from_formats(self, old_volumes_format, old_meshes_format):
-        # TODO: use aims/somaio IO system for formats extensions
-        exts = [['.nii'], ['.nii.gz'], ['.img', '.hdr'], ['.ima', '.dim'],
-                ['.dcm'], ['.mnc'],
-                ['.gii'], ['.mesh'], ['.ply']]
-        vol_formats = ['.nii', '.nii.gz', '.img', '.ima', '.dcm', '.mnc']
-        mesh_formats = ['.gii', '.mesh', '.ply']
-
-        def _convert_data(old_name, new_name):
-            print('converting:', old_name, 'to:', new_name)
-            data = aims.read(old_name)
-            aims.write(data, new_name)
-
-        def _remove_data(name):
-            for fexts in exts:
-                for ext in fexts:
-                    if name.endswith(ext):
-                        basename =  name[:-len(ext)]
-                        real_exts = fexts + [fexts[0] + '.minf']
-                        for cext in real_exts:
-                            filename = basename + cext
-                            if os.path.isdir(filename):
-                                print('rmtree', filename)
-                                shutil.rmtree(filename)
-                            elif os.path.exists(filename):
-                                print('rm', filename)
-                                os.unlink(filename)
+        conversions = self.format_conversions(old_volumes_format,
+                                              old_meshes_format)
+        FormatConverter.from_directory(self.study.output_directory).convert(
+            conversions)
+
+    def format_conversions(self, old_volumes_format, old_meshes_format):
+        ''' update the parameters to the study formats, and list the data
+        files to convert (see FormatConverter)
+
+        Returns
+        -------
+        conversions: list
+            (old_name, new_name) filenames, new_name is None when old_name
+            should only be removed
+        '''
+        exts = FORMATS_EXTENSIONS
+        vol_formats = VOLUMES_FORMATS
+        mesh_formats = MESHES_FORMATS
 
         def _look_for_other_formats(value, new_value):
             old_format = [fext[0] for fext in exts
@@ -186,6 +221,7 @@ class Analysis(six.with_metaclass(AnalysisMetaClass, object)):
         old_params = self.parameters
         # force re-running FOM
         self.set_parameters(self.subject)
+        conversions = []
         todo = [(old_params, self.parameters)]
         while todo:
             old_dict, new_dict = todo.pop(0)
@@ -198,17 +234,66 @@ class Analysis(six.with_metaclass(AnalysisMetaClass, object)):
                             and (not isinstance(new_value, six.string_types)
                                  or not os.path.exists(new_value)):
                         value = _look_for_other_formats(value, new_value)
-                    if os.path.exists(value):
-                        if new_value not in ('', None, traits.Undefined) \
-                                and new_value != value:
-                            _convert_data(value, new_value)
-                        if new_value != value:
-                            _remove_data(value)
+                    if os.path.exists(value) and new_value != value:
+                        if new_value in ('', None, traits.Undefined):
+                            conversions.append((value, None))
+                        else:
+                            conversions.append((value, new_value))
             old_nodes = old_dict.get('nodes', {})
             new_nodes = new_dict.get('nodes', {})
             if old_nodes:
                 todo += [(node, new_nodes.get(key, {}))
                          for key, node in six.iteritems(old_nodes)]
+        return conversions
+
+
+def nodes_with_existing_outputs(pipeline, exists=os.path.exists):
+    ''' pipeline_tools.nodes_with_existing_outputs (recursive, excluding
+    inactive nodes and inputs), checking the files with the given exists
+    function (a study FileSystemIndex for instance)
+    '''
+    selected_nodes = {}
+    steps = getattr(pipeline, 'pipeline_steps', None)
+    disabled_nodes = set()
+    if steps is not None:
+        for step, trait in six.iteritems(steps.user_traits()):
+            if not getattr(steps, step):
+                disabled_nodes.update(trait.nodes)
+    nodes = list(pipeline.nodes.items())
+    while nodes:
+        node_name, node = nodes.pop(0)
+        if node_name == '' or not hasattr(node, 'process'):
+            # main pipeline node, switch...
+            continue
+        if not node.enabled or not node.activated \
+                or node_name in disabled_nodes:
+            continue
+        process = node.process
+        if isinstance(process, Pipeline):
+            nodes += [('%s.%s' % (node_name, new_name), new_node)
+                      for new_name, new_node in six.iteritems(process.nodes)
+                      if new_name != '']
+            continue
+        plug_list = []
+        input_files_list = set()
+        for plug_name, plug in six.iteritems(node.plugs):
+            trait = process.trait(plug_name)
+            if isinstance(trait.trait_type, traits.File) \
+                    or isinstance(trait.trait_type, traits.Directory) \
+                    or isinstance(trait.trait_type, traits.Any):
+                value = getattr(process, plug_name)
+                if isinstance(value, six.string_types) \
+                        and value not in input_files_list \
+                        and exists(value):
+                    if plug.output:
+                        plug_list.append((plug_name, value))
+                    else:
+                        input_files_list.add(value)
+        plug_list = [item for item in plug_list
+                     if item[1] not in input_files_list]
+        if plug_list:
+            selected_nodes[node_name] = plug_list
+    return selected_nodes
 
 
 class SharedPipelineAnalysis(Analysis):
@@ -220,13 +305,19 @@ class SharedPipelineAnalysis(Analysis):
 
     def __init__(self, study):
         super(SharedPipelineAnalysis, self).__init__(study)
-        if study.template_pipeline is None:
-            study.template_pipeline = self.build_pipeline()
-        completion_model = ProcessCompletionEngine.get_completion_engine(
-            study.template_pipeline)
-        # share the same instance of the pipeline to save memory and, most of
+        # share a few instances of the pipeline to save memory and, most of
         # all, instantiation time
+        if study.pipeline_pool is None:
+            study.pipeline_pool = PipelinePool(
+                self._build_shared_pipeline,
+                settings.study_editor.pipelines_memory)
+        if study.template_pipeline is None:
+            study.template_pipeline = study.pipeline_pool.first_instance()
         self.pipeline = study.template_pipeline
+        self._output_manifest = None
+        self._output_manifest_directory = None
+        # (parameters, hash of the parameters)
+        self._parameters_hash = None
 
     def build_pipeline(self):
         '''
@@ -236,29 +327,48 @@ class SharedPipelineAnalysis(Analysis):
         '''
         raise NotImplementedError("SharedPipelineAnalysis is an Abstract class. build_pipeline must be redefined.")
 
+    def _build_shared_pipeline(self):
+        pipeline = self.build_pipeline()
+        ProcessCompletionEngine.get_completion_engine(pipeline)
+        return pipeline
+
     def set_parameters(self, subject):
         self.complete_parameters(subject)
 
     def propagate_parameters(self):
-        if hasattr(self.pipeline, 'current_subject_id') \
-                and self.pipeline.current_subject_id \
-                    == self.subject.id():
+        pool = self.study.pipeline_pool
+        subject_id = self.subject.id()
+        pipeline = pool.get(subject_id, self.parameters)
+        if pipeline is not None:
             # OK this is already done.
+            self.pipeline = pipeline
             return
+        pipeline = pool.assign(subject_id)
         pipeline_tools.set_pipeline_state_from_dict(
-            self.pipeline, self.parameters)
-        self.pipeline.current_subject_id = self.subject.id()
+            pipeline, self.parameters)
+        pipeline.current_subject_id = subject_id
+        pipeline.current_parameters = self.parameters
+        self.pipeline = pipeline
 
     def get_attributes(self, subject):
         raise NotImplementedError("SharedPipelineAnalysis is an Abstract class. get_attributes must be redefined.")
 
+    def format_conversions(self, old_volumes_format, old_meshes_format):
+        # set_parameters must run the completion again with the new formats,
+        # not reuse the pipeline instance of the subject
+        self.study.pipeline_pool.forget(self.subject.id())
+        return super(SharedPipelineAnalysis, self).format_conversions(
+            old_volumes_format, old_meshes_format)
+
     def complete_parameters(self, subject):
-        pipeline = self.pipeline
-        if hasattr(pipeline, 'current_subject_id') \
-                and pipeline.current_subject_id \
-                    == self.subject.id():
+        pool = self.study.pipeline_pool
+        pipeline = pool.get(subject.id())
+        if pipeline is not None:
             # OK this is already done.
+            self.pipeline = pipeline
             return
+        pipeline = pool.assign(subject.id())
+        self.pipeline = pipeline
         attributes_dict = self.get_attributes(subject)
         if not attributes_dict:
             raise AttributeError('Subject %s/%s has no attributes'
@@ -277,17 +387,25 @@ class SharedPipelineAnalysis(Analysis):
             self.pipeline)
         # mark this subject as the one with the current parameters.
         pipeline.current_subject_id = subject.id()
+        pipeline.current_parameters = self.parameters
 
     def existing_results(self, step_ids=None):
-        pipeline = self.pipeline
+        manifest = self._read_output_manifest()
+        if manifest is not None:
+            existing = set()
+            for step_id, step in six.iteritems(manifest['steps']):
+                if step_ids is None or step_id in step_ids:
+                    existing.update(step['outputs'].keys())
+            return existing
         self.propagate_parameters()
+        pipeline = self.pipeline
         pipeline.enable_all_pipeline_steps()
         if step_ids:
             for pstep in pipeline.pipeline_steps.user_traits().keys():
                 if pstep not in step_ids:
                     setattr(pipeline.pipeline_steps, pstep, False)
-        outputs = pipeline_tools.nodes_with_existing_outputs(
-            pipeline, recursive=True, exclude_inputs=True)
+        outputs = nodes_with_existing_outputs(
+            pipeline, exists=self.study.file_index.exists)
         existing = set()
         for node, item_list in six.iteritems(outputs):
             existing.update([filename for param, filename in item_list])
@@ -304,11 +422,11 @@ class SharedPipelineAnalysis(Analysis):
         return bool(self.existing_results(step_ids=step_ids))
 
     def list_input_parameters_with_existing_files(self):
-        pipeline = self.pipeline
         subject = self.subject
         if subject is None:
             return False
         self.propagate_parameters()
+        pipeline = self.pipeline
         param_names = [param_name
                        for param_name, trait
                           in six.iteritems(pipeline.user_traits())
@@ -320,16 +438,17 @@ class SharedPipelineAnalysis(Analysis):
         params = {}
         for param_name in param_names:
             value = getattr(pipeline, param_name)
-            if isinstance(value, six.string_types) and os.path.exists(value):
+            if isinstance(value, six.string_types) \
+                    and self.study.file_index.exists(value):
                 params[param_name] = value
         return params
 
     def list_output_parameters_with_existing_files(self):
-        pipeline = self.pipeline
         subject = self.subject
         if subject is None:
             return False
         self.propagate_parameters()
+        pipeline = self.pipeline
         param_names = [param_name
                        for param_name, trait
                           in six.iteritems(pipeline.user_traits())
@@ -341,7 +460,8 @@ class SharedPipelineAnalysis(Analysis):
         params = {}
         for param_name in param_names:
             value = getattr(pipeline, param_name)
-            if isinstance(value, six.string_types) and os.path.exists(value):
+            if isinstance(value, six.string_types) \
+                    and self.study.file_index.exists(value):
                 params[param_name] = value
         return params
 
@@ -381,6 +501,17 @@ class SharedPipelineAnalysis(Analysis):
         raise NotImplementedError("SharedPipelineAnalysis is an Abstract class. get_output_file_parameter_names must be redefined.")
 
     def has_all_results(self, step_ids=None):
+        manifest = self._read_output_manifest()
+        if manifest is not None:
+            if step_ids is None:
+                return manifest['all_results']
+            if not [step_id for step_id in step_ids
+                    if step_id not in manifest['steps']]:
+                return not [step_id for step_id in step_ids
+                            if not manifest['steps'][step_id]['complete']]
+        return self._has_all_results(step_ids)
+
+    def _has_all_results(self, step_ids=None):
         # here we use the hard-coded outputs list in
         # IntraAnalysisParameterNames since we cannot determine automatically
         # from a pipeline if all outputs are expected or not (many are
@@ -391,11 +522,104 @@ class SharedPipelineAnalysis(Analysis):
             if self.is_parameter_in_steps(parameter, step_ids=step_ids):
                 value = getattr(pipeline, parameter)
                 if not isinstance(value, six.string_types) \
-                        or not os.path.exists(value):
+                        or not self.study.file_index.exists(value):
                     return False
         return True
 
 
+    def clear_results(self, step_ids=None):
+        # the manifest is stale anyway, and would hide the partial results
+        self.output_manifest().remove()
+        super(SharedPipelineAnalysis, self).clear_results(step_ids)
+
+    def output_manifest(self):
+        subject_directory = self.get_subject_directory()
+        if self._output_manifest is None \
+                or self._output_manifest_directory != subject_directory:
+            self._output_manifest \
+                = OutputManifest.from_subject_directory(subject_directory)
+            self._output_manifest_directory = subject_directory
+        return self._output_manifest
+
+    def steps_provenance(self):
+        return StepsProvenance.from_subject_directory(
+            self.get_subject_directory())
+
+    def parameters_hash(self):
+        if self._parameters_hash is None \
+                or self._parameters_hash[0] is not self.parameters:
+            serialized = json.dumps(self.parameters, sort_keys=True,
+                                    default=str)
+            self._parameters_hash = (
+                self.parameters,
+                hashlib.md5(serialized.encode('utf-8')).hexdigest())
+        return self._parameters_hash[1]
+
+    def _read_output_manifest(self):
+        if getattr(self, 'subject', None) is None or self.parameters is None:
+            return None
+        return self.output_manifest().read(self.parameters_hash(),
+                                           self.study.file_index.mtime)
+
+    def _file_directories(self):
+        ''' directories of the files of the subject in the study output
+        directory
+        '''
+        prefix = os.path.join(os.path.normpath(self.study.output_directory),
+                              '')
+        directories = set()
+        todo = [self.parameters]
+        while todo:
+            value = todo.pop()
+            if isinstance(value, six.string_types):
+                if value.startswith(prefix):
+                    directories.add(os.path.dirname(value))
+            elif isinstance(value, dict):
+                todo += list(value.values())
+            elif isinstance(value, (list, tuple)):
+                todo += list(value)
+        return directories
+
+    def _results_by_step(self):
+        ''' step_id -> existing output files of the step '''
+        self.propagate_parameters()
+        pipeline = self.pipeline
+        pipeline.enable_all_pipeline_steps()
+        outputs = nodes_with_existing_outputs(
+            pipeline, exists=self.study.file_index.exists)
+        inputs = set()
+        for param_name, trait in six.iteritems(pipeline.user_traits()):
+            if not trait.output:
+                value = getattr(pipeline, param_name)
+                if isinstance(value, six.string_types):
+                    inputs.add(value)
+        node_steps = {}
+        results = {}
+        for step_id, trait \
+                in six.iteritems(pipeline.pipeline_steps.user_traits()):
+            results[step_id] = set()
+            for node_name in trait.nodes:
+                node_steps.setdefault(node_name, []).append(step_id)
+        for node_name, item_list in six.iteritems(outputs):
+            for step_id in node_steps.get(node_name.split('.')[0], []):
+                results[step_id].update(
+                    [filename for param, filename in item_list
+                     if filename not in inputs])
+        return results
+
+    def write_output_manifest(self, step_ids=(), checksums=False):
+        directories = self._file_directories()
+        # the files have just been written: the index may not know them
+        for directory in directories:
+            self.study.file_index.invalidate(directory)
+        results = self._results_by_step()
+        complete_steps = [step_id for step_id in results
+                          if self._has_all_results([step_id])]
+        self.output_manifest().write(
+            results, complete_steps, self._has_all_results(),
+            self.parameters_hash(), directories, step_ids, checksums)
+
+
 class ImportationError(Exception):
     pass
 
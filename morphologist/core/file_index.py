@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import time
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+
+class FileSystemIndex(object):
+    '''
+    Answers the "does this file exist" questions of a whole study from
+    listings of the directories, rather than with a stat per file: each
+    directory is listed once (with os.scandir), and listed again only when
+    its modification time has changed.
+
+    The modification time of a directory is checked at most once every
+    validity seconds, so that the many queries of a study-wide check (the
+    results of all the subjects, for instance) cost one stat per directory.
+
+    Parameters
+    ----------
+    validity: float
+        duration (in seconds) during which a directory listing is used
+        without checking the modification time of the directory
+    '''
+    # modification times of some file systems (NFS...) have a resolution of
+    # a second: a directory modified in the second of its listing may have
+    # changed unnoticed
+    MTIME_RESOLUTION = 1.
+
+    def __init__(self, validity=1.):
+        self.validity = validity
+        # directory -> (names, mtime, listing time, check time), names is
+        # None if the directory does not exist
+        self._directories = {}
+        self._lock = threading.Lock()
+
+    def exists(self, path):
+        ''' os.path.exists equivalent '''
+        if not path:
+            return False
+        path = os.path.normpath(os.path.abspath(path))
+        directory, name = os.path.split(path)
+        if not name:
+            # root directory
+            return os.path.exists(path)
+        names = self._names(directory)
+        return names is not None and name in names
+
+    def invalidate(self, directory=None):
+        ''' forget the listing of the directory and of its subdirectories,
+        or of all the directories
+        '''
+        with self._lock:
+            if directory is None:
+                self._directories = {}
+                return
+            directory = os.path.normpath(os.path.abspath(directory))
+            prefix = os.path.join(directory, '')
+            for cached in list(self._directories):
+                if cached == directory or cached.startswith(prefix):
+                    del self._directories[cached]
+
+    def mtime(self, directory):
+        ''' modification time of the directory, None if it does not exist '''
+        directory = os.path.normpath(os.path.abspath(directory))
+        return self._entry(directory)[1]
+
+    def _names(self, directory):
+        return self._entry(directory)[0]
+
+    def _entry(self, directory):
+        now = time.time()
+        with self._lock:
+            cached = self._directories.get(directory)
+        if cached is not None:
+            names, mtime, listing_time, check_time = cached
+            if now - check_time < self.validity:
+                return cached
+            if mtime is not None \
+                    and mtime < listing_time - self.MTIME_RESOLUTION \
+                    and self._mtime(directory) == mtime:
+                cached = (names, mtime, listing_time, now)
+                with self._lock:
+                    self._directories[directory] = cached
+                return cached
+        mtime = self._mtime(directory)
+        names = self._list(directory) if mtime is not None else None
+        cached = (names, mtime, now, now)
+        with self._lock:
+            self._directories[directory] = cached
+        return cached
+
+    @staticmethod
+    def _mtime(directory):
+        try:
+            return os.stat(directory).st_mtime
+        except OSError:
+            return None
+
+    @staticmethod
+    def _list(directory):
+        try:
+            if scandir is None:
+                return frozenset(os.listdir(directory))
+            return frozenset([entry.name for entry in scandir(directory)])
+        except OSError:
+            return None
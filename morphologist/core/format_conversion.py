@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import os
+import json
+import shutil
+
+import numpy
+from soma import aims
+
+from morphologist.core.utils import create_process_pool
+
+
+# TODO: use aims/somaio IO system for formats extensions
+FORMATS_EXTENSIONS = [['.nii'], ['.nii.gz'], ['.img', '.hdr'],
+                      ['.ima', '.dim'], ['.dcm'], ['.mnc'],
+                      ['.gii'], ['.mesh'], ['.ply']]
+VOLUMES_FORMATS = ['.nii', '.nii.gz', '.img', '.ima', '.dcm', '.mnc']
+MESHES_FORMATS = ['.gii', '.mesh', '.ply']
+
+
+class FormatConversionError(Exception):
+    pass
+
+
+def remove_data(name):
+    ''' remove the files of the data of filename name (header, .minf...) '''
+    for fexts in FORMATS_EXTENSIONS:
+        for ext in fexts:
+            if name.endswith(ext):
+                basename = name[:-len(ext)]
+                real_exts = fexts + [fexts[0] + '.minf']
+                for cext in real_exts:
+                    filename = basename + cext
+                    if os.path.isdir(filename):
+                        print('rmtree', filename)
+                        shutil.rmtree(filename)
+                    elif os.path.exists(filename):
+                        print('rm', filename)
+                        os.unlink(filename)
+
+
+def _same_data(data, other):
+    ''' compare the voxels of volumes, and the vertices and polygons of the
+    time steps of meshes. Other types of data (textures, buckets...) are
+    not compared: they are considered the same.
+    '''
+    if hasattr(data, 'getSize'):
+        # volume
+        return numpy.array_equal(numpy.asarray(data), numpy.asarray(other))
+    if hasattr(data, 'vertex') and hasattr(data, 'polygon'):
+        # mesh: vertices may be written with a lower precision
+        if data.size() != other.size():
+            return False
+        for t in range(data.size()):
+            vertices = numpy.asarray(data.vertex(t))
+            other_vertices = numpy.asarray(other.vertex(t))
+            if vertices.shape != other_vertices.shape \
+                    or not numpy.allclose(vertices, other_vertices,
+                                          rtol=1e-5, atol=1e-5) \
+                    or not numpy.array_equal(numpy.asarray(data.polygon(t)),
+                                             numpy.asarray(other.polygon(t))):
+                return False
+        return True
+    return True
+
+
+def convert_data(old_name, new_name):
+    ''' convert the data of old_name into new_name, and check the written
+    data by reading it back
+    '''
+    print('converting:', old_name, 'to:', new_name)
+    data = aims.read(old_name)
+    aims.write(data, new_name)
+    if not _same_data(data, aims.read(new_name)):
+        raise FormatConversionError('%s differs from %s after conversion'
+                                    % (new_name, old_name))
+
+
+class FormatConverter(object):
+    '''
+    Convert the data files of a study to new formats.
+
+    The conversions are spread over a pool of processes. The original files
+    are only removed once all the converted files have been written and
+    checked, so that a study never ends up with mixed formats.
+
+    The conversions to do are first written in a journal in the study
+    output directory, followed by the conversions done as they complete: an
+    interrupted conversion resumes where it stopped (see resume), or is
+    rolled back while the original files are all there (see rollback), and
+    the journal is removed once the original files are removed.
+
+    Parameters
+    ----------
+    journal_filename: str
+    processes_n: int
+        number of conversion processes
+    '''
+    JOURNAL_FILENAME = '.format_conversion.journal'
+
+    def __init__(self, journal_filename, processes_n=1):
+        self.journal_filename = journal_filename
+        self.processes_n = processes_n
+
+    @classmethod
+    def from_directory(cls, directory, processes_n=1):
+        return cls(os.path.join(directory, cls.JOURNAL_FILENAME),
+                   processes_n)
+
+    def has_pending_conversion(self):
+        return os.path.exists(self.journal_filename)
+
+    def pending_formats(self):
+        ''' formats given to convert for the pending conversion (None if
+        there were none)
+        '''
+        with open(self.journal_filename) as f:
+            return json.loads(f.readline()).get('formats')
+
+    def convert(self, conversions, progress_callback=None, formats=None):
+        '''
+        Parameters
+        ----------
+        conversions: list
+            (old_name, new_name) filenames, new_name is None when old_name
+            should only be removed
+        progress_callback: function
+            called with the progress, from 0 to 1
+        formats: list
+            new formats of the data, written in the journal (see
+            pending_formats)
+        '''
+        planned = set()
+        unique_conversions = []
+        for old_name, new_name in conversions:
+            if old_name not in planned:
+                planned.add(old_name)
+                unique_conversions.append([old_name, new_name])
+        if not unique_conversions:
+            return
+        tmp_filename = self.journal_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(json.dumps({'conversions': unique_conversions,
+                                'formats': formats}) + '\n')
+        os.rename(tmp_filename, self.journal_filename)
+        self._run(unique_conversions, set(), progress_callback)
+
+    def resume(self, progress_callback=None):
+        ''' finish the conversion of the journal, if any '''
+        if not self.has_pending_conversion():
+            return
+        conversions, done = self._read_journal()
+        print('resuming an interrupted format conversion:',
+              len(done), 'of', len(conversions), 'files converted')
+        self._run(conversions, done, progress_callback)
+
+    def can_rollback(self):
+        ''' the original files of the pending conversion are all there '''
+        conversions, _ = self._read_journal()
+        return not [old_name for old_name, new_name in conversions
+                    if not os.path.exists(old_name)]
+
+    def rollback(self):
+        ''' cancel the pending conversion, if any: remove the files it has
+        converted, and keep the original ones
+        '''
+        if not self.has_pending_conversion():
+            return
+        conversions, done = self._read_journal()
+        print('cancelling an interrupted format conversion:',
+              len(done), 'of', len(conversions), 'files converted')
+        old_names = set([old_name for old_name, new_name in conversions])
+        # the files being converted when interrupted are removed too
+        for old_name, new_name in conversions:
+            if new_name is not None and new_name not in old_names:
+                remove_data(new_name)
+        os.unlink(self.journal_filename)
+
+    def _read_journal(self):
+        with open(self.journal_filename) as f:
+            conversions = json.loads(f.readline())['conversions']
+            done = set()
+            for line in f:
+                try:
+                    done.add(json.loads(line)['converted'])
+                except ValueError:
+                    # last line, written partially
+                    break
+        return conversions, done
+
+    def _run(self, conversions, done, progress_callback):
+        todo = [(index, old_name, new_name)
+                for index, (old_name, new_name) in enumerate(conversions)
+                if new_name is not None and index not in done]
+        if progress_callback:
+            progress_callback(0.)
+        errors = []
+        with open(self.journal_filename, 'a') as journal:
+            for n, (index, error) in enumerate(self._convert(todo)):
+                if error is None:
+                    journal.write(json.dumps({'converted': index}) + '\n')
+                    journal.flush()
+                else:
+                    errors.append('%s: %s' % (conversions[index][0], error))
+                if progress_callback:
+                    progress_callback((n + 1.) / (len(todo) + 1))
+        if errors:
+            # the original files are kept, the conversion of the failed
+            # files will be tried again when resuming
+            raise FormatConversionError(
+                'some files could not be converted:\n' + '\n'.join(errors))
+        new_names = set([new_name for old_name, new_name in conversions])
+        for old_name, new_name in conversions:
+            if old_name not in new_names:
+                remove_data(old_name)
+        os.unlink(self.journal_filename)
+        if progress_callback:
+            progress_callback(1.)
+
+    def _convert(self, todo):
+        processes_n = min(self.processes_n, len(todo))
+        if processes_n <= 1:
+            for args in todo:
+                yield _convert_data(args)
+            return
+        pool = create_process_pool(processes_n)
+        try:
+            for result in pool.imap_unordered(_convert_data, todo):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+
+def _convert_data(args):
+    index, old_name, new_name = args
+    try:
+        convert_data(old_name, new_name)
+    except Exception as e:
+        # exceptions may not be picklable
+        return index, '%s: %s' % (e.__class__.__name__, e)
+    return index, None
@@ -92,8 +92,19 @@ class RunnerView(QtGui.QWidget):
     @QtCore.Slot()
     def on_stop_button_clicked(self):
         assert(self._runner_model is not None)
-        self._runner_model.runner.stop()
-        self._set_not_running_state()
+        runner = self._runner_model.runner
+        selected_subject_ids = self._runner_model.get_selected_subject_ids()
+        if selected_subject_ids == ALL_SUBJECTS:
+            runner.stop()
+        else:
+            # the other subjects keep running
+            for subject_id in selected_subject_ids:
+                if runner.is_running(subject_id):
+                    runner.stop(subject_id)
+        if runner.is_running():
+            self._set_running_state()
+        else:
+            self._set_not_running_state()
 
     def install_spam_models(self):
         print('install_spam_models')
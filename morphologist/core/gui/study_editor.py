@@ -4,10 +4,10 @@ from collections import namedtuple
 import copy
 import six
 
-from morphologist.core.analysis import ImportationError
 from morphologist.core.utils.design_patterns import Observable, \
                                             ObserverNotification
 from morphologist.core.study import Study
+from morphologist.core.importation import create_subjects_importer
 
 
 class StudyEditor(object):
@@ -206,15 +206,12 @@ class SubjectsEditor(Observable):
 
         added_subjects = self._added_subjects()
         self._notify_start_importation(added_subjects)
-        for subject in added_subjects:
-            self._notify_start_subject_importation(subject)
-            try:
-                study.add_subject(subject)
-            except ImportationError as e:
-                status_ok = False
-            else:
-                status_ok = True
-            self._notify_end_subject_importation(subject, status_ok)
+        study.add_subjects(added_subjects, import_data=False)
+        # subjects whose importation fails are removed from the study
+        importer = create_subjects_importer(study, len(added_subjects))
+        importer.import_subjects(added_subjects,
+                                 self._notify_start_subject_importation,
+                                 self._notify_end_subject_importation)
         self._notify_end_importation()
 
     def _notify_start_importation(self, added_subjects):
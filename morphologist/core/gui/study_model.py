@@ -17,6 +17,9 @@ class LazyStudyModel(QtCore.QObject):
                    FAILED : 'failed at %s', NO_RESULTS : 'no output files',
                    ALL_RESULTS : 'output files exist', 
                    SOME_RESULTS : 'some output files exist'}
+    # number of subjects whose output files are checked at each update, in
+    # turn (see _update_all_status)
+    OUTPUT_FILES_CHECKS_PER_UPDATE = 32
     changed = QtCore.pyqtSignal()
     status_changed = QtCore.pyqtSignal()
     runner_status_changed = QtCore.pyqtSignal(bool)
@@ -46,7 +49,8 @@ class LazyStudyModel(QtCore.QObject):
             self._are_selected_subjects.append(False)
         self.set_current_subject_index(0)
         self._runner_is_running = False
-        self._update_all_status()
+        self._next_output_files_check = 0
+        self._update_status(check_all_output_files=True)
     
     def set_study_and_runner(self, study, runner):
         self._init_study_and_runner(study, runner)
@@ -127,17 +131,37 @@ class LazyStudyModel(QtCore.QObject):
 
     @QtCore.Slot()
     def _update_all_status(self):
+        self._update_status()
+
+    def _update_status(self, check_all_output_files=False):
+        '''
+        The runner status of all the subjects is updated, but checking the
+        output files of a subject requires its analysis: only the current
+        subject, the subjects whose jobs have ended, and a few other ones in
+        turn are checked, unless check_all_output_files is set.
+        '''
         has_changed = False
         new_runner_status = self.runner.is_running()
         if new_runner_status != self._runner_is_running:
             self._runner_is_running = new_runner_status
             self.runner_status_changed.emit(self._runner_is_running)
-        for row_index, _ in enumerate(self._subjects_row_index_to_id):
-            has_changed |= self._update_subject_status(row_index) 
+        subjects_n = len(self._subjects_row_index_to_id)
+        checks_n = self.OUTPUT_FILES_CHECKS_PER_UPDATE
+        if check_all_output_files or subjects_n <= checks_n:
+            checked_rows = set(range(subjects_n))
+        else:
+            checked_rows = set([(self._next_output_files_check + i)
+                                % subjects_n for i in range(checks_n)])
+            self._next_output_files_check \
+                = (self._next_output_files_check + checks_n) % subjects_n
+            checked_rows.add(self._current_subject_index)
+        for row_index in range(subjects_n):
+            has_changed |= self._update_subject_status(
+                row_index, row_index in checked_rows)
         if has_changed:
             self.status_changed.emit()
 
-    def _update_subject_status(self, row_index):
+    def _update_subject_status(self, row_index, check_output_files=True):
         has_changed = False
         subject_id = self._subjects_row_index_to_id[row_index]
         if self.runner.is_running(subject_id, update_status=False):
@@ -152,7 +176,8 @@ class LazyStudyModel(QtCore.QObject):
             step_id = step_ids[0]
             status = (self.FAILED, step_id)
             has_changed = self._update_subject_status_if_needed(row_index, status)
-        else:
+        elif check_output_files or self._status[row_index][0] \
+                in (self.DEFAULT_STATUS, self.RUNNING, self.FAILED):
             has_changed = self._update_subject_output_files_status_if_needed(row_index)
         return has_changed
 
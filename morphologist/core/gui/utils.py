@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from soma.qt_gui.qtThread import QtThreadCall
+
+from morphologist.core.gui.qt_backend import QtCore
+
+
+class FuncQThread(QtCore.QThread):
+
+    def __init__(self, func, args=(), kwargs={}):
+        super(FuncQThread, self).__init__()
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self.res = None
+
+    def run(self):
+        try:
+            self.res = self._func(*self._args, **self._kwargs)
+        except Exception as e:
+            # print('Exception:', e)
+            import traceback
+            traceback.print_exc()
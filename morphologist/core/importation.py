@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import importlib
+import traceback
+
+from morphologist.core.analysis import ImportationError
+from morphologist.core.settings import settings
+from morphologist.core.utils import create_process_pool
+
+
+class SubjectsImporter(object):
+    '''
+    Import the data of subjects already added to a study (see
+    Study.add_subjects), one after the other.
+
+    Subjects whose importation fails are removed from the study, as
+    Study.add_subject does.
+    '''
+
+    def __init__(self, study):
+        self._study = study
+
+    def import_subjects(self, subjects, start_callback=None,
+                        end_callback=None):
+        '''
+        Parameters
+        ----------
+        subjects: list
+        start_callback: function
+            called with the subject before its importation
+        end_callback: function
+            called with the subject and the success of its importation
+
+        Returns
+        -------
+        failed: list
+            subjects whose importation has failed
+        '''
+        failed = []
+        for subject, error in self._import(subjects, start_callback):
+            if error is None:
+                status_ok = True
+            else:
+                print('importation of %s failed:' % subject.id(), error)
+                self._remove_subject(subject)
+                failed.append(subject)
+                status_ok = False
+            if end_callback:
+                end_callback(subject, status_ok)
+        return failed
+
+    def _import(self, subjects, start_callback):
+        ''' yields (subject, error) in the subjects order, once each
+        subject is imported
+        '''
+        for subject in subjects:
+            if start_callback:
+                start_callback(subject)
+            analysis = self._study.analyses[subject.id()]
+            try:
+                analysis.propagate_parameters()
+                subject.filename = analysis.import_data(subject)
+            except Exception as e:
+                yield subject, '%s: %s' % (e.__class__.__name__, e)
+            else:
+                yield subject, None
+
+    def _remove_subject(self, subject):
+        self._study.remove_subject_from_id(subject.id())
+
+
+class ParallelSubjectsImporter(SubjectsImporter):
+    '''
+    Import the data of subjects in a pool of worker processes.
+
+    Each worker loads its own copy of the study once, as the workflow
+    builders do. Workers are not forked from the calling process (see
+    utils.create_process_pool), which may be the GUI. The number of processes bounds the number of images read
+    and written at the same time. Callbacks are still called in the
+    subjects order, from the calling thread.
+    '''
+
+    def __init__(self, study, processes_n):
+        super(ParallelSubjectsImporter, self).__init__(study)
+        self._processes_n = processes_n
+
+    def _import(self, subjects, start_callback):
+        subjects = list(subjects)
+        study = self._study
+        initargs = (study.analysis_cls().__module__, study.serialize(),
+                    study.output_directory)
+        pool = create_process_pool(self._processes_n,
+                                   initializer=_init_importer_process,
+                                   initargs=initargs)
+        try:
+            results = pool.imap(_import_subject_data,
+                                [subject.id() for subject in subjects])
+            for subject in subjects:
+                if start_callback:
+                    start_callback(subject)
+                filename, error = next(results)
+                if error is None:
+                    subject.filename = filename
+                yield subject, error
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+
+# below this number of subjects per process, the cost of loading the study
+# in the workers is not worth it
+MIN_SUBJECTS_PER_PROCESS = 4
+
+
+def create_subjects_importer(study, subjects_n):
+    ''' Create the importer suited to import subjects_n subjects, according
+    to the study editor settings.
+    '''
+    processes_n = settings.study_editor.importers_n
+    if processes_n.is_auto:
+        processes_n = min(processes_n, subjects_n // MIN_SUBJECTS_PER_PROCESS)
+    if processes_n > 1:
+        return ParallelSubjectsImporter(study, processes_n)
+    return SubjectsImporter(study)
+
+
+def import_subjects(study, subjects, start_callback=None, end_callback=None):
+    ''' import the data of subjects already added to the study, and raise an
+    ImportationError if some of them failed (they are removed from the
+    study)
+    '''
+    subjects = list(subjects)
+    importer = create_subjects_importer(study, len(subjects))
+    failed = importer.import_subjects(subjects, start_callback, end_callback)
+    if failed:
+        raise ImportationError(
+            "Importation failed for the following subjects: %s."
+            % ', '.join([str(subject) for subject in failed]))
+
+
+_importer_study = None
+
+
+def _init_importer_process(analysis_module, serialized_study,
+                           output_directory):
+    global _importer_study
+    # registers the analysis class in the AnalysisFactory
+    importlib.import_module(analysis_module)
+    from morphologist.core.study import Study
+    _importer_study = Study.unserialize(serialized_study, output_directory)
+
+
+def _import_subject_data(subject_id):
+    try:
+        analysis = _importer_study.analyses[subject_id]
+        analysis.propagate_parameters()
+        filename = analysis.import_data(_importer_study.subjects[subject_id])
+    except Exception as e:
+        # exceptions may not be picklable: the parent process only gets a
+        # message
+        traceback.print_exc()
+        return None, '%s: %s' % (e.__class__.__name__, e)
+    return filename, None
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+Run the commands of several jobs fused into a single one (see
+scheduling.fuse_short_jobs), one after the other::
+
+    python -m morphologist.core.job_chain SEPARATOR cmd1... SEPARATOR cmd2...
+
+The chain stops at the first failing command, and exits with its code.
+
+The jobs using an input parameters file (capsul jobs) get theirs from the
+input parameters file of the chain (see chain_parameters), through the
+SOMAWF_INPUT_PARAMS environment variable, as soma-workflow does.
+'''
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+
+JOB_CHAIN_SEPARATOR = '--morphologist-next-job--'
+# parameter of the chain listing the indices of the jobs which use an input
+# parameters file
+CHAIN_INPUTS_PARAMETER = 'morphologist_job_chain_inputs'
+
+
+def chain_command(commands, python_command=None):
+    ''' command of a job running the given commands one after the other,
+    with the given python command (the current one by default)
+    '''
+    command = [python_command or sys.executable or 'python', '-m',
+               'morphologist.core.job_chain']
+    for job_command in commands:
+        command += [JOB_CHAIN_SEPARATOR] + list(job_command)
+    return command
+
+
+def chain_parameters(jobs_parameters):
+    '''
+    param_dict of a job chain, from the param_dict of its jobs, or None for
+    the jobs which do not use an input parameters file. The parameters of
+    the jobs are prefixed by their index in the chain, and keep their
+    values, so that the paths they contain are translated as usual.
+    '''
+    parameters = {}
+    indices = []
+    for index, job_parameters in enumerate(jobs_parameters):
+        if job_parameters is None:
+            continue
+        indices.append(index)
+        for name, value in job_parameters.items():
+            parameters['%d:%s' % (index, name)] = value
+    parameters[CHAIN_INPUTS_PARAMETER] = indices
+    return parameters
+
+
+def split_parameters(chain_params_conf):
+    ''' index -> input parameters file content of the jobs of a chain, from
+    the content of the chain input parameters file (see chain_parameters)
+    '''
+    parameters = chain_params_conf.get('parameters', {})
+    jobs_params_conf = {}
+    for index in parameters.get(CHAIN_INPUTS_PARAMETER, []):
+        params_conf = dict([(key, value)
+                            for key, value in chain_params_conf.items()
+                            if key != 'parameters'])
+        params_conf['parameters'] = {}
+        jobs_params_conf[index] = params_conf
+    for key, value in parameters.items():
+        if key == CHAIN_INPUTS_PARAMETER:
+            continue
+        index, name = key.split(':', 1)
+        jobs_params_conf[int(index)]['parameters'][name] = value
+    return jobs_params_conf
+
+
+def split_commands(args):
+    commands = []
+    for arg in args:
+        if arg == JOB_CHAIN_SEPARATOR:
+            commands.append([])
+        elif commands:
+            commands[-1].append(arg)
+        else:
+            raise ValueError('the commands chain must start with %s'
+                             % JOB_CHAIN_SEPARATOR)
+    return [command for command in commands if command]
+
+
+def main(argv):
+    jobs_params_conf = {}
+    params_file = os.environ.get('SOMAWF_INPUT_PARAMS')
+    if params_file:
+        with open(params_file) as f:
+            jobs_params_conf = split_parameters(json.load(f))
+    tmp_directory = tempfile.mkdtemp(prefix='morphologist_job_chain_')
+    try:
+        for index, command in enumerate(split_commands(argv[1:])):
+            env = dict(os.environ)
+            # the output parameters of the jobs of a chain are not used
+            env.pop('SOMAWF_OUTPUT_PARAMS', None)
+            env.pop('SOMAWF_INPUT_PARAMS', None)
+            if index in jobs_params_conf:
+                job_params_file = os.path.join(
+                    tmp_directory, 'job_%d_input_params.json' % index)
+                with open(job_params_file, 'w') as f:
+                    json.dump(jobs_params_conf[index], f)
+                env['SOMAWF_INPUT_PARAMS'] = job_params_file
+            sys.stdout.flush()
+            returncode = subprocess.call(command, env=env)
+            if returncode != 0:
+                print('job chain: command failed with code %d: %s'
+                      % (returncode, ' '.join(command)), file=sys.stderr)
+                return returncode
+    finally:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import six
+
+
+class JobsStatusTable(object):
+    '''
+    Table of the jobs status of a runner, updated incrementally.
+
+    Each job is registered with the subject and the step it belongs to (or
+    the steps, for a job fusing the jobs of several steps). The table keeps,
+    for each subject and each (subject, step), the number of jobs in every
+    status, so that status queries do not need to go through all the jobs
+    of the workflow.
+
+    :meth:`sync` takes the raw jobs states as returned by the execution
+    backend and only decodes and applies the jobs whose raw state has
+    changed since the previous sync.
+    '''
+
+    class _JobEntry(object):
+        __slots__ = ('subject_id', 'step_ids', 'status', 'raw_state')
+
+        def __init__(self, subject_id, step_ids, status):
+            self.subject_id = subject_id
+            self.step_ids = step_ids
+            self.status = status
+            self.raw_state = None
+
+    def __init__(self, initial_status=0):
+        self._initial_status = initial_status
+        self.clear()
+
+    def clear(self):
+        self._jobs = {}             # job_id -> _JobEntry
+        self._subject_steps = {}    # subject_id -> (step_id -> set(job_id))
+        self._counts = {}           # status -> count
+        self._subject_counts = {}   # subject_id -> (status -> count)
+        self._step_counts = {}      # (subject_id, step_id) -> (status -> count)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def add_job(self, job_id, subject_id, step_id, status=None):
+        ''' step_id may be a tuple of step ids, for a job covering several
+        steps: the job then counts in each of them.
+        '''
+        if job_id in self._jobs:
+            self.remove_job(job_id)
+        if status is None:
+            status = self._initial_status
+        if isinstance(step_id, (tuple, list)):
+            step_ids = []
+            for sid in step_id:
+                if sid not in step_ids:
+                    step_ids.append(sid)
+            step_ids = tuple(step_ids)
+        else:
+            step_ids = (step_id, )
+        entry = self._JobEntry(subject_id, step_ids, status)
+        self._jobs[job_id] = entry
+        steps = self._subject_steps.setdefault(subject_id, {})
+        for step_id in step_ids:
+            steps.setdefault(step_id, set()).add(job_id)
+        self._increment(entry, status, 1)
+
+    def remove_job(self, job_id):
+        entry = self._jobs.pop(job_id)
+        self._increment(entry, entry.status, -1)
+        steps = self._subject_steps[entry.subject_id]
+        for step_id in entry.step_ids:
+            step_jobs = steps[step_id]
+            step_jobs.discard(job_id)
+            if not step_jobs:
+                del steps[step_id]
+        if not steps:
+            del self._subject_steps[entry.subject_id]
+
+    def remove_subject(self, subject_id):
+        for job_id in list(self.job_ids(subject_id)):
+            self.remove_job(job_id)
+
+    def subject_ids(self):
+        return list(self._subject_steps.keys())
+
+    def step_ids(self, subject_id, status_mask=None):
+        ''' step ids of the given subject. If status_mask is given, only
+        steps having at least one job with a status matching the mask are
+        returned.
+        '''
+        steps = self._subject_steps.get(subject_id, {})
+        if status_mask is None:
+            return list(steps.keys())
+        step_ids = []
+        for step_id in steps:
+            if self.has_status(status_mask, subject_id, step_id):
+                step_ids.append(step_id)
+        return step_ids
+
+    def job_ids(self, subject_id=None, step_id=None):
+        if subject_id is None:
+            return set(self._jobs.keys())
+        steps = self._subject_steps.get(subject_id, {})
+        if step_id is None:
+            job_ids = set()
+            for step_jobs in six.itervalues(steps):
+                job_ids.update(step_jobs)
+            return job_ids
+        return set(steps.get(step_id, ()))
+
+    def job_step(self, job_id):
+        ''' (subject_id, step_id) of a job, the first of its steps if it
+        covers several steps (see job_step_ids)
+        '''
+        entry = self._jobs[job_id]
+        return entry.subject_id, entry.step_ids[0]
+
+    def job_step_ids(self, job_id):
+        ''' (subject_id, tuple of step ids) of a job '''
+        entry = self._jobs[job_id]
+        return entry.subject_id, entry.step_ids
+
+    def job_status(self, job_id):
+        return self._jobs[job_id].status
+
+    def set_job_status(self, job_id, status):
+        ''' Force the status of a job. Returns True if it has changed. '''
+        entry = self._jobs[job_id]
+        if entry.status == status:
+            return False
+        self._increment(entry, entry.status, -1)
+        entry.status = status
+        self._increment(entry, status, 1)
+        return True
+
+    def forget_raw_state(self, job_id):
+        ''' the next raw state of the job will be applied, even if it is the
+        same as the previous one (when the job is run again)
+        '''
+        self._jobs[job_id].raw_state = None
+
+    def sync(self, raw_states, decode_status):
+        '''
+        Apply the jobs raw states.
+
+        Parameters
+        ----------
+        raw_states: iterable
+            (job_id, raw_state) pairs. raw_state must be comparable, and is
+            passed to decode_status only if it differs from the previous
+            one of the same job. Unregistered jobs are ignored.
+        decode_status: function
+            raw_state -> status
+
+        Returns
+        -------
+        changes: list
+            (job_id, old_status, new_status) for jobs which status has
+            changed.
+        '''
+        changes = []
+        for job_id, raw_state in raw_states:
+            entry = self._jobs.get(job_id)
+            if entry is None or entry.raw_state == raw_state:
+                continue
+            entry.raw_state = raw_state
+            status = decode_status(raw_state)
+            if status != entry.status:
+                old_status = entry.status
+                self._increment(entry, old_status, -1)
+                entry.status = status
+                self._increment(entry, status, 1)
+                changes.append((job_id, old_status, status))
+        return changes
+
+    def counts(self, subject_id=None, step_id=None):
+        ''' status -> number of jobs, only for non-empty statuses '''
+        if subject_id is None:
+            counts = self._counts
+        elif step_id is None:
+            counts = self._subject_counts.get(subject_id, {})
+        else:
+            counts = self._step_counts.get((subject_id, step_id), {})
+        return dict(counts)
+
+    def has_jobs(self, subject_id=None, step_id=None):
+        if subject_id is None:
+            return len(self._jobs) != 0
+        steps = self._subject_steps.get(subject_id)
+        if not steps:
+            return False
+        return step_id is None or step_id in steps
+
+    def has_status(self, status_mask, subject_id=None, step_id=None):
+        if subject_id is None:
+            counts = self._counts
+        elif step_id is None:
+            counts = self._subject_counts.get(subject_id, {})
+        else:
+            counts = self._step_counts.get((subject_id, step_id), {})
+        for status in counts:
+            if status & status_mask:
+                return True
+        return False
+
+    def _increment(self, entry, status, value):
+        step_keys = [(entry.subject_id, step_id)
+                     for step_id in entry.step_ids]
+        for counts in [self._counts,
+                       self._subject_counts.setdefault(entry.subject_id, {})] \
+                + [self._step_counts.setdefault(step_key, {})
+                   for step_key in step_keys]:
+            count = counts.get(status, 0) + value
+            if count == 0:
+                del counts[status]
+            else:
+                counts[status] = count
+        if not self._subject_counts[entry.subject_id]:
+            del self._subject_counts[entry.subject_id]
+        for step_key in step_keys:
+            if not self._step_counts[step_key]:
+                del self._step_counts[step_key]
@@ -0,0 +1,773 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import os
+import sys
+import math
+import json
+import time
+import heapq
+import shutil
+import tempfile
+import itertools
+import threading
+import subprocess
+import six
+
+from concurrent.futures import ThreadPoolExecutor
+from soma_workflow.client import Job, BarrierJob, TemporaryPath, \
+    FileTransfer
+
+from morphologist.core.runner import Runner, WorkflowRunner
+from morphologist.core.constants import ALL_SUBJECTS
+from morphologist.core.scheduling import group_jobs, job_step_ids
+from morphologist.core.speculation import StragglerDetector, \
+    SpeculativeOutputs
+from morphologist.core.settings import settings
+
+
+class _SpeculativeCopy(object):
+    ''' speculative copy of a straggling job (see LocalPoolRunner) '''
+
+    def __init__(self, outputs, loads):
+        self.outputs = outputs
+        self.loads = loads
+        self.process = None
+        self.runtime = None
+        # the copy is over and successful: it wins
+        self.succeeded = False
+        # the original job is over first: the copy is useless
+        self.lost = False
+
+
+class LocalPoolRunner(WorkflowRunner):
+    '''
+    Runner executing the workflow on the local machine, without any
+    soma-workflow controller, database or scheduler.
+
+    The workflow built by capsul is walked directly: each job is run as a
+    subprocess as soon as its dependencies are done, and ready jobs are
+    started by decreasing priority.
+
+    Jobs are admitted according to the resources declared for their step
+    (see Analysis.get_step_resources): the sum of the CPU weights of the
+    running jobs may not exceed _cpus_number(), and the sum of their memory
+    may not exceed the memory budget of the settings. A job exceeding the
+    budget alone is run when no other job is running. Lower priority jobs
+    which fit in the remaining resources may be started before a job
+    waiting for resources (backfilling), until this job has been overtaken
+    MAX_BACKFILL_SKIPS times: the resources freed are then kept for it.
+
+    When the straggler_percentile setting is set, a job running longer than
+    this percentile of the past durations of its steps gets a speculative
+    copy, run when resources are available, and the first of both to finish
+    wins. The copy writes its outputs in a staging directory (see
+    SpeculativeOutputs), which are moved in place only if it wins.
+    '''
+    BACKEND = 'local_pool'
+    _workflow_counter = itertools.count(1)
+    # cpu weights are at least this value, which bounds the number of
+    # running jobs
+    MIN_CPU_WEIGHT = 0.25
+    # maximum number of waiting jobs skipped to find a job fitting in the
+    # free resources
+    BACKFILL_DEPTH = 32
+    # number of times a waiting job may be overtaken by lower priority jobs,
+    # before the free resources are reserved for it
+    MAX_BACKFILL_SKIPS = 8
+    # delay (in seconds) before checking again a straggling job which could
+    # not be copied for lack of resources
+    SPECULATION_RECHECK_DELAY = 30.
+    # delay (in seconds) between checks of a running process, when the
+    # system cannot wait for it without reaping it
+    PROCESS_POLL_DELAY = 0.2
+
+    def __init__(self, study):
+        super(LocalPoolRunner, self).__init__(study)
+        self._executor = None
+
+    def _init_internal_parameters(self):
+        super(LocalPoolRunner, self)._init_internal_parameters()
+        self._condition = threading.Condition(threading.RLock())
+        self._job_counter = itertools.count()
+        self._jobs = {}             # job_id -> Job
+        self._param_links = {}      # Job -> (param -> [(Job, param)])
+        self._dependencies = {}     # job_id -> set(job_id) (upstream)
+        self._dependents = {}       # job_id -> set(job_id) (downstream)
+        self._states = {}           # job_id -> status
+        self._changed_states = {}   # job_id -> status, not synced yet
+        self._ready = []            # heap of (-priority, job_id)
+        self._processes = {}        # job_id -> Popen
+        self._runtimes = {}         # job_id -> (wall_time, cpu_time, peak_rss)
+        self._job_loads = {}        # job_id -> (cpu_weight, memory)
+        self._backfill_skips = {}   # job_id -> times overtaken, waiting
+        self._running_n = 0
+        self._max_running_n = 1     # cpus
+        self._used_cpus = 0.
+        self._memory_budget = 0
+        self._used_memory = 0
+        self._stopping = False
+        self._stopped_job_ids = set()
+        self._retry_timers = {}     # job_id -> Timer, for jobs to retry
+        self._straggler_detector = None
+        self._straggler_timers = {} # job_id -> Timer, for running jobs
+        self._start_times = {}      # job_id -> start time of the process
+        self._copies = {}           # job_id -> _SpeculativeCopy
+        self._temporary_paths = {}
+        self._tmp_directory = None
+
+    def run(self, subject_ids=ALL_SUBJECTS, incremental=False,
+            step_ids=None):
+        ''' Run the analyses of the given subjects, and only the given
+        pipeline steps if step_ids is specified.
+
+        In incremental mode, the jobs of the subjects which are not
+        currently processed are added to the running pool, the other jobs
+        keep running.
+        '''
+        if not incremental:
+            if self.is_running():
+                raise RuntimeError("Runner is already running.")
+            self._init_internal_parameters()
+        self._setup_retry_policy()
+        self._setup_straggler_detector()
+        with self._condition:
+            if self._executor is None:
+                self._stopping = False
+            elif self._stopping:
+                raise RuntimeError("Runner is being stopped.")
+        if subject_ids == ALL_SUBJECTS:
+            subject_ids = self._study.subjects
+        if incremental:
+            subject_ids = self._get_submittable_subject_ids(subject_ids)
+        workflow = self._create_workflow(subject_ids, step_ids)
+        jobs = [j for j in workflow.jobs if isinstance(j, Job)]
+        if len(jobs) == 0:
+            # empty workflow: nothing to do
+            return
+        with self._condition:
+            if self._tmp_directory is None:
+                self._tmp_directory = tempfile.mkdtemp(
+                    prefix='morphologist_run_')
+            job_ids = self._setup_jobs(workflow, jobs)
+            self._param_links.update(getattr(workflow, 'param_links', {}))
+            self._register_workflow_jobs(workflow, job_ids,
+                                         next(self._workflow_counter))
+            if self._executor is None:
+                self._max_running_n = self._cpus_number()
+                self._memory_budget = settings.runner.memory_budget
+                self._executor = ThreadPoolExecutor(
+                    max_workers=int(math.ceil(
+                        self._max_running_n / self.MIN_CPU_WEIGHT)))
+            for job_id in six.itervalues(job_ids):
+                self._states[job_id] = Runner.NOT_STARTED
+                if not self._dependencies[job_id]:
+                    self._push_ready(job_id)
+            self._start_ready_jobs()
+        self._record_run(workflow, step_ids)
+
+    def _setup_jobs(self, workflow, jobs):
+        job_ids = {}
+        analysis_cls = self._study.analysis_cls()
+        for job in jobs:
+            job_id = next(self._job_counter)
+            job_ids[job] = job_id
+            self._jobs[job_id] = job
+            self._job_loads[job_id] = self._declared_loads(job, analysis_cls)
+            self._dependencies[job_id] = set()
+            self._dependents[job_id] = set()
+        for src, dst in workflow.dependencies:
+            for src_job in group_jobs(src):
+                for dst_job in group_jobs(dst):
+                    src_id = job_ids.get(src_job)
+                    dst_id = job_ids.get(dst_job)
+                    if src_id is None or dst_id is None:
+                        continue
+                    self._dependencies[dst_id].add(src_id)
+                    self._dependents[src_id].add(dst_id)
+        return job_ids
+
+    def _declared_loads(self, job, analysis_cls):
+        ''' (cpu_weight, memory) declared for the steps of a job '''
+        resources = [analysis_cls.get_step_resources(step_id)
+                     for step_id in job_step_ids(job)]
+        return (max([r.cpu_weight for r in resources] + [self.MIN_CPU_WEIGHT]),
+                max([r.memory for r in resources]))
+
+    def _setup_straggler_detector(self):
+        try:
+            self._straggler_detector = StragglerDetector.from_study(
+                self._study)
+        except Exception as e:
+            print('could not read the steps runtimes:', e)
+            self._straggler_detector = None
+
+    def _forget_jobs(self, job_ids):
+        with self._condition:
+            for job_id in job_ids:
+                job = self._jobs.pop(job_id, None)
+                self._param_links.pop(job, None)
+                for jobs_dict in (self._dependencies, self._dependents,
+                                  self._states, self._changed_states,
+                                  self._runtimes, self._job_loads,
+                                  self._backfill_skips):
+                    jobs_dict.pop(job_id, None)
+                self._start_times.pop(job_id, None)
+                self._stopped_job_ids.discard(job_id)
+                self._cancel_retry(job_id)
+                self._cancel_straggler_watch(job_id)
+
+    def _push_ready(self, job_id):
+        priority = getattr(self._jobs[job_id], 'priority', 0) or 0
+        heapq.heappush(self._ready, (-priority, job_id))
+
+    def _set_state(self, job_id, status):
+        # must be called with the condition lock held
+        self._states[job_id] = status
+        self._changed_states[job_id] = status
+        self._condition.notify_all()
+
+    def _start_ready_jobs(self):
+        # must be called with the condition lock held
+        skipped = []
+        while self._ready and not self._stopping \
+                and len(skipped) < self.BACKFILL_DEPTH \
+                and self._used_cpus + self.MIN_CPU_WEIGHT \
+                    <= self._max_running_n:
+            entry = heapq.heappop(self._ready)
+            job_id = entry[1]
+            job = self._jobs[job_id]
+            if isinstance(job, BarrierJob) or not job.command:
+                self._set_state(job_id, Runner.SUCCESS)
+                self._release_dependents(job_id)
+                continue
+            if skipped and self._backfill_skips.get(skipped[0][1], 0) \
+                    >= self.MAX_BACKFILL_SKIPS:
+                # the first waiting job has been overtaken too many times:
+                # the free resources are kept for it
+                skipped.append(entry)
+                continue
+            if not self._fits_in_free_resources(job_id):
+                skipped.append(entry)
+                continue
+            if skipped:
+                head_id = skipped[0][1]
+                self._backfill_skips[head_id] \
+                    = self._backfill_skips.get(head_id, 0) + 1
+            self._backfill_skips.pop(job_id, None)
+            cpu_weight, memory = self._job_loads[job_id]
+            self._used_cpus += cpu_weight
+            self._used_memory += memory
+            self._running_n += 1
+            self._set_state(job_id, Runner.RUNNING)
+            future = self._executor.submit(self._execute_job, job_id)
+            future.add_done_callback(
+                lambda future, job_id=job_id:
+                    self._on_job_done(job_id, future))
+            self._watch_straggler(job_id)
+        for entry in skipped:
+            heapq.heappush(self._ready, entry)
+        self._check_workflow_done()
+
+    def _fits_in_free_resources(self, job_id):
+        if self._running_n == 0:
+            return True
+        cpu_weight, memory = self._job_loads[job_id]
+        return self._used_cpus + cpu_weight <= self._max_running_n \
+            and self._used_memory + memory <= self._memory_budget
+
+    def _release_dependents(self, job_id):
+        for dependent_id in self._dependents[job_id]:
+            if self._states[dependent_id] != Runner.NOT_STARTED:
+                continue
+            if all([self._states[dep] == Runner.SUCCESS
+                    for dep in self._dependencies[dependent_id]]):
+                self._push_ready(dependent_id)
+
+    def _abort_dependents(self, job_id):
+        todo = list(self._dependents[job_id])
+        while todo:
+            dependent_id = todo.pop(0)
+            if self._states[dependent_id] == Runner.NOT_STARTED:
+                self._set_state(dependent_id, Runner.ABORTED_NOTRUN)
+                todo += self._dependents[dependent_id]
+
+    def _check_workflow_done(self):
+        if self._running_n == 0 and self._executor is not None \
+                and (self._stopping
+                     or not (self._ready or self._retry_timers)):
+            executor = self._executor
+            self._executor = None
+            executor.shutdown(wait=False)
+            if not [status for status in six.itervalues(self._states)
+                    if status != Runner.SUCCESS]:
+                shutil.rmtree(self._tmp_directory, ignore_errors=True)
+                self._tmp_directory = None
+                self._temporary_paths = {}
+            self._condition.notify_all()
+
+    def _on_job_done(self, job_id, future):
+        try:
+            returncode = future.result()
+        except Exception as e:
+            print('job %s could not be started: %s' % (job_id, e))
+            returncode = None
+        with self._condition:
+            cpu_weight, memory = self._job_loads[job_id]
+            self._used_cpus -= cpu_weight
+            self._used_memory -= memory
+            self._running_n -= 1
+            self._processes.pop(job_id, None)
+            self._start_times.pop(job_id, None)
+            self._cancel_straggler_watch(job_id)
+            returncode = self._settle_copy(job_id, returncode)
+            if returncode == 0:
+                self._read_output_parameters(job_id)
+                self._set_state(job_id, Runner.SUCCESS)
+                self._release_dependents(job_id)
+            elif self._stopping or job_id in self._stopped_job_ids:
+                self._set_state(job_id, Runner.STOPPED_BY_USER)
+                self._abort_dependents(job_id)
+            else:
+                delay = self._failed_attempt_retry_delay(job_id)
+                if delay is None:
+                    self._set_state(job_id, Runner.FAILED)
+                    self._abort_dependents(job_id)
+                else:
+                    self._schedule_retry(job_id, delay)
+            self._start_ready_jobs()
+
+    def _schedule_retry(self, job_id, delay):
+        # must be called with the condition lock held. The job waits as not
+        # started, and so do its dependents.
+        self._set_state(job_id, Runner.NOT_STARTED)
+        timer = threading.Timer(delay, self._retry_job, (job_id, ))
+        timer.daemon = True
+        self._retry_timers[job_id] = timer
+        timer.start()
+
+    def _cancel_retry(self, job_id):
+        # must be called with the condition lock held
+        timer = self._retry_timers.pop(job_id, None)
+        if timer is not None:
+            timer.cancel()
+        return timer is not None
+
+    def _retry_job(self, job_id):
+        with self._condition:
+            if self._retry_timers.pop(job_id, None) is None:
+                # cancelled meanwhile
+                return
+            if self._stopping or self._executor is None:
+                self._check_workflow_done()
+                return
+            cpu_weight, memory = self._declared_loads(
+                self._jobs[job_id], self._study.analysis_cls())
+            memory = self._retry_policy.reserved_memory(
+                memory, self._attempts.get(job_id, 0), self._memory_budget)
+            self._job_loads[job_id] = (cpu_weight, memory)
+            self._push_ready(job_id)
+            self._start_ready_jobs()
+
+    def _watch_straggler(self, job_id, delay=None):
+        # must be called with the condition lock held
+        self._cancel_straggler_watch(job_id)
+        if self._straggler_detector is None or job_id in self._copies:
+            return
+        if delay is None:
+            delay = self._straggler_detector.threshold(self._jobs[job_id])
+            if delay is None:
+                return
+        timer = threading.Timer(delay, self._check_straggler, (job_id, ))
+        timer.daemon = True
+        self._straggler_timers[job_id] = timer
+        timer.start()
+
+    def _cancel_straggler_watch(self, job_id):
+        # must be called with the condition lock held
+        timer = self._straggler_timers.pop(job_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _can_speculate(self, job):
+        # the outputs parameters and temporary files of the copy could not
+        # be told from the ones of the original job
+        if getattr(job, 'has_outputs', False):
+            return False
+        todo = [job.command, getattr(job, 'param_dict', None)]
+        while todo:
+            value = todo.pop()
+            if isinstance(value, (TemporaryPath, FileTransfer)):
+                return False
+            elif isinstance(value, (list, tuple)):
+                todo += value
+            elif isinstance(value, dict):
+                todo += list(value.values())
+        return True
+
+    def _check_straggler(self, job_id):
+        with self._condition:
+            if self._straggler_timers.pop(job_id, None) is None:
+                # cancelled meanwhile
+                return
+            if self._stopping or self._executor is None \
+                    or self._states.get(job_id) != Runner.RUNNING \
+                    or job_id in self._stopped_job_ids \
+                    or job_id in self._copies:
+                return
+            if job_id not in self._start_times \
+                    or not self._fits_in_free_resources(job_id):
+                self._watch_straggler(job_id, self.SPECULATION_RECHECK_DELAY)
+                return
+            job = self._jobs[job_id]
+            if not self._can_speculate(job):
+                return
+            staging_directory = os.path.join(
+                self._study.output_directory, '.%s_job_%d'
+                % (os.path.basename(self._tmp_directory), job_id))
+            outputs = SpeculativeOutputs(self._study.output_directory,
+                                         staging_directory,
+                                         self._start_times[job_id])
+            command = self._job_command(job_id, outputs)
+            if not outputs.can_isolate():
+                return
+            copy = _SpeculativeCopy(outputs, self._job_loads[job_id])
+            self._copies[job_id] = copy
+            cpu_weight, memory = copy.loads
+            self._used_cpus += cpu_weight
+            self._used_memory += memory
+            self._running_n += 1
+            print('job %s is late, starting a speculative copy' % job.name)
+            future = self._executor.submit(self._execute_copy, job_id, copy,
+                                           command)
+            future.add_done_callback(
+                lambda future, job_id=job_id:
+                    self._on_copy_done(job_id, future))
+
+    def _execute_copy(self, job_id, copy, command):
+        copy.outputs.prepare()
+        return self._run_process(job_id, *command, copy=copy)
+
+    def _on_copy_done(self, job_id, future):
+        try:
+            returncode = future.result()
+        except Exception as e:
+            print('speculative copy of job %s could not be started: %s'
+                  % (job_id, e))
+            returncode = None
+        with self._condition:
+            copy = self._copies[job_id]
+            cpu_weight, memory = copy.loads
+            self._used_cpus -= cpu_weight
+            self._used_memory -= memory
+            self._running_n -= 1
+            if returncode == 0 and not copy.lost and not self._stopping \
+                    and job_id not in self._stopped_job_ids \
+                    and self._states.get(job_id) == Runner.RUNNING:
+                # the copy wins: the original job is killed, and the outputs
+                # of the copy are committed once it is over (_settle_copy)
+                copy.succeeded = True
+                process = self._processes.get(job_id)
+                if process is not None and process.poll() is None:
+                    process.kill()
+            else:
+                copy.outputs.discard()
+                del self._copies[job_id]
+            self._start_ready_jobs()
+
+    def _settle_copy(self, job_id, returncode):
+        ''' return code of a job which is over, given its speculative copy
+        '''
+        # must be called with the condition lock held
+        copy = self._copies.get(job_id)
+        if copy is None:
+            return returncode
+        if not copy.succeeded:
+            copy.lost = True
+            if copy.process is not None and copy.process.poll() is None:
+                copy.process.kill()
+            return returncode
+        del self._copies[job_id]
+        if returncode == 0:
+            # both have succeeded: the outputs of the job are in place
+            copy.outputs.discard()
+            return returncode
+        try:
+            copy.outputs.commit()
+        except (IOError, OSError) as e:
+            print('could not commit the outputs of the speculative copy of '
+                  'job %s: %s' % (self._jobs[job_id].name, e))
+            copy.outputs.discard()
+            return returncode
+        self._runtimes[job_id] = copy.runtime
+        return 0
+
+    def _execute_job(self, job_id):
+        with self._condition:
+            if self._stopping or job_id in self._stopped_job_ids:
+                return None
+            job = self._jobs[job_id]
+            command, env, cwd, out_file, err_file = self._job_command(job_id)
+        returncode = self._run_process(job_id, command, env, cwd, out_file,
+                                       err_file)
+        with self._condition:
+            copy = self._copies.get(job_id)
+            overtaken = copy is not None and copy.succeeded
+        if returncode != 0 and not self._stopping \
+                and job_id not in self._stopped_job_ids and not overtaken:
+            print('job %s failed, see %s' % (job.name, out_file),
+                  file=sys.stderr)
+        return returncode
+
+    def _job_command(self, job_id, outputs=None):
+        ''' command, environment, working directory, stdout and stderr files
+        of a job, or of its speculative copy if outputs (SpeculativeOutputs)
+        is given
+        '''
+        # must be called with the condition lock held
+        job = self._jobs[job_id]
+        if outputs is None:
+            redirect = lambda value: value
+            suffix = ''
+        else:
+            redirect = outputs.redirect
+            suffix = '_copy'
+        command = [redirect(self._resolve_value(item))
+                   for item in job.command]
+        env = dict(os.environ)
+        if job.env:
+            env.update(job.env)
+        self._write_input_parameters(job_id, env, redirect, suffix)
+        out_file = None
+        if outputs is None:
+            out_file = self._resolve_value(job.stdout_file)
+        out_file = out_file or os.path.join(
+            self._tmp_directory, 'job_%d%s.out' % (job_id, suffix))
+        if job.join_stderrout:
+            err_file = None
+        else:
+            err_file = None
+            if outputs is None:
+                err_file = self._resolve_value(job.stderr_file)
+            err_file = err_file or os.path.join(
+                self._tmp_directory, 'job_%d%s.err' % (job_id, suffix))
+        cwd = self._resolve_value(job.working_directory) or None
+        return command, env, cwd, out_file, err_file
+
+    def _run_process(self, job_id, command, env, cwd, out_file, err_file,
+                     copy=None):
+        with open(out_file, 'wb') as stdout:
+            if err_file is None:
+                stderr = subprocess.STDOUT
+            else:
+                stderr = open(err_file, 'wb')
+            try:
+                with self._condition:
+                    if self._stopping or job_id in self._stopped_job_ids \
+                            or (copy is not None and copy.lost):
+                        return None
+                    start_time = time.time()
+                    process = subprocess.Popen(
+                        command, env=env, stdout=stdout, stderr=stderr,
+                        cwd=cwd)
+                    if copy is None:
+                        self._processes[job_id] = process
+                        self._start_times[job_id] = start_time
+                    else:
+                        copy.process = process
+                returncode, cpu_time, peak_rss = self._wait_process(process)
+                runtime = (time.time() - start_time, cpu_time, peak_rss)
+                with self._condition:
+                    if copy is None:
+                        self._runtimes[job_id] = runtime
+                    else:
+                        copy.runtime = runtime
+            finally:
+                if err_file is not None:
+                    stderr.close()
+        return returncode
+
+    def _wait_process(self, process):
+        ''' wait for the process to finish, and return its return code, CPU
+        time and peak resident memory (in kB), when available
+        '''
+        if not hasattr(os, 'wait4'):
+            return process.wait(), None, None
+        if hasattr(os, 'waitid'):
+            # wait for the process to end, without reaping it
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        while True:
+            # the process is reaped and its return code recorded at once:
+            # poll() or kill(), called with the lock held, never meet a
+            # reaped process (or a recycled pid)
+            with self._condition:
+                if process.returncode is not None:
+                    # reaped by poll() meanwhile: no resources usage
+                    return process.returncode, None, None
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid != 0:
+                    if os.WIFSIGNALED(status):
+                        returncode = -os.WTERMSIG(status)
+                    else:
+                        returncode = os.WEXITSTATUS(status)
+                    process.returncode = returncode
+                    return returncode, rusage.ru_utime + rusage.ru_stime, \
+                        rusage.ru_maxrss
+            time.sleep(self.PROCESS_POLL_DELAY)
+
+    def _resolve_value(self, value):
+        if isinstance(value, TemporaryPath):
+            path = self._temporary_paths.get(value)
+            if path is None:
+                fd, path = tempfile.mkstemp(
+                    dir=self._tmp_directory, suffix=value.suffix or '')
+                os.close(fd)
+                self._temporary_paths[value] = path
+            return path
+        elif isinstance(value, FileTransfer):
+            return value.client_path
+        elif isinstance(value, tuple) and len(value) == 2 \
+                and isinstance(value[0], FileTransfer):
+            return os.path.join(value[0].client_path, value[1])
+        elif isinstance(value, list):
+            return [self._resolve_value(item) for item in value]
+        elif isinstance(value, dict):
+            return dict([(key, self._resolve_value(item))
+                         for key, item in six.iteritems(value)])
+        return value
+
+    def _write_input_parameters(self, job_id, env, redirect=None, suffix=''):
+        job = self._jobs[job_id]
+        if getattr(job, 'use_input_params_file', False):
+            params_file = os.path.join(
+                self._tmp_directory,
+                'job_%d%s_input_params.json' % (job_id, suffix))
+            parameters = self._resolve_value(job.param_dict)
+            if redirect is not None:
+                parameters = redirect(parameters)
+            parameters = {'parameters': parameters}
+            configuration = getattr(job, 'configuration', None)
+            if configuration:
+                parameters['configuration_dict'] = configuration
+            with open(params_file, 'w') as f:
+                json.dump(parameters, f)
+            env['SOMAWF_INPUT_PARAMS'] = params_file
+        if getattr(job, 'has_outputs', False):
+            env['SOMAWF_OUTPUT_PARAMS'] = self._output_parameters_file(job_id)
+
+    def _output_parameters_file(self, job_id):
+        return os.path.join(self._tmp_directory,
+                            'job_%d_output_params.json' % job_id)
+
+    def _read_output_parameters(self, job_id):
+        ''' forward the output parameters of a job to the jobs linked to
+        them in the workflow param_links
+        '''
+        job = self._jobs[job_id]
+        if not getattr(job, 'has_outputs', False):
+            return
+        params_file = self._output_parameters_file(job_id)
+        if not os.path.exists(params_file):
+            return
+        with open(params_file) as f:
+            output_values = json.load(f)
+        for dest_job, links in six.iteritems(self._param_links):
+            for dest_param, sources in six.iteritems(links):
+                for source in sources:
+                    if source[0] is job and source[1] in output_values:
+                        dest_job.param_dict[dest_param] \
+                            = output_values[source[1]]
+
+    def _update_jobs_status(self):
+        with self._condition:
+            changed_states = self._changed_states
+            self._changed_states = {}
+            changes = self._jobs_status.sync(six.iteritems(changed_states),
+                                             lambda status: status)
+            runtimes = dict([(job_id, self._runtimes.get(job_id))
+                             for job_id, _, status in changes
+                             if status == Runner.SUCCESS])
+        self._record_step_runtimes(changes, runtimes)
+        self._record_completed_steps(changes)
+        return changes
+
+    def _get_workflow_status(self):
+        with self._condition:
+            running = self._executor is not None
+        if running:
+            status = Runner.RUNNING
+        elif self._jobs_status.has_status(
+                Runner.INTERRUPTED | Runner.ABORTED_NOTRUN):
+            status = Runner.FAILED
+        else:
+            status = Runner.SUCCESS
+        return status
+
+    def wait(self, subject_id=None, step_id=None):
+        if subject_id is None and step_id is None:
+            with self._condition:
+                while self._executor is not None:
+                    self._condition.wait()
+        elif subject_id is not None:
+            if step_id is None:
+                raise NotImplementedError
+            else:
+                self._step_wait(subject_id, step_id)
+        else:
+            raise NotImplementedError
+
+    def _step_wait(self, subject_id, step_id):
+        job_ids = self._jobs_status.job_ids(subject_id, step_id)
+        with self._condition:
+            while self._executor is not None \
+                    and [job_id for job_id in job_ids
+                         if self._states[job_id] in (Runner.NOT_STARTED,
+                                                     Runner.RUNNING)]:
+                self._condition.wait()
+
+    def _workflow_stop(self):
+        with self._condition:
+            self._stopping = True
+            for job_id, status in six.iteritems(dict(self._states)):
+                if status == Runner.NOT_STARTED:
+                    self._set_state(job_id, Runner.ABORTED_NOTRUN)
+            self._ready = []
+            for job_id in list(self._retry_timers):
+                self._cancel_retry(job_id)
+            for job_id in list(self._straggler_timers):
+                self._cancel_straggler_watch(job_id)
+            processes = list(self._processes.values()) \
+                + [copy.process for copy in six.itervalues(self._copies)]
+            for process in processes:
+                if process is not None and process.poll() is None:
+                    process.kill()
+            self._check_workflow_done()
+        self.wait()
+        self._clear_interrupted_results()
+
+    def _jobs_stop(self, job_ids):
+        job_ids = set(job_ids)
+        with self._condition:
+            self._stopped_job_ids.update(job_ids)
+            self._ready = [entry for entry in self._ready
+                           if entry[1] not in job_ids]
+            heapq.heapify(self._ready)
+            for job_id in job_ids:
+                self._cancel_retry(job_id)
+                self._cancel_straggler_watch(job_id)
+                if self._states[job_id] == Runner.NOT_STARTED:
+                    self._set_state(job_id, Runner.ABORTED_NOTRUN)
+                    self._abort_dependents(job_id)
+                else:
+                    copy = self._copies.get(job_id)
+                    for process in (self._processes.get(job_id),
+                                    copy and copy.process):
+                        if process is not None and process.poll() is None:
+                            process.kill()
+            self._check_workflow_done()
+            # running jobs become STOPPED_BY_USER in _on_job_done
+            while [job_id for job_id in job_ids
+                   if self._states[job_id] == Runner.RUNNING]:
+                self._condition.wait()
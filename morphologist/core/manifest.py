@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import json
+import time
+import hashlib
+import six
+
+
+def file_checksum(filename, block_size=1024 * 1024):
+    ''' md5 checksum of a file, of the files of a directory '''
+    checksum = hashlib.md5()
+    if os.path.isdir(filename):
+        for root, dirnames, filenames in os.walk(filename):
+            dirnames.sort()
+            for name in sorted(filenames):
+                checksum.update(file_checksum(
+                    os.path.join(root, name), block_size).encode())
+        return checksum.hexdigest()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+class OutputManifest(object):
+    '''
+    Snapshot of the results of a subject, written in the subject directory
+    by the runners when steps complete, so that the state of a subject can
+    be read from one small file instead of being worked out again from its
+    parameters and the output files.
+
+    The manifest holds, for each step, the existing output files with their
+    sizes, modification times and optionally checksums, and whether all the
+    expected outputs of the step exist. It also holds a hash of the
+    parameters of the subject, and the modification times of the
+    directories of its files: the manifest is stale when the parameters
+    have changed, or when a file has been added to or removed from these
+    directories since it was written.
+
+    Parameters
+    ----------
+    filename: str
+    '''
+    DIRECTORY = '.morphologist'
+    FILENAME = 'outputs_manifest.json'
+    VERSION = 1
+    # modification times of some file systems (NFS...) have a resolution of
+    # a second: a directory modified in the second of the manifest writing
+    # may have changed unnoticed
+    MTIME_RESOLUTION = 1.
+
+    def __init__(self, filename):
+        self.filename = filename
+        # (modification time of the manifest directory, manifest)
+        self._cache = None
+
+    @classmethod
+    def from_subject_directory(cls, directory):
+        return cls(os.path.join(directory, cls.DIRECTORY, cls.FILENAME))
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def write(self, results, complete_steps, all_results, parameters_hash,
+              directories, step_ids=(), checksums=False):
+        '''
+        Parameters
+        ----------
+        results: dict
+            step_id -> existing output files of the step
+        complete_steps: list
+            steps whose expected outputs all exist
+        all_results: bool
+            all the expected outputs of the subject exist
+        parameters_hash: str
+        directories: list
+            directories of the files of the subject
+        step_ids: list
+            steps which have just completed
+        checksums: bool
+            store the checksums of the output files
+        '''
+        manifest_directory = os.path.dirname(self.filename)
+        # created first, so that the modification time of its parent
+        # directory is recorded after
+        if not os.path.isdir(manifest_directory):
+            os.makedirs(manifest_directory)
+        previous = self._load() or {}
+        completion_dates = previous.get('completion_dates', {})
+        now = time.time()
+        for step_id in step_ids:
+            completion_dates[step_id] = now
+        steps = {}
+        for step_id, filenames in six.iteritems(results):
+            outputs = {}
+            for filename in filenames:
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                output = {'size': stat.st_size, 'mtime': stat.st_mtime}
+                if checksums:
+                    output['checksum'] = file_checksum(filename)
+                outputs[filename] = output
+            steps[step_id] = {'outputs': outputs,
+                              'complete': step_id in complete_steps}
+        manifest = {
+            'version': self.VERSION,
+            'date': now,
+            'parameters_hash': parameters_hash,
+            'all_results': all_results,
+            'completion_dates': completion_dates,
+            'steps': steps,
+            'directories': dict([(directory, self._mtime(directory))
+                                 for directory in directories])}
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_filename, self.filename)
+        self._cache = None
+
+    def read(self, parameters_hash, mtime=None):
+        '''
+        Parameters
+        ----------
+        parameters_hash: str
+            hash of the current parameters of the subject
+        mtime: function
+            directory -> modification time (None if it does not exist)
+            function, the modification time of the directory by default
+
+        Returns
+        -------
+        manifest: dict
+            the manifest (see write), None if it is missing or stale
+        '''
+        if mtime is None:
+            mtime = self._mtime
+        # the manifest is replaced by a rename, which modifies its directory
+        manifest_mtime = mtime(os.path.dirname(self.filename))
+        if manifest_mtime is None:
+            return None
+        if self._cache is not None and self._cache[0] == manifest_mtime \
+                and self._settled(manifest_mtime, time.time()):
+            manifest = self._cache[1]
+        else:
+            manifest = self._load()
+            self._cache = (manifest_mtime, manifest)
+        if manifest is None or manifest.get('version') != self.VERSION \
+                or manifest['parameters_hash'] != parameters_hash:
+            return None
+        for directory, directory_mtime in six.iteritems(
+                manifest['directories']):
+            if mtime(directory) != directory_mtime \
+                    or not self._settled(directory_mtime, manifest['date']):
+                return None
+        return manifest
+
+    def _settled(self, mtime, date):
+        # a whole number of seconds denotes a coarse resolution
+        return mtime is None or mtime != int(mtime) \
+            or mtime < date - self.MTIME_RESOLUTION
+
+    def _load(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def remove(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+        self._cache = None
+
+    @staticmethod
+    def _mtime(directory):
+        try:
+            return os.stat(directory).st_mtime
+        except OSError:
+            return None
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+
+def _list_directory(path, directories):
+    ''' sorted names of the subdirectories (or of the files) of path,
+    hidden ones excepted, as glob would list them
+    '''
+    try:
+        if scandir is None:
+            names = [name for name in os.listdir(path)
+                     if os.path.isdir(os.path.join(path, name))
+                     == directories]
+        else:
+            names = [entry.name for entry in scandir(path)
+                     if entry.is_dir() == directories]
+    except OSError:
+        return []
+    return sorted([name for name in names if not name.startswith('.')])
+
+
+def _default_threads_n():
+    # the scan waits for the file system much more than for the CPUs
+    return min(32, multiprocessing.cpu_count() * 4)
+
+
+def scan_organized_directory(directory, modality='t1mri',
+                             acquisitions=None, extensions=('nii', ),
+                             threads_n=None, progress_callback=None):
+    '''
+    Find the subjects images of a directory organized as::
+
+        directory/<group>/<subject>/<modality>/<acquisition>/<subject>.<ext>
+
+    The subjects directories are scanned by a pool of threads, and the
+    subjects are yielded as they are found, in the (group, subject) order.
+
+    Parameters
+    ----------
+    acquisitions: list
+        acquisitions to look into, all of them if None
+    extensions: list
+        extensions of the images
+    progress_callback: function
+        called with the progress (from 0 to 1) in the thread iterating
+        over the results
+
+    Yields
+    ------
+    groupname, subjectname, images: str, str, list
+        images are (filename, extension) tuples, by acquisition
+    '''
+    if threads_n is None:
+        threads_n = _default_threads_n()
+    groupnames = _list_directory(directory, True)
+    # listing the subjects of the groups counts for this part of the progress
+    listing_part = 0.1
+    if progress_callback:
+        progress_callback(0.)
+
+    def list_subjects(groupname):
+        return [(groupname, subjectname)
+                for subjectname in _list_directory(
+                    os.path.join(directory, groupname), True)]
+
+    def scan_subject(group_subject):
+        groupname, subjectname = group_subject
+        modality_dir = os.path.join(directory, groupname, subjectname,
+                                    modality)
+        if acquisitions is None:
+            subject_acquisitions = _list_directory(modality_dir, True)
+        else:
+            subject_acquisitions = acquisitions
+        images = []
+        for acquisition in subject_acquisitions:
+            acquisition_dir = os.path.join(modality_dir, acquisition)
+            filenames = set(_list_directory(acquisition_dir, False))
+            for extension in extensions:
+                filename = '%s.%s' % (subjectname, extension)
+                if filename in filenames:
+                    images.append((os.path.join(acquisition_dir, filename),
+                                   extension))
+        return groupname, subjectname, images
+
+    executor = ThreadPoolExecutor(max_workers=threads_n)
+    try:
+        subject_dirs = []
+        for n, group_subject_dirs in enumerate(
+                executor.map(list_subjects, groupnames)):
+            subject_dirs += group_subject_dirs
+            if progress_callback:
+                progress_callback(listing_part * (n + 1.) / len(groupnames))
+        for n, (groupname, subjectname, images) in enumerate(
+                executor.map(scan_subject, subject_dirs)):
+            if progress_callback:
+                progress_callback(listing_part + (1. - listing_part)
+                                  * (n + 1.) / len(subject_dirs))
+            if images:
+                yield groupname, subjectname, images
+    finally:
+        executor.shutdown(wait=False)
+    if progress_callback:
+        progress_callback(1.)
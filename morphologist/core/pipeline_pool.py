@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import sys
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from morphologist.core.utils import OrderedDict
+
+
+def _resident_memory():
+    ''' resident memory of the process, in MB, None if it is not known '''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024. ** 2
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    try:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (AttributeError, ValueError):
+        return None
+    # peak memory: in bytes on MacOS, in KB elsewhere
+    if sys.platform == 'darwin':
+        return max_rss / 1024. ** 2
+    return max_rss / 1024.
+
+
+class PipelinePool(object):
+    '''
+    Pipeline instances of a study, each in the state (parameters values) of
+    a subject, so that going back to a recently used subject does not
+    require to set the whole pipeline state again.
+
+    Instances are assigned to the subjects in least recently used order.
+    Their number is limited by memory_cap: the memory of an instance is
+    measured when the second one is built (the first one also loads the
+    modules of the pipeline).
+
+    The state of an instance is the one of the subject of its
+    current_subject_id attribute, set from the parameters of its
+    current_parameters attribute (None if they have not been dumped from
+    this instance yet).
+
+    Parameters
+    ----------
+    build_pipeline: function
+        returns a new pipeline instance
+    memory_cap: int
+        memory (in MB) of the instances, there is at least one instance
+    '''
+    # memory (in MB) of an instance, if it cannot be measured
+    DEFAULT_INSTANCE_MEMORY = 200
+
+    def __init__(self, build_pipeline, memory_cap):
+        self._build_pipeline = build_pipeline
+        self.memory_cap = memory_cap
+        self.instance_memory = None
+        self._instances = []
+        # subject_id -> instance, least recently used first
+        self._assigned = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_instances(self):
+        instance_memory = self.instance_memory \
+            or self.DEFAULT_INSTANCE_MEMORY
+        return max(1, int(self.memory_cap // instance_memory))
+
+    def first_instance(self):
+        if not self._instances:
+            self._new_instance()
+        return self._instances[0]
+
+    def get(self, subject_id, parameters=None):
+        ''' the instance in the state of the subject, None if there is none.
+        If parameters are given, the instance must have been set from them,
+        or from equal ones (the parameters of an analysis decoded again, see
+        study.LazyAnalysisMap).
+        '''
+        pipeline = self._assigned.get(subject_id)
+        if pipeline is None \
+                or getattr(pipeline, 'current_subject_id', None) \
+                    != subject_id:
+            self.misses += 1
+            return None
+        if parameters is not None:
+            current_parameters = getattr(pipeline, 'current_parameters', None)
+            if current_parameters is not parameters:
+                if current_parameters is None \
+                        or current_parameters != parameters:
+                    self.misses += 1
+                    return None
+                pipeline.current_parameters = parameters
+        self.hits += 1
+        # most recently used
+        del self._assigned[subject_id]
+        self._assigned[subject_id] = pipeline
+        return pipeline
+
+    def assign(self, subject_id):
+        ''' an instance to set in the state of the subject: a new one, or
+        the least recently used one
+        '''
+        pipeline = self._assigned.pop(subject_id, None)
+        if pipeline is None:
+            free = [instance for instance in self._instances
+                    if instance not in self._assigned.values()]
+            if free:
+                pipeline = free[0]
+            elif len(self._instances) < self.max_instances:
+                pipeline = self._new_instance()
+            else:
+                pipeline = self._assigned.pop(next(iter(self._assigned)))
+        pipeline.current_subject_id = None
+        pipeline.current_parameters = None
+        self._assigned[subject_id] = pipeline
+        return pipeline
+
+    def forget(self, subject_id):
+        ''' the instance of the subject, if any, is no longer in its state:
+        the next get of the subject misses
+        '''
+        pipeline = self._assigned.pop(subject_id, None)
+        if pipeline is not None:
+            pipeline.current_subject_id = None
+            pipeline.current_parameters = None
+
+    def hit_rate(self):
+        requests_n = self.hits + self.misses
+        if requests_n == 0:
+            return None
+        return float(self.hits) / requests_n
+
+    def statistics(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate(),
+                'instances': len(self._instances),
+                'max_instances': self.max_instances,
+                'instance_memory': self.instance_memory}
+
+    def _new_instance(self):
+        measure = self.instance_memory is None and len(self._instances) == 1
+        memory = measure and _resident_memory() or None
+        pipeline = self._build_pipeline()
+        if memory is not None:
+            new_memory = _resident_memory()
+            if new_memory is not None and new_memory > memory:
+                self.instance_memory = new_memory - memory
+        self._instances.append(pipeline)
+        return pipeline
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import six
+
+from soma_workflow.client import Job, BarrierJob
+
+from morphologist.core.constants import ALL_SUBJECTS
+from morphologist.core.scheduling import job_step_ids, simulate_makespan
+from morphologist.core.workflow_builder import MissingModelsError, \
+    create_workflow_builder
+
+
+class StudyPlan(object):
+    '''
+    What running the analyses of a study would do, without running anything
+    (see plan_study).
+
+    Attributes
+    ----------
+    subject_step_jobs: dict
+        subject_id -> (step_id -> number of jobs), for the subjects with
+        jobs to run
+    failing_subjects: dict
+        subject_id -> reason, for the subjects which would fail before any
+        job is run (missing inputs or models)
+    processes_n: int
+        number of processing units the estimates are computed for
+    makespan: float
+        estimated duration of the whole run, in seconds
+    cpu_time: float
+        sum of the estimated durations of the jobs, in seconds
+    output_size: float
+        estimated disk space taken by the new outputs, in MB
+    '''
+
+    def __init__(self, subject_step_jobs, failing_subjects, processes_n,
+                 makespan, cpu_time, output_size):
+        self.subject_step_jobs = subject_step_jobs
+        self.failing_subjects = failing_subjects
+        self.processes_n = processes_n
+        self.makespan = makespan
+        self.cpu_time = cpu_time
+        self.output_size = output_size
+
+    def step_jobs(self):
+        ''' step_id -> number of jobs, for all the subjects '''
+        step_jobs = {}
+        for subject_jobs in six.itervalues(self.subject_step_jobs):
+            for step_id, jobs_n in six.iteritems(subject_jobs):
+                step_jobs[step_id] = step_jobs.get(step_id, 0) + jobs_n
+        return step_jobs
+
+    def jobs_n(self):
+        return sum(self.step_jobs().values())
+
+    def to_dict(self):
+        return {'subjects': self.subject_step_jobs,
+                'step_jobs': self.step_jobs(),
+                'jobs_n': self.jobs_n(),
+                'failing_subjects': self.failing_subjects,
+                'processes_n': self.processes_n,
+                'estimated_makespan': self.makespan,
+                'estimated_cpu_time': self.cpu_time,
+                'estimated_output_size': self.output_size}
+
+
+def plan_study(study, processes_n, subject_ids=ALL_SUBJECTS, step_ids=None):
+    '''
+    Plan the run of the analyses of the given subjects (and only of the given
+    pipeline steps if step_ids is specified) on processes_n processing
+    units, without submitting anything.
+
+    The workflow is built as a runner would do it: steps which outputs
+    already exist are not run, and subjects with missing inputs are
+    reported in the plan rather than failing it.
+
+    Returns
+    -------
+    plan: StudyPlan
+    '''
+    if subject_ids == ALL_SUBJECTS:
+        subject_ids = list(study.subjects.keys())
+    builder = create_workflow_builder(study, len(subject_ids))
+    errors = {}
+    fragments = builder.build_fragments(subject_ids, step_ids, errors)
+    workflow = builder.merge(fragments)
+    job_duration = builder.job_duration()
+    analysis_cls = study.analysis_cls()
+
+    subject_step_jobs = {}
+    output_size = 0.
+    for subject_id, fragment in fragments:
+        step_jobs = {}
+        for job in fragment.jobs:
+            if not isinstance(job, Job) or isinstance(job, BarrierJob) \
+                    or not job.command:
+                continue
+            for step_id in job_step_ids(job):
+                step_jobs[step_id] = step_jobs.get(step_id, 0) + 1
+        if step_jobs:
+            subject_step_jobs[subject_id] = step_jobs
+        # outputs are written once per step, whatever its number of jobs
+        output_size += sum([analysis_cls.get_step_resources(
+            step_id).output_size for step_id in step_jobs])
+
+    failing_subjects = {}
+    for subject_id, error in six.iteritems(errors):
+        if isinstance(error, MissingModelsError):
+            failing_subjects[subject_id] = 'missing models: %s' % error
+        else:
+            failing_subjects[subject_id] = 'missing inputs'
+
+    jobs = [job for job in workflow.jobs if isinstance(job, Job)]
+    cpu_time = float(sum([job_duration(job) for job in jobs]))
+    makespan = simulate_makespan(workflow, job_duration, processes_n)
+    return StudyPlan(subject_step_jobs, failing_subjects, processes_n,
+                     makespan, cpu_time, output_size)
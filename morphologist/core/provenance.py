@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import os
+import json
+import hashlib
+import six
+import traits.api as traits
+
+from capsul.pipeline.pipeline import Pipeline
+from capsul.pipeline.pipeline_tools import find_plug_connection_sources
+
+
+# steps not run again (runner skip_steps setting)
+EXISTING_OUTPUTS_SKIP = 'existing_outputs'
+PROVENANCE_SKIP = 'provenance'
+
+
+def _is_file_trait(trait):
+    return isinstance(trait.trait_type, (traits.File, traits.Directory))
+
+
+def _is_path(value):
+    return isinstance(value, six.string_types) and value != ''
+
+
+def _file_fingerprint(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return [filename, None, None]
+    return [filename, stat.st_size, stat.st_mtime]
+
+
+class _StepsGraph(object):
+    ''' file parameters of the active nodes of the steps of a pipeline.
+
+    All the steps are included, whether they are enabled or not, so that
+    the hash of a step does not depend on the selection of the steps to
+    run.
+    '''
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        steps = pipeline.pipeline_steps
+        self.step_ids = list(steps.user_traits())
+        self.enabled_step_ids = [step_id for step_id in self.step_ids
+                                 if getattr(steps, step_id)]
+        # step_id -> [(node_name, param, value, is_output, is_file)]
+        self.parameters = {}
+        # output file -> step_id
+        self.producers = {}
+        for step_id in self.step_ids:
+            parameters = []
+            for node_name in steps.trait(step_id).nodes:
+                node = pipeline.nodes[node_name]
+                if not node.enabled or not node.activated:
+                    continue
+                process = node.process
+                for param in sorted(node.plugs):
+                    trait = process.trait(param)
+                    value = getattr(process, param)
+                    is_file = _is_file_trait(trait)
+                    if trait.output and is_file \
+                            and isinstance(process, Pipeline) \
+                            and not find_plug_connection_sources(
+                                node.plugs[param]):
+                        # internally disconnected plug: not produced
+                        continue
+                    parameters.append((node_name, param, value,
+                                       bool(trait.output), is_file))
+                    if trait.output and is_file and _is_path(value):
+                        self.producers.setdefault(value, step_id)
+            self.parameters[step_id] = parameters
+
+    def input_files(self, step_id):
+        return set([value for _, _, value, is_output, is_file
+                    in self.parameters[step_id]
+                    if is_file and not is_output and _is_path(value)])
+
+    def output_files(self, step_id):
+        outputs = set([value for _, _, value, is_output, is_file
+                       in self.parameters[step_id]
+                       if is_file and is_output and _is_path(value)])
+        # outputs which are also inputs (in place modifications) are not
+        # produced by the step
+        return outputs - self.input_files(step_id)
+
+    def upstream_steps(self, step_id):
+        return set([self.producers[filename]
+                    for filename in self.input_files(step_id)
+                    if filename in self.producers]) - set([step_id])
+
+    def dependents(self, step_ids):
+        ''' the given steps and the steps depending on them, recursively '''
+        selected = set(step_ids)
+        changed = True
+        while changed:
+            changed = False
+            for step_id in self.step_ids:
+                if step_id not in selected \
+                        and self.upstream_steps(step_id) & selected:
+                    selected.add(step_id)
+                    changed = True
+        return selected
+
+    def hashes(self):
+        ''' step_id -> provenance hash '''
+        hashes = {}
+        computing = set()
+
+        def step_hash(step_id):
+            if step_id in hashes:
+                return hashes[step_id]
+            computing.add(step_id)
+            items = []
+            for node_name, param, value, is_output, is_file \
+                    in self.parameters[step_id]:
+                if is_file and not is_output and _is_path(value):
+                    producer = self.producers.get(value)
+                    if producer is not None and producer != step_id \
+                            and producer not in computing:
+                        value = ['step', producer, step_hash(producer)]
+                    else:
+                        value = _file_fingerprint(value)
+                items.append([node_name, param, value])
+            serialized = json.dumps(items, default=repr)
+            hashes[step_id] = hashlib.md5(
+                serialized.encode('utf-8')).hexdigest()
+            computing.discard(step_id)
+            return hashes[step_id]
+
+        for step_id in self.step_ids:
+            step_hash(step_id)
+        return hashes
+
+
+class StepsProvenance(object):
+    '''
+    Provenance hashes of the steps of a subject, stored in the subject
+    directory: the recorded ones, of the last completed runs of the steps,
+    and the pending ones, of the submitted runs (see record).
+
+    The hash of a step covers the values of the parameters of its nodes.
+    Input files produced by another step are represented by the hash of
+    this step, so that a change propagates downstream, other input files by
+    their size and modification time.
+
+    Parameters
+    ----------
+    filename: str
+    '''
+    DIRECTORY = '.morphologist'
+    FILENAME = 'provenance.json'
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    @classmethod
+    def from_subject_directory(cls, directory):
+        return cls(os.path.join(directory, cls.DIRECTORY, cls.FILENAME))
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                provenance = json.load(f)
+        except (IOError, OSError, ValueError):
+            provenance = {}
+        provenance.setdefault('recorded', {})
+        provenance.setdefault('pending', {})
+        return provenance
+
+    def save(self, provenance):
+        directory = os.path.dirname(self.filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(provenance, f, indent=4, sort_keys=True)
+        os.rename(tmp_filename, self.filename)
+
+    def record(self, step_ids):
+        ''' the runs of the steps submitted last have completed: all their
+        jobs have succeeded
+        '''
+        provenance = self.load()
+        recorded = [step_id for step_id in step_ids
+                    if step_id in provenance['pending']]
+        if not recorded:
+            return
+        for step_id in recorded:
+            provenance['recorded'][step_id] \
+                = provenance['pending'].pop(step_id)
+        self.save(provenance)
+
+
+def _has_existing_outputs(graph, step_id):
+    for filename in graph.output_files(step_id):
+        if os.path.exists(filename):
+            return True
+    return False
+
+
+def disable_steps_with_unchanged_provenance(pipeline, steps_provenance):
+    '''
+    Disable the enabled steps of the pipeline (runtime steps disabling, as
+    pipeline_tools.disable_runtime_steps_with_existing_outputs does) whose
+    provenance hash is the recorded one, and whose outputs exist, unless
+    they depend on a step which is run. The hashes of the steps left
+    enabled are stored as pending in steps_provenance.
+
+    Steps without recorded hash (run before the provenance mode was used)
+    are considered unchanged if their outputs exist: their current hash is
+    recorded.
+
+    Returns
+    -------
+    step_ids: set
+        steps to run
+    '''
+    graph = _StepsGraph(pipeline)
+    hashes = graph.hashes()
+    provenance = steps_provenance.load()
+    recorded = provenance['recorded']
+    changed = set()
+    for step_id in graph.enabled_step_ids:
+        if not _has_existing_outputs(graph, step_id):
+            changed.add(step_id)
+        elif step_id not in recorded:
+            recorded[step_id] = hashes[step_id]
+        elif recorded[step_id] != hashes[step_id]:
+            print('step', step_id, 'has changed since its last run')
+            changed.add(step_id)
+    to_run = graph.dependents(changed).intersection(graph.enabled_step_ids)
+    for step_id in graph.enabled_step_ids:
+        if step_id in to_run:
+            provenance['pending'][step_id] = hashes[step_id]
+        else:
+            setattr(pipeline.pipeline_steps, step_id, False)
+    steps_provenance.save(provenance)
+    return to_run
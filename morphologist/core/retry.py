@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from morphologist.core.settings import settings
+
+
+class RetryPolicy(object):
+    '''
+    How the runners retry the jobs which fail, for failures which may be
+    transient (file system hiccups, licences contention, lack of memory).
+
+    Only the failed jobs are run again, their dependents wait for them as
+    usual.
+
+    Parameters
+    ----------
+    max_attempts: function
+        step_id -> maximum number of runs of a job of the step, including
+        the first one (1: no retry)
+    delay: float
+        delay before the first retry of a job, in seconds
+    backoff_factor: float
+        the delay is multiplied by this factor at each new attempt
+    max_delay: float
+        upper bound of the delay
+    reduce_concurrency: bool
+        retried jobs reserve more resources (see reserved_memory), so that
+        fewer jobs run beside them
+    '''
+
+    def __init__(self, max_attempts=None, delay=30., backoff_factor=2.,
+                 max_delay=3600., reduce_concurrency=False):
+        if max_attempts is None:
+            max_attempts = lambda step_id: 1
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.backoff_factor = backoff_factor
+        self.max_delay = max_delay
+        self.reduce_concurrency = reduce_concurrency
+
+    @classmethod
+    def from_settings(cls, analysis_cls):
+        ''' policy of the runner settings: the number of attempts is the one
+        declared by the analysis steps (see StepResources), unless the
+        settings give one for all steps.
+        '''
+        job_attempts = settings.runner.job_attempts
+        if job_attempts.is_auto:
+            max_attempts = lambda step_id: \
+                analysis_cls.get_step_resources(step_id).max_attempts
+        else:
+            max_attempts = lambda step_id: int(job_attempts)
+        return cls(max_attempts, settings.runner.retry_delay,
+                   reduce_concurrency=settings.runner.retry_reduce_concurrency)
+
+    def can_retry(self, step_id, failed_attempts):
+        return failed_attempts < self.max_attempts(step_id)
+
+    def retry_delay(self, failed_attempts):
+        ''' delay before the next attempt of a job which has failed
+        failed_attempts times
+        '''
+        return min(self.max_delay,
+                   self.delay * self.backoff_factor ** (failed_attempts - 1))
+
+    def reserved_memory(self, memory, failed_attempts, memory_budget):
+        ''' memory reserved for the next attempt of a job which declared
+        memory needs: doubled at each attempt when reduce_concurrency is
+        set, within the memory budget
+        '''
+        if not self.reduce_concurrency:
+            return memory
+        return max(memory, min(memory * 2 ** failed_attempts, memory_budget))
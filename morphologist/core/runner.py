@@ -4,21 +4,31 @@ from __future__ import print_function
 
 from __future__ import absolute_import
 import os
+import re
+import json
 import time
+import socket
 import threading
 import multiprocessing
 import six
 
 import soma_workflow as sw
-from soma_workflow.client import WorkflowController, Helper, Workflow, Job, Group
+from soma_workflow.client import WorkflowController, Helper, Job
 from soma_workflow import configuration as swconf
 
-from capsul.pipeline import pipeline_workflow
 from capsul.pipeline import pipeline_tools
 
 from morphologist.core.settings import settings
 from morphologist.core.utils import BidiMap
 from morphologist.core.constants import ALL_SUBJECTS
+from morphologist.core.jobs_status import JobsStatusTable
+from morphologist.core.runtime_db import StepRuntimeDatabase
+from morphologist.core.planner import plan_study
+from morphologist.core.scheduling import group_jobs, job_step_ids
+from morphologist.core.retry import RetryPolicy
+from morphologist.core.workflow_builder import MissingInputFileError, \
+    MissingModelsError, check_missing_models, create_workflow_builder, \
+    study_workflow_name
 
 
 # XXX:
@@ -41,14 +51,26 @@ class Runner(object):
     UNKNOWN = 0x10
     ABORTED_NOTRUN = 0x20  # job not started but aborted
     INTERRUPTED = FAILED | STOPPED_BY_USER
+    # jobs keep running after the runner process exits
+    DETACHABLE = False
+    # backend name (see create_runner)
+    BACKEND = None
 
     def __init__(self, study):
         super(Runner, self).__init__()
         self._study = study
 
-    def run(self, subject_ids=ALL_SUBJECTS):
+    def run(self, subject_ids=ALL_SUBJECTS, incremental=False,
+            step_ids=None):
         raise NotImplementedError("Runner is an abstract class.")
 
+    def attach(self):
+        ''' Reconnect to the jobs of the study submitted by a previous runner
+        (possibly in another process). Returns True if some were found.
+        Runners which cannot do it return False.
+        '''
+        return False
+
     def is_running(self, subject_id=None, step_id=None, update_status=True):
         raise NotImplementedError("Runner is an abstract class.")
 
@@ -88,22 +110,498 @@ class Runner(object):
         self._study = study
 
 
-class MissingInputFileError(Exception):
-    pass
+def create_runner(study, backend=None):
+    ''' Create a runner for the given study, using the runner backend from
+    the settings if backend is not specified ('soma_workflow' or
+    'local_pool').
+    '''
+    if backend is None:
+        backend = settings.runner.backend
+    if backend == 'local_pool':
+        from morphologist.core.local_runner import LocalPoolRunner
+        return LocalPoolRunner(study)
+    elif backend == 'soma_workflow':
+        return SomaWorkflowRunner(study)
+    raise ValueError("invalid runner backend: '%s'" % backend)
+
+
+class WorkflowRunner(Runner):
+    '''
+    Base class for runners executing the workflow built from the analyses
+    pipelines (see _create_workflow).
+
+    Jobs are registered in a JobsStatusTable, which subclasses keep up to
+    date in _update_jobs_status, and from which all status queries are
+    answered.
+    '''
+
+    def __init__(self, study):
+        super(WorkflowRunner, self).__init__(study)
+        self._init_internal_parameters()
+
+    def _init_internal_parameters(self):
+        self._workflow_id = None # last submitted workflow
+        self._workflow_ids = [] # live workflows, in submission order
+        self._workflow_jobs = {} # workflow_id -> set(job_id)
+        self._jobid_to_step = {} # subjectid -> (job_id -> step)
+        self._jobs_status = JobsStatusTable(Runner.NOT_STARTED)
+        self._step_runtimes = {} # (subjectid, step) -> (job_id -> runtime)
+        self._input_dimensions = {} # subjectid -> (x, y, z)
+        self._attempts = {} # job_id -> number of failed attempts
+        # subjectid -> steps completed since its output manifest was written
+        self._manifest_step_ids = {}
+        self._retry_policy = RetryPolicy() # set up at each run
+
+    def _update_jobs_status(self):
+        raise NotImplementedError("WorkflowRunner is an abstract class.")
+
+    def _get_workflow_status(self):
+        raise NotImplementedError("WorkflowRunner is an abstract class.")
+
+    def get_status(self, subject_id=None, step_id=None, update_status=True):
+        if self._workflow_id is None:
+            status = Runner.NOT_STARTED
+        elif subject_id is None and step_id is None:
+            if update_status:
+                self._update_jobs_status()
+            status = self._get_workflow_status()
+        elif subject_id is not None and step_id is None:
+            status = self._get_subject_status(subject_id, update_status)
+        else:
+            status = self._get_step_status(subject_id, step_id, update_status)
+        return status
+
+    def is_running(self, subject_id=None, step_id=None, update_status=True):
+        status = self.get_status(subject_id, step_id, update_status)
+        return status == Runner.RUNNING
+
+    def get_running_step_ids(self, subject_id, update_status=True):
+        if update_status:
+            self._update_jobs_status()
+        running_step_ids = self._get_subject_filtered_step_ids(
+            subject_id, Runner.RUNNING)
+        return running_step_ids
+
+    def has_failed(self, subject_id=None, step_id=None, update_status=True):
+        status = self.get_status(subject_id, step_id, update_status)
+        return (status & Runner.FAILED) or (status & Runner.ABORTED_NOTRUN)
+
+    def get_failed_step_ids(self, subject_id, update_status=True):
+        if update_status:
+            self._update_jobs_status()
+        failed_step_ids = self._get_subject_filtered_step_ids(
+            subject_id, Runner.FAILED)
+        return failed_step_ids
+
+    def _cpus_number(self):
+        cpus_count = multiprocessing.cpu_count()
+        cpus_settings = settings.runner.selected_processing_units_n
+        if cpus_settings > cpus_count:
+            print("Warning: bad setting value:\n" +
+                  "  (selected_processing_units_n=%d) " % cpus_settings +
+                  "> number of available processing units: %d" % cpus_count)
+            cpus_number = min(cpus_settings, cpus_count)
+        else:
+            cpus_number = cpus_settings
+        return cpus_number
+
+    def _create_workflow(self, subject_ids, step_ids=None):
+        builder = create_workflow_builder(self._study, len(subject_ids))
+        return builder.build(subject_ids, step_ids)
+
+    def check_missing_models(self, pipeline, missing):
+        check_missing_models(pipeline, missing)
+
+    def plan(self, subject_ids=ALL_SUBJECTS, step_ids=None,
+             processes_n=None):
+        ''' Plan what run() would do, without submitting anything
+        (see planner.plan_study). The estimates are computed for the
+        selected number of processing units by default.
+        '''
+        if processes_n is None:
+            processes_n = self._cpus_number()
+        return plan_study(self._study, processes_n, subject_ids, step_ids)
+
+    def stop(self, subject_id=None, step_id=None):
+        ''' Stop all the analyses, or only the jobs of a subject (subject_id
+        given), of a step of a subject (both given) or of a step for all
+        subjects (step_id only). In the latter cases the other jobs keep
+        running, but the jobs depending on the stopped ones are not run.
+
+        The results of the interrupted steps of the concerned subjects are
+        cleared.
+        '''
+        if not self.is_running():
+            raise RuntimeError("Runner is not running.")
+        if subject_id is None and step_id is None:
+            self._workflow_stop()
+            return
+        if subject_id is None:
+            subject_ids = self._jobs_status.subject_ids()
+        else:
+            subject_ids = [subject_id]
+        job_ids = set()
+        for subject_id in subject_ids:
+            job_ids.update(
+                [job_id
+                 for job_id in self._jobs_status.job_ids(subject_id, step_id)
+                 if self._jobs_status.job_status(job_id)
+                     in (Runner.NOT_STARTED, Runner.RUNNING, Runner.UNKNOWN)])
+        if job_ids:
+            self._jobs_stop(job_ids)
+        self._clear_interrupted_results(subject_ids)
+
+    def _workflow_stop(self):
+        raise NotImplementedError("WorkflowRunner is an abstract class.")
+
+    def _jobs_stop(self, job_ids):
+        ''' stop the given jobs (and thus the jobs depending on them), and
+        wait for them to be stopped
+        '''
+        raise NotImplementedError("WorkflowRunner is an abstract class.")
 
+    def _get_interrupted_step_ids(self, update_status = True):
+        """ Interrupted steps are either steps with an interrupted job (killed
+        or failed), or steps with both run and not-run jobs (all jobs have not
+        been performed, but some of them have)
+        """
+        if update_status:
+            self._update_jobs_status()
+        filtered_step_ids_by_subject_id = {}
+        for subject_id in self._jobid_to_step:
+            interrupted_step_ids = set()
+            for step_id in self._jobs_status.step_ids(subject_id):
+                counts = self._jobs_status.counts(subject_id, step_id)
+                if [status for status in counts
+                        if status & Runner.INTERRUPTED]:
+                    interrupted_step_ids.add(step_id)
+                elif Runner.SUCCESS in counts \
+                        and Runner.ABORTED_NOTRUN in counts:
+                    # both started and unfinished step
+                    interrupted_step_ids.add(step_id)
+            filtered_step_ids_by_subject_id[subject_id] = interrupted_step_ids
+        return filtered_step_ids_by_subject_id
 
-class MissingModelsError(MissingInputFileError):
-    pass
+    def _get_filtered_step_ids(self, status, update_status = True):
+        if update_status:
+            self._update_jobs_status()
+        filtered_step_ids_by_subject_id = {}
+        for subject_id in self._jobid_to_step:
+            filtered_step_ids = self._get_subject_filtered_step_ids(
+                subject_id, status)
+            filtered_step_ids_by_subject_id[subject_id] = filtered_step_ids
+        return filtered_step_ids_by_subject_id
 
+    def _get_subject_filtered_step_ids(self, subject_id, status):
+        return self._jobs_status.step_ids(subject_id, status)
 
-class  SomaWorkflowRunner(Runner):
+    def _get_subject_status(self, subject_id, update_status=True):
+        status = Runner.NOT_STARTED
+        if self._jobs_status.has_jobs(subject_id):
+            if update_status:
+                self._update_jobs_status()
+            status = Runner.SUCCESS
+            # XXX hypothesis: the workflow is linear for a subject (no branch)
+            for job_status in (Runner.RUNNING, Runner.FAILED,
+                               Runner.STOPPED_BY_USER, Runner.UNKNOWN):
+                if self._jobs_status.has_status(job_status, subject_id):
+                    status = job_status
+                    break
+        return status
+
+    def _get_step_status(self, subject_id, step_id, update_status=True):
+        status = Runner.NOT_STARTED
+        if self._jobs_status.has_jobs(subject_id, step_id):
+            if update_status:
+                self._update_jobs_status()
+            counts = self._jobs_status.counts(subject_id, step_id)
+            if len(counts) == 1:
+                status = list(counts.keys())[0]
+            else:
+                for job_status in (Runner.RUNNING, Runner.FAILED,
+                                   Runner.STOPPED_BY_USER,
+                                   Runner.ABORTED_NOTRUN, Runner.UNKNOWN):
+                    if job_status in counts:
+                        status = job_status
+                        break
+                else:
+                    # some jobs are done, the others are not started yet
+                    status = Runner.RUNNING
+        return status
+
+    def _get_subject_jobs(self, subject_id):
+        return self._jobid_to_step.get(subject_id, [])
+
+    def _is_subject_active(self, subject_id):
+        ''' True if some jobs of the subject are running or still have to
+        be run in the live workflows
+        '''
+        counts = self._jobs_status.counts(subject_id)
+        return bool([status for status in counts
+                     if status in (Runner.NOT_STARTED, Runner.RUNNING,
+                                   Runner.UNKNOWN)])
+
+    def _get_submittable_subject_ids(self, subject_ids):
+        ''' subjects which may be (re)submitted in incremental mode: the
+        subjects of an active workflow fragment are left running untouched.
+        '''
+        self._update_jobs_status()
+        return [subject_id for subject_id in subject_ids
+                if not self._is_subject_active(subject_id)]
+
+    def _forget_subject_jobs(self, subject_id):
+        job_ids = self._jobs_status.job_ids(subject_id)
+        for workflow_job_ids in six.itervalues(self._workflow_jobs):
+            workflow_job_ids.difference_update(job_ids)
+        self._jobs_status.remove_subject(subject_id)
+        self._jobid_to_step.pop(subject_id, None)
+        for job_id in job_ids:
+            self._attempts.pop(job_id, None)
+        self._forget_jobs(job_ids)
+
+    def _forget_jobs(self, job_ids):
+        ''' called when jobs of a previous workflow are replaced by the jobs
+        of a new workflow fragment. Subclasses may release their own
+        resources about these jobs here.
+        '''
+        pass
+
+    def _register_workflow_jobs(self, workflow, job_ids, workflow_id):
+        ''' fill _jobid_to_step and the jobs status table from the subjects
+        groups of the workflow. job_ids maps workflow jobs to job ids.
+
+        The workflow may be a fragment submitted alongside the previous
+        ones: the former jobs of its subjects are then replaced. Returns
+        the ids of the previous workflows which have no registered job left,
+        so that they can be deleted.
+        '''
+        jobs = []
+        for group in workflow.groups:
+            subjectid = group.user_storage
+            if subjectid:
+                for job in group_jobs(group):
+                    job_id = job_ids.get(job)
+                    if job_id is not None:
+                        jobs.append((job_id, subjectid, job_step_ids(job)))
+                    else:
+                        print('job without mapping, subject: %s, job: %s'
+                              % (subjectid, job.name))
+        return self._register_jobs(jobs, workflow_id)
+
+    def _register_jobs(self, jobs, workflow_id):
+        ''' register the (job_id, subject_id, step_id) jobs of a workflow
+        (see _register_workflow_jobs). step_id may be a list of step ids
+        for a job covering several steps (see scheduling.fuse_short_jobs).
+        '''
+        registered_job_ids = set()
+        registered_subject_ids = set()
+        for job_id, subjectid, step_id in jobs:
+            if isinstance(step_id, (list, tuple)):
+                step_id = step_id[0] if len(step_id) == 1 else tuple(step_id)
+            if subjectid not in registered_subject_ids:
+                registered_subject_ids.add(subjectid)
+                self._forget_subject_jobs(subjectid)
+                self._jobid_to_step[subjectid] = BidiMap('job_id', 'step_id')
+            self._jobid_to_step[subjectid][job_id] = step_id
+            self._jobs_status.add_job(job_id, subjectid, step_id)
+            registered_job_ids.add(job_id)
+        orphan_workflow_ids = [wf_id for wf_id in self._workflow_ids
+                               if not self._workflow_jobs[wf_id]]
+        for wf_id in orphan_workflow_ids:
+            self._workflow_ids.remove(wf_id)
+            del self._workflow_jobs[wf_id]
+        self._workflow_id = workflow_id
+        self._workflow_ids.append(workflow_id)
+        self._workflow_jobs[workflow_id] = registered_job_ids
+        return orphan_workflow_ids
+
+    def _record_run(self, workflow, step_ids):
+        ''' add the subjects of a submitted workflow to the study runs
+        history
+        '''
+        subject_ids = [group.user_storage for group in workflow.groups
+                       if group.user_storage]
+        try:
+            self._study.record_run(subject_ids, step_ids, self.BACKEND)
+        except Exception as e:
+            print('could not record the run in the study:', e)
+
+    def _setup_retry_policy(self):
+        self._retry_policy = RetryPolicy.from_settings(
+            self._study.analysis_cls())
+
+    def _failed_attempt_retry_delay(self, job_id):
+        ''' count a failed attempt of a job. Returns the delay before its
+        next attempt, or None if it must not be retried.
+        '''
+        subject_id, step_ids = self._jobs_status.job_step_ids(job_id)
+        attempts = self._attempts.get(job_id, 0) + 1
+        self._attempts[job_id] = attempts
+        if not [step_id for step_id in step_ids
+                if self._retry_policy.can_retry(step_id, attempts)]:
+            return None
+        max_attempts = max([self._retry_policy.max_attempts(step_id)
+                            for step_id in step_ids])
+        delay = self._retry_policy.retry_delay(attempts)
+        print('step %s of subject %s failed (attempt %d/%d), retried in %g s'
+              % (', '.join(step_ids), subject_id, attempts, max_attempts,
+                 delay))
+        return delay
+
+    def _record_step_runtimes(self, changes, job_runtimes):
+        '''
+        Store in the study runtime database the runtimes of the steps
+        completed with these jobs status changes.
+
+        Parameters
+        ----------
+        changes: list
+            (job_id, old_status, new_status), as returned by
+            JobsStatusTable.sync
+        job_runtimes: dict
+            job_id -> (wall_time, cpu_time, peak_rss) of the succeeded
+            jobs. Runtimes may be None when unknown.
+        '''
+        records = []
+        for job_id, _, status in changes:
+            if status != Runner.SUCCESS:
+                continue
+            subject_id, step_ids = self._jobs_status.job_step_ids(job_id)
+            for step_id in step_ids:
+                runtimes = self._step_runtimes.setdefault(
+                    (subject_id, step_id), {})
+                runtime = job_runtimes.get(job_id)
+                if len(step_ids) != 1:
+                    # the runtime of a fused job cannot be split between
+                    # its steps: the step runtime is unknown
+                    runtimes[job_id] = None
+                elif runtime is not None:
+                    runtimes[job_id] = runtime
+                counts = self._jobs_status.counts(subject_id, step_id)
+                if list(counts.keys()) != [Runner.SUCCESS]:
+                    continue
+                del self._step_runtimes[(subject_id, step_id)]
+                if runtimes and None not in runtimes.values():
+                    records.append(self._step_runtime_record(
+                        subject_id, step_id, list(runtimes.values())))
+        if records:
+            try:
+                StepRuntimeDatabase.from_study(self._study).add_records(
+                    records)
+            except Exception as e:
+                print('could not record steps runtimes:', e)
+
+    def _record_completed_steps(self, changes):
+        ''' record the steps provenance (see StepsProvenance) of the steps
+        completed with these jobs status changes, and write the output
+        manifests (see OutputManifest) of the subjects which have no more
+        jobs to run.
+
+        Writing a manifest goes through all the outputs of the subject: it
+        is done once the jobs of the subject have ended, rather than on
+        each status update.
+        '''
+        completed_step_ids = {}
+        for job_id, _, status in changes:
+            if status != Runner.SUCCESS:
+                continue
+            subject_id, step_ids = self._jobs_status.job_step_ids(job_id)
+            # a step is completed when all its jobs have succeeded
+            step_ids = [step_id for step_id in step_ids
+                        if list(self._jobs_status.counts(
+                            subject_id, step_id).keys()) == [Runner.SUCCESS]]
+            completed_step_ids.setdefault(subject_id, set()).update(step_ids)
+        for subject_id, step_ids in six.iteritems(completed_step_ids):
+            self._manifest_step_ids.setdefault(subject_id, set()).update(
+                step_ids)
+            if not step_ids or subject_id not in self._study.analyses:
+                continue
+            try:
+                self._study.analyses[subject_id].record_steps_provenance(
+                    sorted(step_ids))
+            except Exception as e:
+                print('could not record the steps provenance of %s:'
+                      % subject_id, e)
+        changed_subject_ids = set([self._jobs_status.job_step(job_id)[0]
+                                   for job_id, _, _ in changes])
+        checksums = settings.runner.manifest_checksums
+        for subject_id in changed_subject_ids:
+            if subject_id not in self._manifest_step_ids \
+                    or self._is_subject_active(subject_id):
+                continue
+            step_ids = self._manifest_step_ids.pop(subject_id)
+            if subject_id not in self._study.analyses:
+                continue
+            try:
+                self._study.analyses[subject_id].write_output_manifest(
+                    sorted(step_ids), checksums)
+            except Exception as e:
+                print('could not write the output manifest of %s:'
+                      % subject_id, e)
+
+    def _step_runtime_record(self, subject_id, step_id, runtimes):
+        cpu_times = [r[1] for r in runtimes if r[1] is not None]
+        peak_rss = [r[2] for r in runtimes if r[2] is not None]
+        return {'step_id': step_id, 'subject_id': subject_id,
+                'host': self._get_runtime_host(),
+                'dimensions': self._get_input_dimensions(subject_id),
+                'wall_time': sum([r[0] for r in runtimes]),
+                'cpu_time': sum(cpu_times) if cpu_times else None,
+                'peak_rss': max(peak_rss) if peak_rss else None}
+
+    def _get_runtime_host(self):
+        return socket.gethostname()
+
+    def _get_input_dimensions(self, subject_id):
+        if subject_id not in self._input_dimensions:
+            dimensions = None
+            subject = self._study.subjects.get(subject_id)
+            if subject is not None:
+                try:
+                    # imported here: aims is long to import, and only
+                    # needed when steps complete
+                    from soma import aims
+                    finder = aims.Finder()
+                    if finder.check(subject.filename):
+                        dimensions = tuple(
+                            finder.header()['volume_dimension'][:3])
+                except Exception:
+                    pass
+            self._input_dimensions[subject_id] = dimensions
+        return self._input_dimensions[subject_id]
+
+    def _clear_interrupted_results(self, subject_ids=None):
+        interrupted_step_ids = self._get_interrupted_step_ids()
+        for subject_id, step_ids in six.iteritems(interrupted_step_ids):
+            if subject_ids is not None and subject_id not in subject_ids:
+                continue
+            if step_ids:
+                analysis = self._study.analyses[subject_id]
+                analysis.clear_results(step_ids)
+
+
+class  SomaWorkflowRunner(WorkflowRunner):
+    '''
+    Runs the analyses through soma-workflow.
+
+    The submitted workflows outlive the runner: their ids and jobs -> steps
+    mapping are saved in the study directory (see STATE_FILENAME), so that
+    a runner created later, possibly in another process, can attach to them
+    when the study is reopened.
+    '''
     WORKFLOW_NAME_SUFFIX = "Morphologist user friendly analysis"
+    STATE_FILENAME = 'runner_state.json'
+    DETACHABLE = True
+    BACKEND = 'soma_workflow'
 
     def __init__(self, study):
         super(SomaWorkflowRunner, self).__init__(study)
 
         self._workflow_controller = None
-        self._init_internal_parameters()
+
+    def _init_internal_parameters(self):
+        super(SomaWorkflowRunner, self)._init_internal_parameters()
+        self._retries_due = {} # job_id -> time of its next attempt
 
     def get_soma_workflow_credentials(self):
         resource_id = self._study.somaworkflow_computing_resource
@@ -121,11 +619,6 @@ class  SomaWorkflowRunner(Runner):
 
         return resource_id, login, password, rsa_key_pass
 
-    def _init_internal_parameters(self):
-        self._workflow_id = None
-        self._jobid_to_step = {} # subjectid -> (job_id -> step)
-        self._cached_jobs_status = None
-
     def resource_id(self):
         if self._workflow_controller is None:
             resource_id = None
@@ -159,20 +652,92 @@ class  SomaWorkflowRunner(Runner):
             self._delete_old_workflows()
 
     def _delete_old_workflows(self):
+        # workflows left by former versions, which could not be attached to.
+        # The workflows of a saved runner state are kept.
+        kept_workflow_ids = set(self._workflow_ids)
+        state = self._load_state()
+        if state is not None:
+            kept_workflow_ids.update([workflow['workflow_id']
+                                      for workflow in state['workflows']])
         for (workflow_id, (name, _)) \
                 in six.iteritems(self._workflow_controller.workflows()):
-            if name is not None and name.endswith(self.WORKFLOW_NAME_SUFFIX):
+            if name is not None and name.endswith(self.WORKFLOW_NAME_SUFFIX) \
+                    and workflow_id not in kept_workflow_ids:
                 self._workflow_controller.delete_workflow(workflow_id)
 
-    def run(self, subject_ids=ALL_SUBJECTS):
+    def _state_filename(self):
+        return os.path.join(self._study.output_directory,
+                            self.STATE_FILENAME)
+
+    def _save_state(self):
+        ''' save the live workflows and their jobs in the study directory '''
+        workflows = []
+        for workflow_id in self._workflow_ids:
+            workflow_job_ids = self._workflow_jobs[workflow_id]
+            jobs = []
+            for subject_id, job_steps in six.iteritems(self._jobid_to_step):
+                jobs += [[job_id, subject_id, job_steps[job_id]]
+                         for job_id in job_steps
+                         if job_id in workflow_job_ids]
+            workflows.append({'workflow_id': workflow_id, 'jobs': jobs})
+        # failed jobs waiting to be retried: [job_id, due time, attempts]
+        retries = [[job_id, due_time, self._attempts.get(job_id, 0)]
+                   for job_id, due_time in six.iteritems(self._retries_due)]
+        state = {'resource_id': self.resource_id(),
+                 'workflow_name': study_workflow_name(self._study),
+                 'workflows': workflows,
+                 'retries': retries}
+        filename = self._state_filename()
+        try:
+            if not workflows:
+                if os.path.exists(filename):
+                    os.unlink(filename)
+                return
+            # write then rename, not to leave a truncated file behind
+            tmp_filename = filename + '.tmp'
+            with open(tmp_filename, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            print('could not save the runner state:', e)
+
+    def _load_state(self):
+        ''' saved runner state of the study, or None if there is none for
+        the current computing resource
+        '''
+        try:
+            with open(self._state_filename()) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('resource_id') != self.resource_id():
+            return None
+        return state
+
+    def run(self, subject_ids=ALL_SUBJECTS, incremental=False,
+            step_ids=None):
+        ''' Run the analyses of the given subjects, and only the given
+        pipeline steps if step_ids is specified.
+
+        In incremental mode, the live workflows are kept: only the subjects
+        which are not currently processed are submitted, as a new workflow
+        fragment running alongside the previous ones.
+        '''
         self._setup_soma_workflow_controller()
-        self._init_internal_parameters()
+        if not incremental:
+            for workflow_id in self._workflow_ids:
+                self._workflow_controller.delete_workflow(workflow_id)
+            self._init_internal_parameters()
+            self._save_state()
+        self._setup_retry_policy()
         if self._workflow_controller.scheduler_config:
             # in local mode only
             cpus_number = self._cpus_number()
             self._workflow_controller.scheduler_config.set_proc_nb(cpus_number)
         if subject_ids == ALL_SUBJECTS:
             subject_ids = self._study.subjects
+        if incremental:
+            subject_ids = self._get_submittable_subject_ids(subject_ids)
         # setup shared path in study_config
         study_config = self._study
         swf_resource = study_config.somaworkflow_computing_resource
@@ -192,140 +757,109 @@ class  SomaWorkflowRunner(Runner):
                     ['brainvisa', 'de25977f-abf5-9f1c-4384-2585338cd7af'])
 
         #self._check_input_files(subject_ids)
-        workflow = self._create_workflow(subject_ids)
+        workflow = self._create_workflow(subject_ids, step_ids)
         jobs = [j for j in workflow.jobs if isinstance(j, Job)]
-        if self._workflow_id is not None:
-            self._workflow_controller.delete_workflow(self._workflow_id)
         if len(jobs) == 0:
             # empty workflow: nothing to do
-            self._workflow_id = None
             return
-        self._workflow_id = self._workflow_controller.submit_workflow(
+        workflow_id = self._workflow_controller.submit_workflow(
             workflow, name=workflow.name)
-        self._build_jobid_to_step()
+        self._build_jobid_to_step(workflow_id)
+        self._record_run(workflow, step_ids)
 
         # run transfers, if any
-        Helper.transfer_input_files(self._workflow_id,
-                                    self._workflow_controller)
+        Helper.transfer_input_files(workflow_id, self._workflow_controller)
         # the status does not change immediately after run,
         # so we wait for the status WORKFLOW_IN_PROGRESS or timeout
-        status = self._workflow_controller.workflow_status(self._workflow_id)
+        status = self._workflow_controller.workflow_status(workflow_id)
         try_count = 8
         while ((status != sw.constants.WORKFLOW_IN_PROGRESS) and \
                                                 (try_count > 0)):
             time.sleep(0.25)
-            status = self._workflow_controller.workflow_status(
-                self._workflow_id)
+            status = self._workflow_controller.workflow_status(workflow_id)
             try_count -= 1
 
-    def _cpus_number(self):
-        cpus_count = multiprocessing.cpu_count()
-        cpus_settings = settings.runner.selected_processing_units_n
-        if cpus_settings > cpus_count:
-            print("Warning: bad setting value:\n" +
-                  "  (selected_processing_units_n=%d) " % cpus_settings +
-                  "> number of available processing units: %d" % cpus_count)
-            cpus_number = min(cpus_settings, cpus_count)
-        else:
-            cpus_number = cpus_settings
-        return cpus_number
-
-    def _create_workflow(self, subject_ids):
-        study_config = self._study
-        workflow = Workflow(
-            name='Morphologist UI - %s' % study_config.study_name,
-            jobs=[])
-        workflow.root_group = []
-        initial_vol_format = study_config.volumes_format
+    def attach(self):
+        ''' Attach the runner to the workflows of the study known by the
+        soma-workflow controller, submitted by another runner.
 
-        priority = (len(subject_ids) - 1) * 100
-        for subject_id in subject_ids:
-            analysis = self._study.analyses[subject_id]
-            subject = self._study.subjects[subject_id]
-
-            analysis.set_parameters(subject)
-            #analysis.propagate_parameters()
-            pipeline = analysis.pipeline
-            pipeline.enable_all_pipeline_steps()
-            # force highest priority normalization method
-            # FIXME: specific knowledge of Morphologist should not be used here.
-            pipeline.Normalization_select_Normalization_pipeline \
-                  = 'NormalizeSPM'
-            pipeline_tools.disable_runtime_steps_with_existing_outputs(
-                pipeline)
-
-            missing = pipeline_tools.nodes_with_missing_inputs(pipeline)
-            if missing:
-                self.check_missing_models(pipeline, missing)
-                print('MISSING INPUTS IN NODES:', missing)
-                raise MissingInputFileError("subject: %s" % subject_id)
-
-            wf = pipeline_workflow.workflow_from_pipeline(
-                pipeline, study_config=study_config,
-                jobs_priority=priority)
-            njobs = len([j for j in wf.jobs if isinstance(j, Job)])
-            if njobs != 0:
-                priority -= 100
-                workflow.jobs += wf.jobs
-                workflow.dependencies += wf.dependencies
-                group = Group(wf.root_group,
-                            name='Morphologist %s' % str(subject))
-                group.user_storage = subject_id
-                workflow.root_group.append(group) # += wf.root_group
-                workflow.groups += [group] + wf.groups
-
-        return workflow
-
-    def check_missing_models(self, pipeline, missing):
-        if 'SulciRecognition.SPAM_recognition09.global_recognition' in missing:
-            node = missing[
-                'SulciRecognition.SPAM_recognition09.global_recognition']
-            model = [m[0] for m in node if m[0] == 'model']
-            if model:
-                raise MissingModelsError(
-                    "SPAM recognition models are not installed.")
-
-    def _build_jobid_to_step(self):
-        self._jobid_to_step = {}
-        workflow = self._workflow_controller.workflow(self._workflow_id)
-        for group in workflow.groups:
-            subjectid = group.user_storage
-            if subjectid:
-                self._jobid_to_step[subjectid] = BidiMap(
-                    'job_id', 'step_id')
-                job_list = list(group.elements)
-                while job_list:
-                    job = job_list.pop(0)
-                    if isinstance(job, Group):
-                        job_list += job.elements
-                    else:
-                        job_att = workflow.job_mapping.get(job)
-                        if job_att:
-                            job_id = job_att.job_id
-                            step_id = job.user_storage or job.name
-                            self._jobid_to_step[subjectid][job_id] = step_id
-                        else:
-                            print('job without mapping, subject: %s, job: %s'
-                                  % (subjectid, job.name))
+        The saved runner state is used when there is one, otherwise the
+        workflows are looked up by name, and their jobs mapping is fetched
+        from soma-workflow.
+        '''
+        self._setup_soma_workflow_controller()
+        self._init_internal_parameters()
+        live_workflows = self._workflow_controller.workflows()
+        state = self._load_state()
+        if state is not None:
+            for workflow in state['workflows']:
+                workflow_id = workflow['workflow_id']
+                if workflow_id in live_workflows:
+                    self._register_jobs(
+                        [tuple(job) for job in workflow['jobs']],
+                        workflow_id)
+        else:
+            name = study_workflow_name(self._study)
+            workflow_ids = sorted(
+                [workflow_id for workflow_id, (workflow_name, _)
+                 in six.iteritems(live_workflows)
+                 if workflow_name == name])
+            for workflow_id in workflow_ids:
+                self._build_jobid_to_step(workflow_id)
+        self._seed_jobs_status()
+        self._setup_retry_policy()
+        if state is not None:
+            self._restore_retries(state.get('retries', []))
+        # forget the workflows which have been deleted in the meantime
+        self._save_state()
+        return len(self._workflow_ids) != 0
+
+    def _restore_retries(self, retries):
+        ''' retries of the saved runner state (see _save_state) '''
+        for job_id, due_time, attempts in retries:
+            if job_id not in self._jobs_status:
+                # its workflow has been deleted in the meantime
+                continue
+            self._attempts[job_id] = attempts
+            self._retries_due[job_id] = due_time
+            self._jobs_status.set_job_status(job_id, Runner.NOT_STARTED)
+
+    def _seed_jobs_status(self):
+        ''' set the current status of the attached jobs, without handling
+        them as status changes: the jobs which have ended before the
+        attachment are not completed again (runtimes, manifests and
+        provenance are not recorded twice, on each reopening of the study)
+        '''
+        raw_states, _ = self._get_jobs_raw_states()
+        self._jobs_status.sync(raw_states, self._decode_job_state)
+
+    def _build_jobid_to_step(self, workflow_id):
+        workflow = self._workflow_controller.workflow(workflow_id)
+        job_ids = dict([(job, job_att.job_id)
+                        for job, job_att
+                            in six.iteritems(workflow.job_mapping)])
+        orphan_workflow_ids = self._register_workflow_jobs(
+            workflow, job_ids, workflow_id)
+        # all the subjects of these workflows have been resubmitted
+        for orphan_workflow_id in orphan_workflow_ids:
+            self._workflow_controller.delete_workflow(orphan_workflow_id)
+        self._save_state()
 
     def _define_workflow_name(self):
         return self._study.name + " " + self.WORKFLOW_NAME_SUFFIX
 
-    def is_running(self, subject_id=None, step_id=None, update_status=True):
-        status = self.get_status(subject_id, step_id, update_status)
-        return status == Runner.RUNNING
-
-    def get_running_step_ids(self, subject_id, update_status=True):
-        if update_status:
-            self._update_jobs_status()
-        running_step_ids = self._get_subject_filtered_step_ids(
-            subject_id, Runner.RUNNING)
-        return running_step_ids
-
     def wait(self, subject_id=None, step_id=None):
         if subject_id is None and step_id is None:
-            Helper.wait_workflow(
-                self._workflow_id, self._workflow_controller)
+            while True:
+                for workflow_id in list(self._workflow_ids):
+                    Helper.wait_workflow(workflow_id,
+                                         self._workflow_controller)
+                self._update_jobs_status()
+                if not self._retries_due:
+                    break
+                time.sleep(max(0., min(self._retries_due.values())
+                               - time.time()))
+                self._restart_due_jobs()
         elif subject_id is not None:
             if step_id is None:
                 raise NotImplementedError
@@ -333,182 +867,245 @@ class  SomaWorkflowRunner(Runner):
                 self._step_wait(subject_id, step_id)
         else:
             raise NotImplementedError
+        self._transfer_output_files()
+
+    def _transfer_output_files(self):
         # transfer back files, if any
-        Helper.transfer_output_files(self._workflow_id,
-                                     self._workflow_controller)
+        for workflow_id in self._workflow_ids:
+            Helper.transfer_output_files(workflow_id,
+                                         self._workflow_controller)
 
     def _step_wait(self, subject_id, step_id):
-        job_id = self._jobid_to_step[subject_id][step_id, 'step_id']
-        self._workflow_controller.wait_job([job_id])
-
-    def has_failed(self, subject_id=None, step_id=None, update_status=True):
-        status = self.get_status(subject_id, step_id, update_status)
-        return (status & Runner.FAILED) or (status & Runner.ABORTED_NOTRUN)
-
-    def get_failed_step_ids(self, subject_id, update_status=True):
-        if update_status:
-            self._update_jobs_status()
-        failed_step_ids = self._get_subject_filtered_step_ids(
-            subject_id, Runner.FAILED)
-        return failed_step_ids
-
-    def stop(self, subject_id=None, step_id=None):
-        if not self.is_running():
-            raise RuntimeError("Runner is not running.")
-        if subject_id is None and step_id is None:
-            self._workflow_stop()
-        elif subject_id is not None:
-            if step_id is None:
-                raise NotImplementedError
-            else:
-                raise NotImplementedError
-        else:
-            raise NotImplementedError
+        job_ids = list(self._jobs_status.job_ids(subject_id, step_id))
+        self._workflow_controller.wait_job(job_ids)
+
+    def _jobs_stop(self, job_ids):
+        self._cancel_retries(job_ids)
+        # soma-workflow stops jobs workflow by workflow
+        for workflow_id in self._workflow_ids:
+            workflow_job_ids = [job_id for job_id in job_ids
+                                if job_id in self._workflow_jobs[workflow_id]]
+            if workflow_job_ids:
+                self._workflow_controller.stop_jobs(workflow_id,
+                                                    workflow_job_ids)
+        self._workflow_controller.wait_job(list(job_ids))
+        self._transfer_output_files()
 
     def _workflow_stop(self):
-        self._workflow_controller.stop_workflow(self._workflow_id)
+        self._cancel_retries(list(self._retries_due))
+        for workflow_id in self._workflow_ids:
+            self._workflow_controller.stop_workflow(workflow_id)
 
-        # transfer back files, if any
-        Helper.transfer_output_files(self._workflow_id,
-                                     self._workflow_controller)
+        self._transfer_output_files()
 
-        interrupted_step_ids = self._get_interrupted_step_ids()
-        for subject_id, step_ids in six.iteritems(interrupted_step_ids):
-            if step_ids:
-                analysis = self._study.analyses[subject_id]
-                analysis.clear_results(step_ids)
-
-    def _get_interrupted_step_ids(self, update_status = True):
-        """ Interrupted steps are either steps with an interrupted job (killed
-        or failed), or steps with both run and not-run jobs (all jobs have not
-        been performed, but some of them have)
-        """
-        if update_status:
-            self._update_jobs_status()
-        filtered_step_ids_by_subject_id = {}
-        for subject_id in self._jobid_to_step:
-            subject_jobs = self._get_subject_jobs(subject_id)
-            jobs_status = self._get_jobs_status(update_status=False)
-            interrupted_step_ids = set()
-            started_step_ids = set()
-            notrun_step_ids = set()
-            for job_id, step in six.iteritems(subject_jobs):
-                if step in interrupted_step_ids:
-                    continue # this one is already in the list
-                job_status = jobs_status[job_id]
-                if job_status & Runner.INTERRUPTED:
-                    interrupted_step_ids.add(step)
-                else:
-                    if job_status & Runner.SUCCESS:
-                        started_step_ids.add(step)
-                        if step in notrun_step_ids:
-                            # both started and unfinished step
-                            interrupted_step_ids.add(step)
-                    elif job_status & Runner.ABORTED_NOTRUN:
-                        notrun_step_ids.add(step)
-                        if step in started_step_ids:
-                            # both started and unfinished step
-                            interrupted_step_ids.add(step)
-            filtered_step_ids_by_subject_id[subject_id] = interrupted_step_ids
-        return filtered_step_ids_by_subject_id
-
-    def _get_filtered_step_ids(self, status, update_status = True):
-        if update_status:
-            self._update_jobs_status()
-        filtered_step_ids_by_subject_id = {}
-        for subject_id in self._jobid_to_step:
-            filtered_step_ids = self._get_subject_filtered_step_ids(
-                subject_id, status)
-            filtered_step_ids_by_subject_id[subject_id] = filtered_step_ids
-        return filtered_step_ids_by_subject_id
-
-    def _get_subject_filtered_step_ids(self, subject_id, status):
-        step_ids = set()
-        subject_jobs = self._get_subject_jobs(subject_id)
-        jobs_status = self._get_jobs_status(update_status=False)
-        for job_id in subject_jobs:
-            job_status = jobs_status[job_id]
-            if job_status & status:
-                step_ids.add(subject_jobs[job_id])
-        return list(step_ids)
-
-    def get_status(self, subject_id=None, step_id=None, update_status=True):
-        if self._workflow_id is None:
-            status = Runner.NOT_STARTED
-        elif subject_id is None and step_id is None:
-            if update_status:
-                self._update_jobs_status()
-            status = self._get_workflow_status()
-        elif subject_id is not None and step_id is None:
-            status = self._get_subject_status(subject_id, update_status)
-        else:
-            status = self._get_step_status(subject_id, step_id, update_status)
-        return status
+        self._clear_interrupted_results()
 
     def _get_workflow_status(self):
-        sw_status \
-            = self._workflow_controller.workflow_status(self._workflow_id)
-        if (sw_status in [sw.constants.WORKFLOW_IN_PROGRESS,
-                          sw.constants.WORKFLOW_NOT_STARTED]):
+        # failed jobs waiting to be retried keep the analyses running
+        running = bool(self._retries_due)
+        for workflow_id in self._workflow_ids:
+            sw_status \
+                = self._workflow_controller.workflow_status(workflow_id)
+            if (sw_status in [sw.constants.WORKFLOW_IN_PROGRESS,
+                              sw.constants.WORKFLOW_NOT_STARTED]):
+                running = True
+                break
+        if running:
             status = Runner.RUNNING
         else:
-            has_failed = (len(Helper.list_failed_jobs(
-                self._workflow_id, self._workflow_controller,
-                include_aborted_jobs=True,
-                include_user_killed_jobs=True)) != 0)
+            has_failed = self._jobs_status.has_status(
+                Runner.INTERRUPTED | Runner.ABORTED_NOTRUN)
             if has_failed:
                 status = Runner.FAILED
             else:
                 status = Runner.SUCCESS
         return status
 
-    def _get_subject_status(self, subject_id, update_status=True):
-        status = Runner.NOT_STARTED
-        subject_jobs = self._get_subject_jobs(subject_id)
-        if subject_jobs:
-            jobs_status=self._get_jobs_status(update_status)
-            status = Runner.SUCCESS
-            for job_id in subject_jobs:
-                job_status = jobs_status[job_id]
-                # XXX hypothesis: the workflow is linear for a subject (no branch)
-                if job_status & (Runner.RUNNING | Runner.INTERRUPTED):
-                    status = job_status
-                    break
-                elif job_status & Runner.UNKNOWN:
-                    status = job_status
-        return status
-
-    def _get_step_status(self, subject_id, step_id, update_status=True):
-        status = Runner.NOT_STARTED
-        subject_jobs = self._get_subject_jobs(subject_id)
-        if subject_jobs:
-            # WARNING: assumes only 1 job per step. FIXME.
-            job_id = subject_jobs[step_id, "step_id"]
-            jobs_status = self._get_jobs_status(update_status)
-            status = jobs_status[job_id]
-        return status
-
-    def _get_subject_jobs(self, subject_id):
-        return self._jobid_to_step.get(subject_id, [])
-
-    def _get_jobs_status(self, update_status=True):
-        if update_status or self._cached_jobs_status is None:
-            self._update_jobs_status()
-        return self._cached_jobs_status
-
     def _update_jobs_status(self):
-        jobs_status = {} # job_id -> status
-        job_info_seq = self._workflow_controller.workflow_elements_status(
-            self._workflow_id)[0]
-        for job_info in job_info_seq:
-            job_id = job_info[0]
-            sw_status = job_info[1]
-            exit_info = job_info[3]
-            exit_status, exit_value, _, _ = exit_info
-            status = self._sw_status_to_runner_status(sw_status, exit_status,
-                                                      exit_value)
-            jobs_status[job_id] = status
-        self._cached_jobs_status = jobs_status
+        """ Synchronize the jobs status table with soma-workflow. Only jobs
+        whose soma-workflow state has changed since the last update are
+        decoded and applied.
+        """
+        raw_states, jobs_info = self._get_jobs_raw_states()
+        changes = self._jobs_status.sync(raw_states, self._decode_job_state)
+        runtimes = dict([(job_id, self._job_info_runtime(jobs_info[job_id]))
+                         for job_id, _, status in changes
+                         if status == Runner.SUCCESS])
+        self._record_step_runtimes(changes, runtimes)
+        # retried jobs keep their subject active: its manifest is written
+        # after the retries
+        self._schedule_retries(changes)
+        self._record_completed_steps(changes)
+        self._restart_due_jobs()
+        return changes
+
+    def _get_jobs_raw_states(self):
+        ''' (job_id, raw_state) list, and job_id -> soma-workflow job info
+        dict of the jobs of the live workflows
+        '''
+        raw_states = []
+        jobs_info = {}
+        for workflow_id in self._workflow_ids:
+            job_info_seq = self._workflow_controller.workflow_elements_status(
+                workflow_id)[0]
+            raw_states += [(job_info[0],
+                            (job_info[1],) + tuple(job_info[3][:2]))
+                           for job_info in job_info_seq]
+            jobs_info.update([(job_info[0], job_info)
+                              for job_info in job_info_seq])
+        return raw_states, jobs_info
+
+    def _schedule_retries(self, changes):
+        failed_job_ids = [job_id for job_id, _, status in changes
+                          if status == Runner.FAILED]
+        if not failed_job_ids:
+            return
+        if not hasattr(self._workflow_controller, 'restart_jobs'):
+            # this soma-workflow version cannot restart single jobs
+            for job_id in failed_job_ids:
+                subject_id, step_ids = self._jobs_status.job_step_ids(job_id)
+                if [step_id for step_id in step_ids
+                        if self._retry_policy.max_attempts(step_id) > 1]:
+                    print('step %s of subject %s failed, and cannot be '
+                          'retried: this version of soma-workflow cannot '
+                          'restart jobs' % (', '.join(step_ids), subject_id))
+            return
+        scheduled = False
+        for job_id in failed_job_ids:
+            delay = self._failed_attempt_retry_delay(job_id)
+            if delay is not None:
+                # the soma-workflow state of the job stays failed until it
+                # is restarted: its new status is kept meanwhile
+                self._jobs_status.set_job_status(job_id, Runner.NOT_STARTED)
+                self._retries_due[job_id] = time.time() + delay
+                scheduled = True
+        if scheduled:
+            self._save_state()
+
+    def _restart_due_jobs(self):
+        now = time.time()
+        due_job_ids = set([job_id for job_id, due_time
+                           in six.iteritems(self._retries_due)
+                           if due_time <= now])
+        if not due_job_ids:
+            return
+        restarted_job_ids = set(due_job_ids)
+        for workflow_id in self._workflow_ids:
+            job_ids = due_job_ids.intersection(
+                self._workflow_jobs[workflow_id])
+            if job_ids:
+                # the jobs not run because of the failure are run again too
+                job_ids.update(self._aborted_dependent_jobs(workflow_id,
+                                                            job_ids))
+                restarted_job_ids.update(job_ids)
+                self._workflow_controller.restart_jobs(workflow_id,
+                                                       list(job_ids))
+        for job_id in due_job_ids:
+            del self._retries_due[job_id]
+        for job_id in restarted_job_ids:
+            if job_id not in self._jobs_status:
+                continue
+            self._jobs_status.set_job_status(job_id, Runner.NOT_STARTED)
+            self._jobs_status.forget_raw_state(job_id)
+        self._save_state()
+
+    def _aborted_dependent_jobs(self, workflow_id, job_ids):
+        ''' ids of the jobs of the workflow depending on the given ones,
+        recursively, which have not been run (ABORTED_NOTRUN)
+        '''
+        workflow = self._workflow_controller.workflow(workflow_id)
+        ids = dict([(job, job_att.job_id)
+                    for job, job_att in six.iteritems(workflow.job_mapping)])
+        dependents = {}
+        for upstream_job, job in workflow.dependencies:
+            dependents.setdefault(ids.get(upstream_job), set()).add(
+                ids.get(job))
+        aborted_job_ids = set()
+        job_ids = list(job_ids)
+        while job_ids:
+            for job_id in dependents.get(job_ids.pop(), ()):
+                if job_id is None or job_id in aborted_job_ids:
+                    continue
+                # barrier jobs are not registered: they are followed
+                if job_id not in self._jobs_status \
+                        or self._jobs_status.job_status(job_id) \
+                            == Runner.ABORTED_NOTRUN:
+                    aborted_job_ids.add(job_id)
+                    job_ids.append(job_id)
+        return aborted_job_ids
+
+    def _cancel_retries(self, job_ids):
+        cancelled = False
+        for job_id in job_ids:
+            if self._retries_due.pop(job_id, None) is not None:
+                self._jobs_status.set_job_status(job_id, Runner.FAILED)
+                cancelled = True
+        if cancelled:
+            self._save_state()
+
+    def _forget_jobs(self, job_ids):
+        for job_id in job_ids:
+            self._retries_due.pop(job_id, None)
+
+    def _job_info_runtime(self, job_info):
+        ''' (wall_time, cpu_time, peak_rss) from a soma-workflow job info,
+        or None if the job dates are not available
+        '''
+        try:
+            execution_date, ending_date = job_info[4][1:3]
+            wall_time = (ending_date - execution_date).total_seconds()
+        except (IndexError, TypeError, AttributeError):
+            return None
+        cpu_time, peak_rss = self._parse_resource_usage(job_info[3][3])
+        return wall_time, cpu_time, peak_rss
+
+    _resource_usage_re = re.compile(
+        r'([A-Za-z_]+)\s*[=:]\s*([0-9.]+)\s*(kb|mb|gb)?', re.IGNORECASE)
+
+    def _parse_resource_usage(self, resource_usage):
+        ''' (cpu_time, peak_rss in kB) from a soma-workflow job resource
+        usage, which content depends on the scheduler. Values are None when
+        not found.
+        '''
+        values = {}
+        units = {}
+        if isinstance(resource_usage, dict):
+            items = [(key, value, None)
+                     for key, value in six.iteritems(resource_usage)]
+        else:
+            items = self._resource_usage_re.findall(resource_usage or '')
+        for key, value, unit in items:
+            try:
+                values[key.lower()] = float(value)
+                units[key.lower()] = (unit or '').lower()
+            except (TypeError, ValueError):
+                pass
+        cpu_time = None
+        for key in ('cpu_time', 'cput', 'cpu'):
+            if key in values:
+                cpu_time = values[key]
+                break
+        else:
+            if 'ru_utime' in values:
+                cpu_time = values['ru_utime'] + values.get('ru_stime', 0.)
+        peak_rss = None
+        for key in ('maxrss', 'ru_maxrss', 'mem', 'memory'):
+            if key in values:
+                peak_rss = values[key] * {'mb': 1024., 'gb': 1024. ** 2}.get(
+                    units[key], 1.)
+                break
+        return cpu_time, peak_rss
+
+    def _get_runtime_host(self):
+        resource_id = self.resource_id()
+        if resource_id is None or resource_id == 'localhost':
+            return super(SomaWorkflowRunner, self)._get_runtime_host()
+        return resource_id
+
+    def _decode_job_state(self, raw_state):
+        sw_status, exit_status, exit_value = raw_state
+        return self._sw_status_to_runner_status(sw_status, exit_status,
+                                                exit_value)
 
     def _sw_status_to_runner_status(self, sw_status, exit_status, exit_value):
         if sw_status in [sw.constants.FAILED,
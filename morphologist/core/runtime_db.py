@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import os
+import time
+import socket
+import sqlite3
+import six
+
+
+class StepRuntimeDatabase(object):
+    '''
+    Runtimes of the steps run in a study, stored in a SQLite file in the
+    study output directory.
+
+    Each record holds the wall time, CPU time (both in seconds) and peak
+    resident memory (in kB) of a step of a subject, with the host it has
+    run on and the dimensions of the subject input volume.
+    '''
+    FILENAME = 'step_runtimes.sqlite'
+    FIELDS = ('wall_time', 'cpu_time', 'peak_rss')
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    @classmethod
+    def from_study(cls, study):
+        return cls(os.path.join(study.output_directory, cls.FILENAME))
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.filename)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS step_runtimes ('
+            'step_id TEXT NOT NULL, subject_id TEXT NOT NULL, '
+            'host TEXT, dimensions TEXT, date REAL, '
+            'wall_time REAL, cpu_time REAL, peak_rss REAL)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS step_runtimes_step '
+            'ON step_runtimes (step_id, host)')
+        return connection
+
+    def add_records(self, records):
+        '''
+        Parameters
+        ----------
+        records: list
+            dicts with step_id, subject_id, wall_time keys, and optionally
+            cpu_time, peak_rss, host (default: this host), dimensions
+            ((x, y, z) of the input volume) and date (default: now).
+        '''
+        rows = []
+        for record in records:
+            dimensions = record.get('dimensions')
+            if dimensions is not None:
+                dimensions = 'x'.join([str(int(d)) for d in dimensions])
+            rows.append((record['step_id'], record['subject_id'],
+                         record.get('host') or socket.gethostname(),
+                         dimensions, record.get('date') or time.time(),
+                         record['wall_time'], record.get('cpu_time'),
+                         record.get('peak_rss')))
+        if not rows:
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO step_runtimes VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    rows)
+        finally:
+            connection.close()
+
+    def add_record(self, step_id, subject_id, wall_time, **kwargs):
+        record = dict(kwargs)
+        record.update({'step_id': step_id, 'subject_id': subject_id,
+                       'wall_time': wall_time})
+        self.add_records([record])
+
+    def _select(self, columns, step_ids=None, host=None, dimensions=None):
+        query = 'SELECT %s FROM step_runtimes' % ', '.join(columns)
+        conditions = []
+        values = []
+        if step_ids is not None:
+            step_ids = list(step_ids)
+            conditions.append('step_id IN (%s)'
+                              % ', '.join(['?'] * len(step_ids)))
+            values += step_ids
+        if host is not None:
+            conditions.append('host = ?')
+            values.append(host)
+        if dimensions is not None:
+            conditions.append('dimensions = ?')
+            values.append('x'.join([str(int(d)) for d in dimensions]))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if not self.exists():
+            return []
+        connection = self._connect()
+        try:
+            return connection.execute(query, values).fetchall()
+        finally:
+            connection.close()
+
+    def records(self, step_ids=None, host=None, dimensions=None):
+        columns = ('step_id', 'subject_id', 'host', 'dimensions', 'date') \
+            + self.FIELDS
+        return [dict(zip(columns, row))
+                for row in self._select(columns, step_ids, host, dimensions)]
+
+    def percentiles(self, percentiles=(50, 90), field='wall_time',
+                    step_ids=None, host=None, dimensions=None):
+        '''
+        Percentiles of a runtime field (wall_time, cpu_time or peak_rss) for
+        each step.
+
+        Returns
+        -------
+        percentiles: dict
+            step_id -> (percentile -> value)
+        '''
+        if field not in self.FIELDS:
+            raise ValueError("unknown runtime field: '%s'" % field)
+        values = {}
+        for step_id, value in self._select(('step_id', field), step_ids,
+                                           host, dimensions):
+            if value is not None:
+                values.setdefault(step_id, []).append(value)
+        step_percentiles = {}
+        for step_id, step_values in six.iteritems(values):
+            step_values.sort()
+            step_percentiles[step_id] = dict(
+                [(percentile, _percentile(step_values, percentile))
+                 for percentile in percentiles])
+        return step_percentiles
+
+    def median_durations(self, step_ids=None, host=None):
+        ''' step_id -> median wall time '''
+        return dict([(step_id, values[50])
+                     for step_id, values in six.iteritems(
+                         self.percentiles((50, ), 'wall_time', step_ids,
+                                          host))])
+
+
+def _percentile(sorted_values, percentile):
+    # linear interpolation between the closest ranks
+    position = (len(sorted_values) - 1) * percentile / 100.
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] \
+        + (sorted_values[upper] - sorted_values[lower]) * fraction
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import heapq
+import six
+
+from soma_workflow.client import Job, BarrierJob, Group, TemporaryPath
+
+from morphologist.core.job_chain import chain_command, chain_parameters
+
+
+LINEAR_PRIORITIES = 'linear'
+CRITICAL_PATH_PRIORITIES = 'critical_path'
+LONGEST_SUBJECT_FIRST_PRIORITIES = 'longest_subject_first'
+
+
+def group_jobs(element):
+    ''' jobs of a workflow element: the element itself if it is a job, or
+    all the jobs of a group (recursively)
+    '''
+    if not isinstance(element, Group):
+        return [element]
+    jobs = []
+    elements = list(element.elements)
+    while elements:
+        element = elements.pop(0)
+        if isinstance(element, Group):
+            elements += element.elements
+        else:
+            jobs.append(element)
+    return jobs
+
+
+def jobs_dependents(workflow):
+    ''' Job -> set(Job) depending on it, with groups dependencies expanded
+    '''
+    dependents = dict([(job, set()) for job in workflow.jobs
+                       if isinstance(job, Job)])
+    for src, dst in workflow.dependencies:
+        dst_jobs = group_jobs(dst)
+        for src_job in group_jobs(src):
+            if src_job in dependents:
+                dependents[src_job].update([job for job in dst_jobs
+                                            if job in dependents])
+    return dependents
+
+
+def job_step_id(job):
+    return job.user_storage or job.name
+
+
+def job_step_ids(job):
+    ''' step ids of the jobs fused in a job (see fuse_short_jobs), or the
+    step id of a regular job, in a list
+    '''
+    if isinstance(job.user_storage, (list, tuple)):
+        return list(job.user_storage)
+    return [job_step_id(job)]
+
+
+def critical_path_lengths(workflow, job_duration):
+    '''
+    Remaining critical path length of each job of the workflow: the job
+    duration plus the longest remaining path of the jobs depending on it.
+
+    Parameters
+    ----------
+    workflow: Workflow
+    job_duration: function
+        Job -> estimated duration
+
+    Returns
+    -------
+    lengths: dict
+        Job -> critical path length
+    '''
+    dependents = jobs_dependents(workflow)
+    # reverse topological order: a job comes after all its dependents
+    remaining = dict([(job, len(job_dependents))
+                      for job, job_dependents in six.iteritems(dependents)])
+    dependencies = dict([(job, []) for job in dependents])
+    for job, job_dependents in six.iteritems(dependents):
+        for dependent in job_dependents:
+            dependencies[dependent].append(job)
+    todo = [job for job, count in six.iteritems(remaining) if count == 0]
+    lengths = {}
+    while todo:
+        job = todo.pop()
+        lengths[job] = job_duration(job) \
+            + max([lengths[dependent] for dependent in dependents[job]]
+                  or [0])
+        for dependency in dependencies[job]:
+            remaining[dependency] -= 1
+            if remaining[dependency] == 0:
+                todo.append(dependency)
+    if len(lengths) != len(dependents):
+        raise ValueError('the workflow dependencies contain a cycle')
+    return lengths
+
+
+def make_job_duration(analysis_cls, step_durations=None):
+    ''' Job -> estimated duration function, using step_durations
+    (step_id -> duration, typically measured durations) when available, and
+    the steps resources declared by the analysis class otherwise.
+    '''
+    if step_durations is None:
+        step_durations = {}
+
+    def job_duration(job):
+        if isinstance(job, BarrierJob) or not job.command:
+            return 0
+        duration = 0
+        for step_id in job_step_ids(job):
+            step_duration = step_durations.get(step_id)
+            if step_duration is None:
+                step_duration \
+                    = analysis_cls.get_step_resources(step_id).duration
+            duration += step_duration
+        return duration
+
+    return job_duration
+
+
+def set_jobs_priorities(workflow, mode, job_duration):
+    '''
+    Set the jobs priorities of a workflow merged from subjects fragments
+    (see merge_subject_workflows).
+
+    Parameters
+    ----------
+    workflow: Workflow
+    mode: str
+        LINEAR_PRIORITIES: keep the subjects order priorities.
+        CRITICAL_PATH_PRIORITIES: the priority of each job is its remaining
+        critical path length (in seconds), so that long chains start first
+        whatever subject they belong to.
+        LONGEST_SUBJECT_FIRST_PRIORITIES: subjects are ordered by decreasing
+        critical path length, the jobs of a subject all get the same
+        priority.
+    job_duration: function
+        Job -> estimated duration
+    '''
+    if mode == LINEAR_PRIORITIES:
+        return
+    lengths = critical_path_lengths(workflow, job_duration)
+    if mode == CRITICAL_PATH_PRIORITIES:
+        for job, length in six.iteritems(lengths):
+            job.priority = int(round(length))
+    elif mode == LONGEST_SUBJECT_FIRST_PRIORITIES:
+        subject_groups = [group for group in workflow.root_group
+                          if isinstance(group, Group)]
+        subject_lengths = []
+        for index, group in enumerate(subject_groups):
+            length = max([lengths.get(job, 0) for job in group_jobs(group)]
+                         or [0])
+            subject_lengths.append((-length, index, group))
+        subject_lengths.sort()
+        priority = (len(subject_lengths) - 1) * 100
+        for _, _, group in subject_lengths:
+            for job in group_jobs(group):
+                job.priority = priority
+            priority -= 100
+    else:
+        raise ValueError("invalid jobs priorities mode: '%s'" % mode)
+
+
+def simulate_makespan(workflow, job_duration, processes_n):
+    '''
+    Estimate the time needed to run a workflow on processes_n processing
+    units, by simulating a list scheduling: whenever a unit is free, the
+    ready job with the highest priority is started.
+
+    Parameters
+    ----------
+    workflow: Workflow
+    job_duration: function
+        Job -> estimated duration
+    processes_n: int
+
+    Returns
+    -------
+    makespan: float
+        estimated duration of the whole workflow
+    '''
+    processes_n = max(1, int(processes_n))
+    dependents = jobs_dependents(workflow)
+    indices = dict([(job, index) for index, job
+                    in enumerate(workflow.jobs) if job in dependents])
+    waiting = dict([(job, 0) for job in dependents])
+    for job_dependents in six.itervalues(dependents):
+        for dependent in job_dependents:
+            waiting[dependent] += 1
+    # heaps items hold the job index to keep the order of equal items stable
+    ready = [(-(job.priority or 0), indices[job], job)
+             for job, count in six.iteritems(waiting) if count == 0]
+    heapq.heapify(ready)
+    running = []
+    now = 0.
+    done_n = 0
+    while ready or running:
+        while ready and len(running) < processes_n:
+            _, index, job = heapq.heappop(ready)
+            heapq.heappush(running, (now + job_duration(job), index, job))
+        now, _, job = heapq.heappop(running)
+        done_n += 1
+        for dependent in dependents[job]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                heapq.heappush(ready, (-(dependent.priority or 0),
+                                       indices[dependent], dependent))
+    if done_n != len(dependents):
+        raise ValueError('the workflow dependencies contain a cycle')
+    return now
+
+
+def fuse_short_jobs(workflow, job_duration, max_duration):
+    '''
+    Fuse the linear chains of short jobs of a workflow (typically the
+    fragment of a subject) into single jobs, running their commands one
+    after the other (see job_chain). This saves the scheduling and dispatch
+    overhead of each job.
+
+    A chain is a sequence of jobs each having its successor as only
+    dependent, and its predecessor as only dependency. Fused jobs last at
+    most max_duration in total. Jobs exchanging parameters (param_links),
+    or using files transfers, are not fused. The input parameters files of
+    capsul jobs are passed through the fused job (see
+    job_chain.chain_parameters). The fused job user_storage is the list of
+    the step ids of the jobs it replaces (see job_step_ids).
+
+    The workflow is modified in place.
+
+    Parameters
+    ----------
+    workflow: Workflow
+    job_duration: function
+        Job -> estimated duration
+    max_duration: float
+        maximum duration of the fused jobs, in seconds
+
+    Returns
+    -------
+    fused_n: int
+        number of jobs replaced by fused jobs
+    '''
+    if not max_duration or max_duration <= 0:
+        return 0
+    dependents = jobs_dependents(workflow)
+    dependencies = dict([(job, set()) for job in dependents])
+    for job, job_dependents in six.iteritems(dependents):
+        for dependent in job_dependents:
+            dependencies[dependent].add(job)
+    linked_jobs = set()
+    for dst_job, links in six.iteritems(
+            getattr(workflow, 'param_links', None) or {}):
+        linked_jobs.add(dst_job)
+        for sources in six.itervalues(links):
+            linked_jobs.update([src_job for src_job, _ in sources])
+    durations = dict([(job, job_duration(job)) for job in dependents])
+    fusable = set([job for job in dependents
+                   if job not in linked_jobs and _is_fusable(job)
+                   and durations[job] <= max_duration])
+
+    def successor(job):
+        if len(dependents[job]) != 1:
+            return None
+        dependent = next(iter(dependents[job]))
+        if dependent in fusable and len(dependencies[dependent]) == 1 \
+                and _are_compatible(job, dependent):
+            return dependent
+        return None
+
+    has_predecessor = set([dependent for dependent
+                           in [successor(job) for job in fusable]
+                           if dependent is not None])
+    heads = [job for job in workflow.jobs
+             if job in fusable and job not in has_predecessor]
+    chains = []
+    while heads:
+        job = heads.pop(0)
+        chain = [job]
+        duration = durations[job]
+        job = successor(job)
+        while job is not None and duration + durations[job] <= max_duration:
+            chain.append(job)
+            duration += durations[job]
+            job = successor(job)
+        if job is not None:
+            # the chain is too long: the rest starts another one
+            heads.append(job)
+        if len(chain) > 1:
+            chains.append(chain)
+    if not chains:
+        return 0
+
+    replaced = {}
+    for chain in chains:
+        first_job = chain[0]
+        input_files, output_files = _chain_referenced_files(chain)
+        use_input_params_file = [
+            bool(getattr(job, 'use_input_params_file', False))
+            for job in chain]
+        param_dict = {}
+        if True in use_input_params_file:
+            param_dict = chain_parameters(
+                [job.param_dict if use_params_file else None
+                 for job, use_params_file
+                 in zip(chain, use_input_params_file)])
+        fused_job = Job(
+            command=chain_command([job.command for job in chain],
+                                  _python_command(chain)),
+            name=' + '.join([job.name for job in chain]),
+            referenced_input_files=input_files,
+            referenced_output_files=output_files,
+            priority=max([job.priority or 0 for job in chain]),
+            env=first_job.env,
+            working_directory=getattr(first_job, 'working_directory', None),
+            native_specification=getattr(first_job, 'native_specification',
+                                         None),
+            param_dict=param_dict,
+            use_input_params_file=True in use_input_params_file)
+        # Job.__init__ does not assign its user_storage argument
+        fused_job.user_storage = sum([job_step_ids(job) for job in chain],
+                                     [])
+        configuration = getattr(first_job, 'configuration', None)
+        if configuration:
+            fused_job.configuration = configuration
+        for job in chain:
+            replaced[job] = fused_job
+    workflow.jobs = _replace_elements(workflow.jobs, replaced)
+    dependencies = []
+    known_dependencies = set()
+    for src, dst in workflow.dependencies:
+        dependency = (replaced.get(src, src), replaced.get(dst, dst))
+        if dependency[0] is not dependency[1] \
+                and dependency not in known_dependencies:
+            known_dependencies.add(dependency)
+            dependencies.append(dependency)
+    workflow.dependencies = dependencies
+    groups = list(workflow.groups)
+    elements = list(getattr(workflow.root_group, 'elements',
+                            workflow.root_group))
+    while elements:
+        element = elements.pop(0)
+        if isinstance(element, Group):
+            groups.append(element)
+            elements += element.elements
+    done_groups = set()
+    for group in groups:
+        if id(group) in done_groups:
+            continue
+        done_groups.add(id(group))
+        group.elements = _replace_elements(group.elements, replaced)
+    if isinstance(workflow.root_group, Group):
+        workflow.root_group.elements = _replace_elements(
+            workflow.root_group.elements, replaced)
+    else:
+        workflow.root_group = _replace_elements(workflow.root_group,
+                                                replaced)
+    return len(replaced)
+
+
+def _is_fusable(job):
+    # the output parameters of the jobs not linked to other jobs
+    # (has_outputs) are not used: they are not written in a chain
+    referenced_files = list(getattr(job, 'referenced_input_files', None)
+                            or []) \
+        + list(getattr(job, 'referenced_output_files', None) or [])
+    return not isinstance(job, BarrierJob) and bool(job.command) \
+        and not [item for item in referenced_files
+                 if not isinstance(item, TemporaryPath)] \
+        and not getattr(job, 'stdin', None) \
+        and not getattr(job, 'stdout_file', None) \
+        and not getattr(job, 'stderr_file', None) \
+        and not getattr(job, 'parallel_job_info', None)
+
+
+def _are_compatible(job1, job2):
+    # jobs run in the same environment
+    for attribute in ('env', 'working_directory', 'native_specification',
+                      'configuration'):
+        if (getattr(job1, attribute, None) or None) \
+                != (getattr(job2, attribute, None) or None):
+            return False
+    return True
+
+
+def _chain_referenced_files(chain):
+    ''' referenced input and output files of a fused job: the temporary
+    files produced in the chain are not inputs of the chain
+    '''
+    input_files = []
+    output_files = []
+    for job in chain:
+        for item in getattr(job, 'referenced_input_files', None) or []:
+            if item not in input_files and item not in output_files:
+                input_files.append(item)
+        for item in getattr(job, 'referenced_output_files', None) or []:
+            if item not in output_files:
+                output_files.append(item)
+    return input_files, output_files
+
+
+def _python_command(chain):
+    ''' python command of the capsul jobs of a chain (it may be configured
+    for the computing resource), None if there is none
+    '''
+    for job in chain:
+        if getattr(job, 'use_input_params_file', False) \
+                and os.path.basename(
+                    str(job.command[0])).startswith('python'):
+            return job.command[0]
+    return None
+
+
+def _replace_elements(elements, replaced):
+    new_elements = []
+    for element in elements:
+        if element in replaced:
+            element = replaced[element]
+            if element in new_elements:
+                continue
+        new_elements.append(element)
+    return new_elements
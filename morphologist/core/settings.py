@@ -191,7 +191,20 @@ class CommandLineSettings(SettingsFacade):
 
 class RunnerSettings(SettingsFacade):
     _settings_map = {
-        'selected_processing_units_n' : ('application', 'CPUs')
+        'selected_processing_units_n' : ('application', 'CPUs'),
+        'backend' : ('application', 'runner'),
+        'workflow_builders_n' : ('application', 'workflow_builders'),
+        'priorities_mode' : ('application', 'priorities'),
+        'memory_budget' : ('application', 'memory'),
+        'fusion_max_duration' : ('application', 'fuse_jobs_under'),
+        'job_attempts' : ('application', 'job_attempts'),
+        'retry_delay' : ('application', 'retry_delay'),
+        'retry_reduce_concurrency' : ('application',
+                                      'retry_reduce_concurrency'),
+        'straggler_percentile' : ('application', 'straggler_percentile'),
+        'manifest_checksums' : ('application',
+                                'output_manifest_checksums'),
+        'skip_mode' : ('application', 'skip_steps'),
     }
 
     @property
@@ -204,10 +217,53 @@ class RunnerSettings(SettingsFacade):
         else:
             return AutoOrInt(value, auto=False)
 
+    @property
+    def workflow_builders_n(self):
+        attr = 'workflow_builders_n'
+        value = super(RunnerSettings, self).__getattr__(attr)
+        if value == AUTO:
+            value = self._auto_selected_processing_units_n()
+            return AutoOrInt(value, auto=True)
+        else:
+            return AutoOrInt(value, auto=False)
+
     def _auto_selected_processing_units_n(self):
         total_processing_units_n = multiprocessing.cpu_count()
         return max(1, total_processing_units_n - 1)
 
+    @property
+    def memory_budget(self):
+        attr = 'memory_budget'
+        value = super(RunnerSettings, self).__getattr__(attr)
+        if value == AUTO:
+            value = self._auto_memory_budget()
+            return AutoOrInt(value, auto=True)
+        else:
+            return AutoOrInt(value, auto=False)
+
+    @property
+    def job_attempts(self):
+        attr = 'job_attempts'
+        value = super(RunnerSettings, self).__getattr__(attr)
+        if value == AUTO:
+            return AutoOrInt(1, auto=True)
+        else:
+            return AutoOrInt(value, auto=False)
+
+    def _auto_memory_budget(self):
+        # 80% of the physical memory
+        return max(1, int(_physical_memory() * 0.8))
+
+
+def _physical_memory():
+    ''' physical memory, in MB '''
+    try:
+        total_memory = os.sysconf('SC_PAGE_SIZE') \
+            * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        total_memory = 4 * 1024 ** 3
+    return total_memory / 1024. ** 2
+
 
 class AutoOrInt(int):
 
@@ -224,8 +280,34 @@ class AutoOrInt(int):
 class StudyEditorSettings(SettingsFacade):
     _settings_map = {
         "brainomics" : ('application', 'brainomics'),
+        "study_storage" : ('application', 'study_storage'),
+        "importers_n" : ('application', 'importers'),
+        "pipelines_memory" : ('application', 'pipelines_memory'),
+        "max_decoded_analyses" : ('application', 'decoded_analyses'),
      }
 
+    @property
+    def importers_n(self):
+        attr = 'importers_n'
+        value = super(StudyEditorSettings, self).__getattr__(attr)
+        if value == AUTO:
+            # importations are bound by the disks rather than by the CPUs
+            value = min(4, multiprocessing.cpu_count())
+            return AutoOrInt(value, auto=True)
+        else:
+            return AutoOrInt(value, auto=False)
+
+    @property
+    def pipelines_memory(self):
+        attr = 'pipelines_memory'
+        value = super(StudyEditorSettings, self).__getattr__(attr)
+        if value == AUTO:
+            # 5% of the physical memory, up to 1 GB
+            value = min(1024, int(_physical_memory() * 0.05))
+            return AutoOrInt(value, auto=True)
+        else:
+            return AutoOrInt(value, auto=False)
+
 
 class BackendSettings(SettingsFacade):
     _settings_map = {
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import shutil
+import six
+
+from morphologist.core.runtime_db import StepRuntimeDatabase
+from morphologist.core.scheduling import job_step_ids
+from morphologist.core.settings import settings
+
+
+class StragglerDetector(object):
+    '''
+    Tells when a running job is a straggler: it has run longer than a
+    percentile of the past durations of its steps (see StepRuntimeDatabase).
+
+    Parameters
+    ----------
+    thresholds: dict
+        step_id -> duration (in seconds) after which a job of the step is a
+        straggler
+    '''
+
+    def __init__(self, thresholds):
+        self.thresholds = thresholds
+
+    @classmethod
+    def from_study(cls, study, percentile=None):
+        ''' detector of the runner settings, None if speculative copies are
+        disabled or if no runtime has been recorded for the study yet
+        '''
+        if percentile is None:
+            percentile = settings.runner.straggler_percentile
+        if not percentile:
+            return None
+        runtime_db = StepRuntimeDatabase.from_study(study)
+        if not runtime_db.exists():
+            return None
+        thresholds = dict([(step_id, values[percentile])
+                           for step_id, values in six.iteritems(
+                               runtime_db.percentiles((percentile, )))])
+        return cls(thresholds)
+
+    def threshold(self, job):
+        ''' duration after which the job is a straggler, None when it is
+        unknown for one of the steps of the job
+        '''
+        thresholds = [self.thresholds.get(step_id)
+                      for step_id in job_step_ids(job)]
+        if not thresholds or None in thresholds:
+            return None
+        return sum(thresholds)
+
+
+class SpeculativeOutputs(object):
+    '''
+    Isolates the outputs of a speculative copy of a job from the ones of the
+    original job: the paths of the copy under directory are redirected to a
+    staging directory, which must be on the same file system, and are moved
+    in place by commit() once the original job is over.
+
+    The staging directory mirrors the files which existed before the
+    original job started in the directories of the redirected paths, so that
+    the copy finds its inputs. The files modified since then are being
+    written by the original job, and are not mirrored. The redirected paths
+    (and their associated files, see _is_redirected) may be outputs left by
+    a former run, which the copy writes again: they are mirrored by copies,
+    the other files by symbolic links.
+
+    Parameters
+    ----------
+    directory: str
+        directory of the outputs of the job (the study output directory)
+    staging_directory: str
+    since: float
+        start time of the original job
+    '''
+
+    def __init__(self, directory, staging_directory, since):
+        self.directory = os.path.normpath(directory)
+        self.staging_directory = staging_directory
+        self.since = since
+        self.redirected = set()
+        # a path of directory was found within a value: it cannot be
+        # redirected
+        self.embedded = False
+        # staged copy -> (size, mtime), not committed if left unchanged
+        self._copies = {}
+
+    def can_isolate(self):
+        return bool(self.redirected) and not self.embedded
+
+    def redirect(self, value):
+        ''' value (command item or parameter) to use in the copy '''
+        if isinstance(value, six.string_types):
+            prefix = self.directory + os.sep
+            if value.startswith(prefix):
+                self.redirected.add(value)
+                return os.path.join(self.staging_directory,
+                                    value[len(prefix):])
+            if prefix in value:
+                self.embedded = True
+            return value
+        elif isinstance(value, (list, tuple)):
+            return type(value)([self.redirect(item) for item in value])
+        elif isinstance(value, dict):
+            return dict([(key, self.redirect(item))
+                         for key, item in six.iteritems(value)])
+        return value
+
+    def _staged(self, path):
+        return os.path.join(self.staging_directory,
+                            os.path.relpath(path, self.directory))
+
+    def _is_redirected(self, path):
+        ''' path is a redirected path, or a file going with it (.minf header,
+        .dim of a .ima, .data directory of a .arg...)
+        '''
+        for redirected in self.redirected:
+            if path == redirected \
+                    or path.startswith(os.path.splitext(redirected)[0]
+                                       + '.'):
+                return True
+        return False
+
+    def _copy(self, path, staged_path):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.copytree(path, staged_path)
+            staged_files = [os.path.join(root, name)
+                            for root, _, filenames in os.walk(staged_path)
+                            for name in filenames]
+        else:
+            shutil.copy2(path, staged_path)
+            staged_files = [staged_path]
+        for staged_file in staged_files:
+            stat = os.lstat(staged_file)
+            self._copies[staged_file] = (stat.st_size, stat.st_mtime)
+
+    def prepare(self):
+        directories = set([os.path.dirname(path) for path in self.redirected])
+        for directory in directories:
+            staged_directory = self._staged(directory)
+            if not os.path.isdir(staged_directory):
+                os.makedirs(staged_directory)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                staged_path = os.path.join(staged_directory, name)
+                if os.path.lexists(staged_path) \
+                        or os.lstat(path).st_mtime >= self.since:
+                    continue
+                if self._is_redirected(path):
+                    # the copy would write through a link into the file of
+                    # the original job
+                    self._copy(path, staged_path)
+                else:
+                    os.symlink(path, staged_path)
+
+    def commit(self):
+        ''' move the outputs of the copy in place, each file atomically (they
+        replace the ones left by the original job, which must be over).
+
+        Returns
+        -------
+        committed: list
+            paths of the committed files
+        '''
+        committed = []
+        for root, dirnames, filenames in os.walk(self.staging_directory):
+            target_root = os.path.join(
+                self.directory, os.path.relpath(root, self.staging_directory))
+            for name in filenames:
+                path = os.path.join(root, name)
+                if os.path.islink(path) or self._is_unchanged_copy(path):
+                    continue
+                if not os.path.isdir(target_root):
+                    os.makedirs(target_root)
+                target = os.path.join(target_root, name)
+                os.rename(path, target)
+                committed.append(target)
+        self.discard()
+        return committed
+
+    def _is_unchanged_copy(self, path):
+        if path not in self._copies:
+            return False
+        stat = os.lstat(path)
+        return self._copies[path] == (stat.st_size, stat.st_mtime)
+
+    def discard(self):
+        shutil.rmtree(self.staging_directory, ignore_errors=True)
@@ -9,3 +9,23 @@ class StepHelp(object):
         self.description = ""
         self.help_message = ""
 
+
+
+class StepResources(object):
+    ''' Resources needed by a step, used to schedule its jobs.
+
+    duration: estimated duration of the step, in seconds
+    memory: peak memory used by a job of the step, in MB
+    cpu_weight: number of processing units used by a job of the step
+    output_size: disk space taken by the outputs of the step, in MB
+    max_attempts: number of runs of a failing job of the step before it is
+    reported as failed (see RetryPolicy)
+    '''
+
+    def __init__(self, duration=60., memory=500, cpu_weight=1.,
+                 output_size=20., max_attempts=1):
+        self.duration = duration
+        self.memory = memory
+        self.cpu_weight = cpu_weight
+        self.output_size = output_size
+        self.max_attempts = max_attempts
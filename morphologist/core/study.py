@@ -3,16 +3,31 @@ from __future__ import absolute_import
 
 import os
 import json
-import re
-import glob
 import sys
+import sqlite3
+import threading
+import weakref
 import six
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
 from morphologist.core.utils import OrderedDict
 from morphologist.core.analysis \
     import AnalysisFactory, ImportationError
 from morphologist.core.constants import ALL_SUBJECTS
 from morphologist.core.subject import Subject
+from morphologist.core import study_format
+from morphologist.core.study_store import SQLiteStudyStore
+from morphologist.core.organized_directory import scan_organized_directory
+from morphologist.core.template_completion import TemplateCompletion
+from morphologist.core.importation import import_subjects
+from morphologist.core.format_conversion import FormatConverter, \
+    FormatConversionError
+from morphologist.core.file_index import FileSystemIndex
+from morphologist.core.settings import settings
 
 # Axon config
 argv = sys.argv
@@ -32,7 +47,7 @@ from capsul.api import StudyConfig
 import traits.api as traits
 
 
-STUDY_FORMAT_VERSION = '0.5'
+STUDY_FORMAT_VERSION = '0.6'
 
 
 class Study(StudyConfig):
@@ -71,7 +86,14 @@ class Study(StudyConfig):
         self.add_trait("subjects", traits.Trait(OrderedDict()))
         self.subjects = OrderedDict()
         self.template_pipeline = None
-        self.analyses = {}
+        # PipelinePool of the analyses
+        self.pipeline_pool = None
+        self.analyses = LazyAnalysisMap(self)
+        # SQLiteStudyStore, if the study is stored in a database rather than
+        # in a study file
+        self.store = None
+        # existence of the files of the study, shared by the analyses
+        self.file_index = FileSystemIndex()
         self.on_trait_change(self._force_input_dir, 'output_directory')
 
     def _force_input_dir(self, value):
@@ -122,7 +144,7 @@ class Study(StudyConfig):
         except:
             msg = "unknown study format version"
             raise StudySerializationError(msg)
-        if version != STUDY_FORMAT_VERSION:
+        if version not in study_format.FORMAT_VERSIONS:
             msg = "find unsupported study format version '%s'" % version
             raise StudySerializationError(msg)
         study = cls(analysis_type=serialized['analysis_type'], 
@@ -131,7 +153,8 @@ class Study(StudyConfig):
         serialized_dict = dict(
             [(key, value) for key, value in six.iteritems(serialized)
              if key not in ('subjects', 'study_format_version',
-                            'analysis_type', 'inputs', 'outputs')])
+                            'analysis_type', 'inputs', 'outputs',
+                            'parameters', 'parameters_template')])
         study.set_study_configuration(serialized_dict)
         for subject_id, serialized_subject in \
                 six.iteritems(serialized['subjects']):
@@ -141,20 +164,40 @@ class Study(StudyConfig):
         if 'parameters' not in serialized:
             raise StudySerializationError(
                     "Cannot find parameters section in study file")
-        for subject_id, subject in six.iteritems(study.subjects):
+        compact = version in study_format.COMPACT_FORMAT_VERSIONS
+        if compact:
+            study.analyses.parameters_template \
+                = serialized['parameters_template']
+        for subject_id in study.subjects:
             if subject_id not in serialized['parameters']:
                 raise StudySerializationError(
                     "Cannot find params for subject %s" % subject_id)
-            analysis = study._create_analysis()
-            analysis.subject = subject
-            parameters = serialized['parameters'][subject_id]
-            analysis.parameters = Study.unserialize_paths(
-                parameters, study.output_directory)
-            study.analyses[subject_id] = analysis
+            # the analysis is built when the subject is first accessed
+            if compact:
+                study.analyses.set_parameters_delta(
+                    subject_id, serialized['parameters'][subject_id])
+            else:
+                study.analyses.set_serialized_parameters(
+                    subject_id, serialized['parameters'][subject_id])
+        study.finish_format_conversion()
+        return study
+
+    @classmethod
+    def from_store(cls, store):
+        output_directory = os.path.dirname(store.filename)
+        try:
+            serialized_study = store.load()
+        except sqlite3.Error as e:
+            raise StudySerializationError("%s" %(e))
+        study = cls.unserialize(serialized_study, output_directory)
+        study.store = store
         return study
 
     @classmethod
     def from_study_directory(cls, study_directory):
+        store = SQLiteStudyStore.from_directory(study_directory)
+        if store.exists():
+            return cls.from_store(store)
         backup_filepath = \
             cls._get_backup_filepath_from_output_directory(study_directory)
         return cls.from_file(backup_filepath)
@@ -179,19 +222,33 @@ class Study(StudyConfig):
             callback(init_progress + 0.05 * scl_progess)
             progress_callback = (callback,
                                  init_progress + .05 * scl_progess,
-                                 0.25 * scl_progess)
-        subjects = new_study.get_subjects_from_pattern(
-            progress_callback=progress_callback) ##exact_match=True)
-        nsubjects = len(subjects)
-        for n, subject in enumerate(subjects):
-            new_study.add_subject(subject, import_data=False)
-            if progress_callback:
-                callback(init_progress
-                         + (.3 + 0.7 * (n + 1) / nsubjects) * scl_progess)
+                                 0.95 * scl_progess)
+        # subjects are added while the next ones are being looked for, the
+        # scan progress accounts for both
+        new_study.add_subjects(new_study.iter_subjects_from_pattern(
+            progress_callback=progress_callback), import_data=False)
         return new_study
 
     def save_to_backup_file(self):
+        ''' save the study in its output directory, in a database if the
+        study has been loaded from a database or if the study_storage setting
+        is sqlite, otherwise in a study file
+        '''
+        if (self.store is None
+                and settings.study_editor.study_storage == 'sqlite') \
+                or (self.store is not None
+                    and os.path.dirname(self.store.filename)
+                        != self.output_directory):
+            self.store = SQLiteStudyStore.from_directory(
+                self.output_directory)
         serialized_study = self.serialize()
+        if self.store is not None:
+            # only the changes are written
+            try:
+                self.store.save(serialized_study)
+            except sqlite3.Error as e:
+                raise StudySerializationError("%s" %(e))
+            return
         try:
             with open(self.backup_filepath, "w") as fd:
                 json.dump(serialized_study, fd, indent=4, sort_keys=True)
@@ -212,11 +269,14 @@ class Study(StudyConfig):
         for subject_id, subject in six.iteritems(self.subjects):
             serialized['subjects'][subject_id] = \
                 subject.serialize(self.output_directory)
+        # parameters are stored as deltas from a template tree (see
+        # study_format)
         serialized['parameters'] = {}
-        for subject_id, analysis in six.iteritems(self.analyses):
+        for subject_id in self.analyses:
             serialized['parameters'][subject_id] \
-                = Study.serialize_paths(analysis.parameters,
-                                        self.output_directory)
+                = self.analyses.parameters_delta(subject_id)
+        serialized['parameters_template'] \
+            = self.analyses.parameters_template or {}
         return serialized
 
     def add_subject(self, subject, import_data=True):
@@ -229,6 +289,25 @@ class Study(StudyConfig):
         if import_data:
             self._import_subject(subject_id, subject)
 
+    def add_subjects(self, subjects, import_data=True):
+        ''' add several subjects (from any iterable): the completion engine
+        only runs for a few of them, the parameters of the others are
+        derived from theirs (see TemplateCompletion). The data of the
+        subjects are then imported in parallel (see importation).
+        '''
+        completion = TemplateCompletion(self)
+        added_subjects = []
+        for subject in subjects:
+            subject_id = subject.id()
+            if subject_id in self.subjects:
+                raise SubjectExistsError(subject)
+            self.subjects[subject_id] = subject
+            self.analyses[subject_id] = self._create_analysis()
+            completion.set_parameters(self.analyses[subject_id], subject)
+            added_subjects.append(subject)
+        if import_data:
+            import_subjects(self, added_subjects)
+
     def _import_subject(self, subject_id, subject):
         try:
             new_imgname = self.analyses[subject_id].import_data(subject)
@@ -250,6 +329,13 @@ class Study(StudyConfig):
         del self.subjects[subject_id]
         del self.analyses[subject_id]
 
+    def record_run(self, subject_ids, step_ids=None, backend=None):
+        ''' add a run of the given subjects to the runs history, when the
+        study is stored in a database
+        '''
+        if self.store is not None:
+            self.store.add_run(subject_ids, step_ids, backend)
+
     def has_subjects(self):
         return len(self.subjects) != 0
 
@@ -281,6 +367,7 @@ class Study(StudyConfig):
     def remove_dirs(self, subject_id):
         analysis = self.analyses[subject_id]
         analysis.remove_subject_dir()
+        self.file_index.invalidate(self.output_directory)
 
     def get_available_computing_resources(self):
         from soma_workflow import configuration
@@ -301,6 +388,17 @@ class Study(StudyConfig):
 
     def get_subjects_from_pattern(self, exact_match=False,
                                   progress_callback=None):
+        return list(self.iter_subjects_from_pattern(
+            exact_match=exact_match, progress_callback=progress_callback))
+
+    def iter_subjects_from_pattern(self, exact_match=False,
+                                   progress_callback=None):
+        ''' yield the subjects found in the output directory, organized as
+        <group>/<subject>/t1mri/<acquisition>/<subject>.<ext> (see
+        organized_directory.scan_organized_directory), as they are found.
+        The volumes format of the study is set from the first subject, and
+        the subjects in another format are skipped.
+        '''
         if progress_callback is not None:
             if isinstance(progress_callback, tuple):
                 progress_callback, init_progress, scl_progess \
@@ -308,33 +406,14 @@ class Study(StudyConfig):
             else:
                 init_progress = 0.
                 scl_progess = 1.
-        subjects = []
         MODALITY = 't1mri'
         ACQUISITION = 'default_acquisition'
-        any_dir = "([^/\\\\]+)"
-        re_sep = os.sep.replace('\\', '\\\\')
-        if progress_callback:
-            progress_callback(init_progress)
         if exact_match:
-            glob_pattern = os.path.join(
-                self.output_directory, "*", "*", MODALITY, ACQUISITION,
-                "*.nii")
-            regexp = re.compile(
-                             "^" + self.output_directory.replace('\\', '\\\\')
-                                 + re_sep
-                                 + any_dir + re_sep + any_dir + re_sep
-                                 + MODALITY + re_sep + ACQUISITION + re_sep
-                                 + "\\2\.(nii)$")
-
+            acquisitions = [ACQUISITION]
+            extensions = ['nii']
         else:
-            glob_pattern = os.path.join(
-                self.output_directory, "*", "*", MODALITY, "*", "*.*")
-            regexp = re.compile(
-                             "^" + self.output_directory.replace('\\', '\\\\')
-                                 + re_sep
-                                 + any_dir + re_sep + any_dir + re_sep
-                                 + MODALITY + re_sep + any_dir + re_sep
-                                 + "\\2\.((?:nii(?:\.gz)?)|(?:ima))$")
+            acquisitions = None
+            extensions = ['nii', 'nii.gz', 'ima']
 
         vol_format = None
         formats_dict = self.modules_data.fom_atp['input'].foms.formats
@@ -351,23 +430,15 @@ class Study(StudyConfig):
             "mesh": "MESH",
             "ply": "PLY",
         })
-        subjects_ids = set()
-        files_list = list(glob.iglob(glob_pattern))
-        nfiles = len(files_list)
-        progress = 0.5
-        for n, filename in enumerate(files_list):
-            if progress_callback:
-                progress_callback(
-                    init_progress
-                    + (progress + (1. - progress) * n / nfiles) * scl_progess)
-            match = regexp.match(filename)
-            if match:
-                groupname = match.group(1)
-                subjectname = match.group(2)
-                if exact_match:
-                    format_ext = match.group(3)
-                else:
-                    format_ext = match.group(4)
+        scan_progress = None
+        if progress_callback:
+            scan_progress = lambda progress: progress_callback(
+                init_progress + progress * scl_progess)
+        for groupname, subjectname, images in scan_organized_directory(
+                self.output_directory, MODALITY, acquisitions, extensions,
+                progress_callback=scan_progress):
+            found = False
+            for filename, format_ext in images:
                 format_name = ext_dict.get(format_ext, 'NIFTI')
                 if vol_format is None:
                     vol_format = format_name
@@ -376,20 +447,14 @@ class Study(StudyConfig):
                     print('Warning: subject %s input MRI does not have '
                           'the expected format: %s, expecting %s'
                           % (subjectname, format_name, vol_format))
-                    continue # skip this subject
-                subject = Subject(subjectname, groupname, filename)
-                subject_id = subject.id()
-                if subject_id in subjects_ids:
+                    continue # skip this image
+                if found:
                     print('Warning: %s / %s exists several times (in '
                           'different acquisitions probably) - keeping only '
                           'one.' % (subjectname, groupname))
-                    continue
-                subjects_ids.add(subject_id)
-                subjects.append(subject)
-
-        if progress_callback:
-            progress_callback(init_progress + scl_progess)
-        return subjects
+                    break
+                found = True
+                yield Subject(subjectname, groupname, filename)
 
     @classmethod
     def serialize_paths(cls, params, directory):
@@ -473,6 +538,28 @@ class Study(StudyConfig):
                         parent.append(sub_item)
         return new_params
 
+    def finish_format_conversion(self):
+        ''' finish a format conversion of the study which has been
+        interrupted (see FormatConverter), before its files are used.
+        If the study has not been saved with the new formats, it still uses
+        the original files: the conversion is cancelled instead.
+        '''
+        converter = FormatConverter.from_directory(
+            self.output_directory, settings.study_editor.importers_n)
+        if not converter.has_pending_conversion():
+            return
+        formats = converter.pending_formats()
+        try:
+            if formats is not None \
+                    and formats != [self.volumes_format, self.meshes_format] \
+                    and converter.can_rollback():
+                converter.rollback()
+            else:
+                converter.resume()
+        except FormatConversionError as e:
+            # the journal is kept, the conversion is tried again next time
+            print('could not finish the format conversion of the study:', e)
+
     def convert_from_formats(self, old_volumes_format, old_meshes_format,
                              progress_callback=None):
         if progress_callback:
@@ -486,12 +573,217 @@ class Study(StudyConfig):
         ns = len(self.subjects)
         if progress_callback:
             callback(progr_init)
+        converter = FormatConverter.from_directory(
+            self.output_directory, settings.study_editor.importers_n)
+        # a previous conversion has been interrupted: it is finished first,
+        # then the files it has converted are found by the new one
+        converter.resume()
+        # listing the files to convert counts for this part of the progress
+        listing_part = 0.2
+        conversions = []
         for n, subject_id in enumerate(self.subjects):
             print('convert', subject_id)
-            self.analyses[subject_id].convert_from_formats(
+            conversions += self.analyses[subject_id].format_conversions(
                 old_volumes_format, old_meshes_format)
             if progress_callback:
-                callback(progr_init + (n + 1) * progr_scl / ns)
+                callback(progr_init
+                         + listing_part * (n + 1) * progr_scl / ns)
+        if progress_callback:
+            def conversion_callback(progress):
+                callback(progr_init + (listing_part + (1. - listing_part)
+                                       * progress) * progr_scl)
+        else:
+            conversion_callback = None
+        converter.convert(conversions, conversion_callback,
+                          [self.volumes_format, self.meshes_format])
+
+
+class LazyAnalysisMap(MutableMapping):
+    '''
+    subject_id -> Analysis mapping of a study. The analyses of the subjects
+    loaded from a study file are built, and their parameters decoded, only
+    when they are first accessed.
+
+    At most max_decoded analyses are kept (the study_editor
+    max_decoded_analyses setting by default): the least recently used ones
+    are dropped, and their parameters are kept in their serialized form
+    until they are accessed again. The serialized form is kept while the
+    analysis is decoded, so that it is not encoded again if its parameters
+    have not been replaced. A dropped analysis which is still referenced
+    elsewhere is given back as it is when it is accessed again.
+
+    Serialized parameters are kept either whole, or as a delta from
+    parameters_template (see study_format).
+    '''
+
+    def __init__(self, study, max_decoded=None):
+        super(LazyAnalysisMap, self).__init__()
+        self._study = study
+        if max_decoded is None:
+            max_decoded = settings.study_editor.max_decoded_analyses
+        self.max_decoded = max_decoded
+        self.parameters_template = None
+        self._subject_ids = OrderedDict()   # subject_id -> None
+        self._analyses = OrderedDict()      # subject_id -> Analysis, LRU first
+        self._serialized = {}               # subject_id -> parameters
+        self._deltas = {}                   # subject_id -> parameters delta
+        # subject_id -> parameters decoded from the serialized form, for
+        # the analyses in _analyses
+        self._decoded_parameters = {}
+        # subject_id -> Analysis dropped from _analyses, still referenced
+        self._dropped = weakref.WeakValueDictionary()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._subject_ids)
+
+    def __iter__(self):
+        return iter(list(self._subject_ids))
+
+    def __contains__(self, subject_id):
+        return subject_id in self._subject_ids
+
+    def __getitem__(self, subject_id):
+        with self._lock:
+            analysis = self._analyses.pop(subject_id, None)
+            if analysis is None:
+                if subject_id not in self._subject_ids:
+                    raise KeyError(subject_id)
+                analysis = self._dropped.pop(subject_id, None)
+            if analysis is None:
+                parameters = self._stored_parameters(subject_id)
+                analysis = self._study._create_analysis()
+                analysis.subject = self._study.subjects[subject_id]
+                if parameters is not None:
+                    parameters = Study.unserialize_paths(
+                        parameters, self._study.output_directory)
+                analysis.parameters = parameters
+                self._decoded_parameters[subject_id] = parameters
+            self._store(subject_id, analysis)
+            return analysis
+
+    def __setitem__(self, subject_id, analysis):
+        with self._lock:
+            self._forget(subject_id)
+            self._subject_ids[subject_id] = None
+            self._store(subject_id, analysis)
+
+    def __delitem__(self, subject_id):
+        with self._lock:
+            del self._subject_ids[subject_id]
+            self._forget(subject_id)
+
+    def _forget(self, subject_id):
+        # must be called with the lock held
+        self._analyses.pop(subject_id, None)
+        self._serialized.pop(subject_id, None)
+        self._deltas.pop(subject_id, None)
+        self._decoded_parameters.pop(subject_id, None)
+        self._dropped.pop(subject_id, None)
+
+    def _store(self, subject_id, analysis):
+        # must be called with the lock held
+        self._analyses[subject_id] = analysis
+        while len(self._analyses) > self.max_decoded:
+            evicted_id, evicted = self._analyses.popitem(last=False)
+            if not self._is_unchanged(evicted_id, evicted):
+                self._serialized.pop(evicted_id, None)
+                self._deltas.pop(evicted_id, None)
+                if evicted.parameters is None:
+                    self._serialized[evicted_id] = None
+                elif self.parameters_template is not None:
+                    self._deltas[evicted_id] = self._delta(
+                        evicted_id, self._serialize(evicted))
+                else:
+                    self._serialized[evicted_id] = self._serialize(evicted)
+            self._decoded_parameters.pop(evicted_id, None)
+            self._dropped[evicted_id] = evicted
+
+    def _is_unchanged(self, subject_id, analysis):
+        ''' the stored serialized form of the subject parameters is the one
+        of the analysis (must be called with the lock held)
+        '''
+        return subject_id in self._decoded_parameters \
+            and analysis.parameters is self._decoded_parameters[subject_id]
+
+    def _live_analysis(self, subject_id):
+        # must be called with the lock held
+        analysis = self._analyses.get(subject_id)
+        if analysis is None:
+            analysis = self._dropped.get(subject_id)
+        return analysis
+
+    def _serialize(self, analysis):
+        return Study.serialize_paths(analysis.parameters or {},
+                                     self._study.output_directory)
+
+    def _delta(self, subject_id, parameters):
+        subject = self._study.subjects[subject_id]
+        return study_format.parameters_delta(
+            self.parameters_template,
+            study_format.template_parameters(parameters, subject.name,
+                                             subject.groupname))
+
+    def _stored_parameters(self, subject_id):
+        # must be called with the lock held
+        if subject_id in self._deltas:
+            subject = self._study.subjects[subject_id]
+            return study_format.expand_parameters(
+                study_format.apply_parameters_delta(
+                    self.parameters_template, self._deltas[subject_id]),
+                subject.name, subject.groupname)
+        return self._serialized[subject_id]
+
+    def set_serialized_parameters(self, subject_id, parameters):
+        ''' set the analysis of a subject from its serialized parameters (see
+        Study.serialize_paths), decoded when the subject is accessed
+        '''
+        with self._lock:
+            self._forget(subject_id)
+            self._subject_ids[subject_id] = None
+            self._serialized[subject_id] = parameters
+
+    def set_parameters_delta(self, subject_id, delta):
+        ''' same as set_serialized_parameters, for parameters given as a
+        delta from parameters_template
+        '''
+        with self._lock:
+            self._forget(subject_id)
+            self._subject_ids[subject_id] = None
+            self._deltas[subject_id] = delta
+
+    def serialized_parameters(self, subject_id):
+        ''' parameters of the analysis of a subject, in their serialized
+        form, without building the analysis
+        '''
+        with self._lock:
+            analysis = self._live_analysis(subject_id)
+            if analysis is not None \
+                    and not self._is_unchanged(subject_id, analysis):
+                return self._serialize(analysis)
+            if subject_id not in self._subject_ids:
+                raise KeyError(subject_id)
+            return self._stored_parameters(subject_id) or {}
+
+    def parameters_delta(self, subject_id):
+        ''' serialized parameters of a subject, as a delta from
+        parameters_template, which is set from this subject if needed
+        '''
+        with self._lock:
+            analysis = self._live_analysis(subject_id)
+            if subject_id in self._deltas and (
+                    analysis is None
+                    or self._is_unchanged(subject_id, analysis)):
+                return self._deltas[subject_id]
+            parameters = self.serialized_parameters(subject_id)
+            if self.parameters_template is None:
+                subject = self._study.subjects[subject_id]
+                self.parameters_template = study_format.template_parameters(
+                    parameters, subject.name, subject.groupname)
+            return self._delta(subject_id, parameters)
+
+    def is_decoded(self, subject_id):
+        return subject_id in self._analyses
 
 
 class StudySerializationError(Exception):
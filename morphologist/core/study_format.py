@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+'''
+Compact storage of the analyses parameters in study files.
+
+Up to the study format 0.5, study files hold the whole parameters tree of
+each subject. The parameters of different subjects mostly differ by the
+subject and group names found in the file names, so the format 0.6 stores a
+single template tree, where these names are replaced by the ${subject} and
+${group} placeholders, and for each subject the delta between its own
+templated tree and the template (see parameters_delta).
+
+Study files can be converted from one format to the other with::
+
+    python -m morphologist.core.study_format study.json [-o output.json]
+        [--format 0.5]
+'''
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import os
+import sys
+import copy
+import json
+import optparse
+import six
+
+
+SUBJECT_PLACEHOLDER = '${subject}'
+GROUP_PLACEHOLDER = '${group}'
+COMPACT_FORMAT_VERSIONS = ('0.6', )
+FORMAT_VERSIONS = ('0.5', ) + COMPACT_FORMAT_VERSIONS
+
+
+def map_strings(value, function):
+    ''' copy of a parameters tree with function applied to its strings '''
+    if isinstance(value, six.string_types):
+        return function(value)
+    elif isinstance(value, dict):
+        return value.__class__([(key, map_strings(item, function))
+                                for key, item in six.iteritems(value)])
+    elif isinstance(value, list):
+        return [map_strings(item, function) for item in value]
+    return value
+
+
+def _expand_string(value, subjectname, groupname):
+    return value.replace(SUBJECT_PLACEHOLDER, subjectname).replace(
+        GROUP_PLACEHOLDER, groupname)
+
+
+def _template_string(value, subjectname, groupname):
+    # the longest name first, as it may contain the other one
+    replacements = sorted([(subjectname, SUBJECT_PLACEHOLDER),
+                           (groupname, GROUP_PLACEHOLDER)],
+                          key=lambda replacement: -len(replacement[0]))
+    templated = value
+    for name, placeholder in replacements:
+        if name:
+            templated = templated.replace(name, placeholder)
+    if templated != value \
+            and _expand_string(templated, subjectname, groupname) != value:
+        return value
+    return templated
+
+
+def template_parameters(parameters, subjectname, groupname):
+    ''' parameters tree with the subject and group names replaced by
+    placeholders
+    '''
+    return map_strings(parameters, lambda value: _template_string(
+        value, subjectname, groupname))
+
+
+def expand_parameters(parameters, subjectname, groupname):
+    ''' opposite of template_parameters '''
+    return map_strings(parameters, lambda value: _expand_string(
+        value, subjectname, groupname))
+
+
+def _same_values(value, other_value):
+    if type(value) is not type(other_value):
+        return False
+    if isinstance(value, list):
+        return len(value) == len(other_value) \
+            and all([_same_values(item, other_item)
+                     for item, other_item in zip(value, other_value)])
+    if isinstance(value, dict):
+        return sorted(value.keys()) == sorted(other_value.keys()) \
+            and all([_same_values(item, other_value[key])
+                     for key, item in six.iteritems(value)])
+    return value == other_value
+
+
+def parameters_delta(template, parameters):
+    '''
+    Returns
+    -------
+    delta: dict
+        {'set': [[keys, value], ...], 'unset': [keys, ...]}, where keys is
+        the list of the keys leading to a value of the parameters which
+        differs from the template, or which does not exist in the
+        parameters. Empty if the parameters match the template.
+    '''
+    values = []
+    unset = []
+    todo = [([], template, parameters)]
+    while todo:
+        keys, template_item, item = todo.pop(0)
+        for key, value in six.iteritems(item):
+            template_value = template_item.get(key)
+            if isinstance(value, dict) and isinstance(template_value, dict):
+                todo.append((keys + [key], template_value, value))
+            elif key not in template_item \
+                    or not _same_values(value, template_value):
+                values.append([keys + [key], value])
+        unset += [keys + [key] for key in template_item if key not in item]
+    delta = {}
+    if values:
+        delta['set'] = values
+    if unset:
+        delta['unset'] = unset
+    return delta
+
+
+def apply_parameters_delta(template, delta):
+    ''' opposite of parameters_delta '''
+    parameters = copy.deepcopy(template)
+    for keys, value in delta.get('set', []):
+        item = parameters
+        for key in keys[:-1]:
+            if not isinstance(item.get(key), dict):
+                item[key] = {}
+            item = item[key]
+        item[keys[-1]] = copy.deepcopy(value)
+    for keys in delta.get('unset', []):
+        item = parameters
+        for key in keys[:-1]:
+            item = item.get(key, {})
+        item.pop(keys[-1], None)
+    return parameters
+
+
+def compact_study(serialized, version=COMPACT_FORMAT_VERSIONS[-1]):
+    ''' serialized study (as in a study file) in the compact format '''
+    if serialized['study_format_version'] in COMPACT_FORMAT_VERSIONS:
+        serialized = dict(serialized)
+        serialized['study_format_version'] = version
+        return serialized
+    compact = dict([(key, value) for key, value in six.iteritems(serialized)
+                    if key != 'parameters'])
+    compact['study_format_version'] = version
+    template = None
+    deltas = {}
+    for subject_id, parameters in sorted(
+            six.iteritems(serialized['parameters'])):
+        subject = serialized['subjects'][subject_id]
+        templated = template_parameters(parameters, subject['name'],
+                                        subject['groupname'])
+        if template is None:
+            template = templated
+        deltas[subject_id] = parameters_delta(template, templated)
+    compact['parameters_template'] = template or {}
+    compact['parameters'] = deltas
+    return compact
+
+
+def expand_study(serialized, version=FORMAT_VERSIONS[0]):
+    ''' serialized study (as in a study file) in the format 0.5 '''
+    if serialized['study_format_version'] not in COMPACT_FORMAT_VERSIONS:
+        serialized = dict(serialized)
+        serialized['study_format_version'] = version
+        return serialized
+    expanded = dict([(key, value) for key, value in six.iteritems(serialized)
+                     if key not in ('parameters', 'parameters_template')])
+    expanded['study_format_version'] = version
+    template = serialized['parameters_template']
+    expanded['parameters'] = {}
+    for subject_id, delta in six.iteritems(serialized['parameters']):
+        subject = serialized['subjects'][subject_id]
+        expanded['parameters'][subject_id] = expand_parameters(
+            apply_parameters_delta(template, delta), subject['name'],
+            subject['groupname'])
+    return expanded
+
+
+def convert_study_file(filename, output_filename=None,
+                       version=COMPACT_FORMAT_VERSIONS[-1]):
+    ''' convert a study file to the given format version, in place if
+    output_filename is not given
+    '''
+    if version not in FORMAT_VERSIONS:
+        raise ValueError("unsupported study format version '%s'" % version)
+    with open(filename) as f:
+        serialized = json.load(f)
+    if serialized.get('study_format_version') not in FORMAT_VERSIONS:
+        raise ValueError("unsupported study format version '%s'"
+                         % serialized.get('study_format_version'))
+    if version in COMPACT_FORMAT_VERSIONS:
+        serialized = compact_study(serialized, version)
+    else:
+        serialized = expand_study(serialized, version)
+    if output_filename is None:
+        output_filename = filename
+    # write the whole file before replacing the original one
+    tmp_filename = output_filename + '.tmp'
+    with open(tmp_filename, 'w') as f:
+        json.dump(serialized, f, indent=4, sort_keys=True)
+    os.rename(tmp_filename, output_filename)
+
+
+def main(argv):
+    parser = optparse.OptionParser(
+        usage='%prog STUDY_FILE [-o OUTPUT_FILE] [--format VERSION]')
+    parser.add_option('-o', '--output', dest='output', default=None,
+                      help='output study file (default: convert in place)')
+    parser.add_option('--format', dest='version',
+                      default=COMPACT_FORMAT_VERSIONS[-1],
+                      help='study format version: %s (default: %s)'
+                      % (', '.join(FORMAT_VERSIONS),
+                         COMPACT_FORMAT_VERSIONS[-1]))
+    options, args = parser.parse_args(argv[1:])
+    if len(args) != 1:
+        parser.error('a study file must be given')
+    try:
+        convert_study_file(args[0], options.output, options.version)
+    except (IOError, OSError, ValueError) as e:
+        print('conversion failed:', e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
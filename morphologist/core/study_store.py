@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import json
+import time
+import sqlite3
+import six
+
+
+class SQLiteStudyStore(object):
+    '''
+    Study storage in a SQLite file of the study output directory, as an
+    alternative to the study.json file (see Study.save_to_backup_file).
+
+    The store holds the same contents as a study file (see Study.serialize),
+    split into tables: the study properties (one row per property), the
+    subjects with their parameters, and the history of the runs. Saving a
+    study only writes the rows which have changed since the last load or
+    save, in a single transaction.
+
+    The database uses write-ahead logging, so that other processes (a batch
+    status query for instance) can read it while it is being updated.
+    '''
+    FILENAME = 'study.sqlite'
+    # seconds to wait for a lock held by another process
+    TIMEOUT = 30.
+
+    def __init__(self, filename):
+        self.filename = filename
+        # rows as last loaded or saved: key -> value for the properties,
+        # subject_id -> row for the subjects
+        self._properties = {}
+        self._subjects = {}
+
+    @classmethod
+    def from_directory(cls, directory):
+        return cls(os.path.join(directory, cls.FILENAME))
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.filename, timeout=self.TIMEOUT)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS properties ('
+            'key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS subjects ('
+            'subject_id TEXT PRIMARY KEY, name TEXT NOT NULL, '
+            'groupname TEXT NOT NULL, filename TEXT, parameters TEXT)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS subjects_names '
+            'ON subjects (groupname, name)')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            'date REAL, subject_id TEXT NOT NULL, step_ids TEXT, '
+            'backend TEXT)')
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS runs_subject ON runs (subject_id)')
+        return connection
+
+    def load(self):
+        '''
+        Returns
+        -------
+        serialized: dict
+            serialized study, as in a study file
+        '''
+        connection = self._connect()
+        try:
+            properties = connection.execute(
+                'SELECT key, value FROM properties').fetchall()
+            subjects = connection.execute(
+                'SELECT subject_id, name, groupname, filename, parameters '
+                'FROM subjects ORDER BY subject_id').fetchall()
+        finally:
+            connection.close()
+        self._properties = dict(properties)
+        self._subjects = dict([(row[0], row) for row in subjects])
+        serialized = dict([(key, json.loads(value))
+                           for key, value in properties])
+        serialized['subjects'] = {}
+        serialized['parameters'] = {}
+        for subject_id, name, groupname, filename, parameters in subjects:
+            serialized['subjects'][subject_id] = {
+                'name': name, 'groupname': groupname, 'filename': filename}
+            serialized['parameters'][subject_id] = json.loads(parameters)
+        return serialized
+
+    def save(self, serialized):
+        ''' write the changes of the serialized study (see load) since the
+        last load or save
+        '''
+        properties = dict([(key, json.dumps(value, sort_keys=True))
+                           for key, value in six.iteritems(serialized)
+                           if key not in ('subjects', 'parameters')])
+        subjects = {}
+        for subject_id, subject in six.iteritems(serialized['subjects']):
+            subjects[subject_id] = (
+                subject_id, subject['name'], subject['groupname'],
+                subject.get('filename'),
+                json.dumps(serialized['parameters'].get(subject_id, {}),
+                           sort_keys=True))
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO properties VALUES (?, ?)',
+                    [(key, value) for key, value in six.iteritems(properties)
+                     if self._properties.get(key) != value])
+                connection.executemany(
+                    'DELETE FROM properties WHERE key = ?',
+                    [(key, ) for key in self._properties
+                     if key not in properties])
+                connection.executemany(
+                    'INSERT OR REPLACE INTO subjects VALUES (?, ?, ?, ?, ?)',
+                    [row for subject_id, row in six.iteritems(subjects)
+                     if self._subjects.get(subject_id) != row])
+                connection.executemany(
+                    'DELETE FROM subjects WHERE subject_id = ?',
+                    [(subject_id, ) for subject_id in self._subjects
+                     if subject_id not in subjects])
+        finally:
+            connection.close()
+        self._properties = properties
+        self._subjects = subjects
+
+    def subject_ids(self, groupname=None, name=None):
+        ''' ids of the subjects of the given group and / or name '''
+        query = 'SELECT subject_id FROM subjects'
+        conditions = []
+        values = []
+        if groupname is not None:
+            conditions.append('groupname = ?')
+            values.append(groupname)
+        if name is not None:
+            conditions.append('name = ?')
+            values.append(name)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY subject_id'
+        connection = self._connect()
+        try:
+            return [row[0] for row in connection.execute(query, values)]
+        finally:
+            connection.close()
+
+    def add_run(self, subject_ids, step_ids=None, backend=None, date=None):
+        ''' record a run of the given subjects (and only of the given steps
+        if step_ids is specified)
+        '''
+        date = date or time.time()
+        if step_ids is not None:
+            step_ids = json.dumps(list(step_ids))
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO runs VALUES (?, ?, ?, ?)',
+                    [(date, subject_id, step_ids, backend)
+                     for subject_id in subject_ids])
+        finally:
+            connection.close()
+
+    def runs(self, subject_id=None):
+        '''
+        Returns
+        -------
+        runs: list
+            dicts with date, subject_id, step_ids (None for all steps) and
+            backend keys, by date
+        '''
+        query = 'SELECT date, subject_id, step_ids, backend FROM runs'
+        values = []
+        if subject_id is not None:
+            query += ' WHERE subject_id = ?'
+            values.append(subject_id)
+        query += ' ORDER BY date'
+        connection = self._connect()
+        try:
+            rows = connection.execute(query, values).fetchall()
+        finally:
+            connection.close()
+        return [{'date': date, 'subject_id': row_subject_id,
+                 'step_ids': step_ids and json.loads(step_ids),
+                 'backend': backend}
+                for date, row_subject_id, step_ids, backend in rows]
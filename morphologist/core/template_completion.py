@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+
+from morphologist.core import study_format
+
+
+OUTPUT_DIRECTORY_PLACEHOLDER = '${output_directory}'
+
+
+class TemplateCompletion(object):
+    '''
+    Completes the parameters of the analyses of many subjects at once.
+
+    The completion engine is run for a few reference subjects only: their
+    parameters, where the subject and group names are replaced by
+    placeholders (see study_format.template_parameters), give a template
+    from which the parameters of the other subjects are obtained by a
+    simple substitution.
+
+    A template is trusted once two references of different names lead to
+    the same one (a name which happens to be found in an unrelated string
+    would give different templates). The group placeholder is only trusted
+    for the groups of the references, until references of two groups agree
+    too. Subjects whose attributes differ from the ones of the references
+    in other ways than their names, or which are not covered by the
+    template, go through the completion engine.
+
+    Parameters
+    ----------
+    study: Study
+    '''
+    # references tried before giving up the template
+    MAX_REFERENCES = 4
+
+    def __init__(self, study):
+        self.study = study
+        self.template = None
+        self.groupnames = set()
+        # (subject, attributes) of the subject the template comes from
+        self._reference = None
+        # (subject, attributes, templated parameters) of the subjects
+        # completed by the engine
+        self._references = []
+
+    def set_parameters(self, analysis, subject):
+        ''' set the parameters of the analysis for the subject, by
+        substitution in the template whenever possible
+        '''
+        attributes = self._get_attributes(analysis, subject)
+        if self._can_substitute(subject, attributes):
+            parameters = study_format.expand_parameters(
+                self.template, subject.name, subject.groupname)
+            analysis.subject = subject
+            analysis.parameters = self._expand_output_directory(parameters)
+            return
+        analysis.set_parameters(subject)
+        self._learn(subject, attributes, analysis.parameters)
+
+    @staticmethod
+    def _get_attributes(analysis, subject):
+        try:
+            return analysis.get_attributes(subject)
+        except (AttributeError, NotImplementedError):
+            return None
+
+    def _can_substitute(self, subject, attributes):
+        if self.template is None or attributes is None:
+            return False
+        if len(self.groupnames) < 2 \
+                and subject.groupname not in self.groupnames:
+            return False
+        reference, reference_attributes = self._reference
+        return self._same_attributes(subject, attributes, reference,
+                                     reference_attributes)
+
+    @staticmethod
+    def _same_attributes(subject, attributes, other_subject,
+                         other_attributes):
+        ''' the attributes only differ by the names of the subjects '''
+        if sorted(attributes.keys()) != sorted(other_attributes.keys()):
+            return False
+        for key, value in attributes.items():
+            other_value = other_attributes[key]
+            if value == other_value:
+                continue
+            if value == subject.name and other_value == other_subject.name:
+                continue
+            if value == subject.groupname \
+                    and other_value == other_subject.groupname:
+                continue
+            return False
+        return True
+
+    def _learn(self, subject, attributes, parameters):
+        if attributes is None or parameters is None \
+                or len(self.groupnames) >= 2:
+            return
+        if self.template is None \
+                and len(self._references) >= self.MAX_REFERENCES:
+            return
+        templated = study_format.template_parameters(
+            self._template_output_directory(parameters), subject.name,
+            subject.groupname)
+        if self.template is not None:
+            reference, reference_attributes = self._reference
+            if self._same_attributes(subject, attributes, reference,
+                                     reference_attributes) \
+                    and not study_format.parameters_delta(self.template,
+                                                          templated):
+                self.groupnames.add(subject.groupname)
+            return
+        for reference, reference_attributes, reference_templated \
+                in self._references:
+            if reference.name != subject.name \
+                    and self._same_attributes(subject, attributes, reference,
+                                              reference_attributes) \
+                    and not study_format.parameters_delta(
+                        reference_templated, templated):
+                self.template = templated
+                self._reference = (reference, reference_attributes)
+                self.groupnames = set([reference.groupname,
+                                       subject.groupname])
+                self._references = []
+                return
+        self._references.append((subject, attributes, templated))
+
+    def _template_output_directory(self, parameters):
+        # the output directory may contain the names as well
+        prefix = os.path.normpath(self.study.output_directory) + os.sep
+
+        def template(value):
+            if value.startswith(prefix):
+                return OUTPUT_DIRECTORY_PLACEHOLDER + value[len(prefix) - 1:]
+            return value
+
+        return study_format.map_strings(parameters, template)
+
+    def _expand_output_directory(self, parameters):
+        directory = os.path.normpath(self.study.output_directory)
+
+        def expand(value):
+            if value.startswith(OUTPUT_DIRECTORY_PLACEHOLDER):
+                return directory + value[len(OUTPUT_DIRECTORY_PLACEHOLDER):]
+            return value
+
+        return study_format.map_strings(parameters, expand)
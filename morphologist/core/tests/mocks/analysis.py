@@ -2,7 +2,8 @@ from __future__ import absolute_import
 import os
 import glob
 
-from morphologist.core.analysis import SharedPipelineAnalysis
+from morphologist.core.analysis import SharedPipelineAnalysis, \
+    ImportationError
 from morphologist.core.subject import Subject
 from capsul.api import get_process_instance
 
@@ -91,6 +92,15 @@ class MockAnalysis(SharedPipelineAnalysis):
         return ['output_image']
 
 
+class MockImportFailedAnalysis(MockAnalysis):
+    ''' the importation of the subjects named "failed..." fails '''
+
+    def import_data(self, subject):
+        if subject.name.startswith('failed'):
+            raise ImportationError('cannot import %s' % subject.name)
+        return super(MockImportFailedAnalysis, self).import_data(subject)
+
+
 class MockFailedAnalysis(MockAnalysis):
 
     def build_pipeline(self):
@@ -14,9 +14,8 @@ class MockStudy(Study):
     def __init__(self, *args, **kwargs):
         super(MockStudy, self).__init__(*args, **kwargs)
 
-    def get_subjects_from_pattern(self, exact_match=False,
-                                  progress_callback=None):
-        subjects = []
+    def iter_subjects_from_pattern(self, exact_match=False,
+                                   progress_callback=None):
         glob_pattern = os.path.join(
             self.output_directory, "*_input.nii")
         regexp = re.compile(
@@ -28,7 +27,5 @@ class MockStudy(Study):
             if match:
                 groupname = match.group(1)
                 subjectname = match.group(2)
-                subject = Subject(subjectname, groupname, filename)
-                subjects.append(subject)
-        return subjects
+                yield Subject(subjectname, groupname, filename)
 
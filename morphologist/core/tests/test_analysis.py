@@ -2,6 +2,7 @@ from __future__ import absolute_import
 import unittest
 
 from morphologist.core.study import Study
+from morphologist.core.subject import Subject
 from morphologist.core.tests.analysis import MockAnalysisTestCase
 from capsul.pipeline import pipeline_tools
 import os
@@ -61,6 +62,69 @@ class TestAnalysis(unittest.TestCase):
         self.analysis.clear_results()
         self.assertTrue(not self.analysis.has_some_results())
 
+    def test_subjects_alternation_in_pipeline_pool(self):
+        # more subjects than pipeline instances: instances are reassigned
+        pool = self.study.pipeline_pool
+        # not measured when the second instance is built
+        pool.instance_memory = 100
+        pool.memory_cap = 200
+        analyses = []
+        for name in ('subject1', 'subject2', 'subject3'):
+            analysis = self.test_case.analysis_cls()(self.study)
+            analysis.set_parameters(Subject(
+                name, 'group',
+                os.path.join(self.test_case.output_directory, name)))
+            analyses.append(analysis)
+        self.assertEqual(pool.max_instances, 2)
+        analyses[0].propagate_parameters()
+        filename = analyses[0].pipeline.output_image
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write('something\n')
+        self.study.file_index.invalidate()
+
+        for i in range(2):
+            for analysis in analyses:
+                results = analysis.existing_results()
+                if analysis is analyses[0]:
+                    self.assertTrue(filename in results)
+                else:
+                    self.assertTrue(filename not in results)
+                self.assertEqual(analysis.pipeline.current_subject_id,
+                                 analysis.subject.id())
+
+    def test_format_conversions_of_a_pooled_subject(self):
+        # several pipeline instances: both subjects keep theirs
+        pool = self.study.pipeline_pool
+        pool.instance_memory = 100
+        pool.memory_cap = 300
+        analyses = []
+        for name in ('subject1', 'subject2'):
+            analysis = self.test_case.analysis_cls()(self.study)
+            analysis.set_parameters(Subject(
+                name, 'group',
+                os.path.join(self.test_case.output_directory, name)))
+            analyses.append(analysis)
+        analysis = analyses[0]
+        filename = analysis.parameters['state']['output_image']
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write('something\n')
+        old_volumes_format = self.study.volumes_format
+        if old_volumes_format == 'NIFTI gz':
+            self.study.volumes_format = 'NIFTI'
+        else:
+            self.study.volumes_format = 'NIFTI gz'
+
+        conversions = analysis.format_conversions(old_volumes_format,
+                                                  self.study.meshes_format)
+
+        new_filename = analysis.parameters['state']['output_image']
+        self.assertNotEqual(new_filename, filename)
+        self.assertTrue((filename, new_filename) in conversions)
+
     def test_step_id(self):
         self.assertEqual(len(self.analysis._step_ids),
                          len(self.analysis._steps))
@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+import sys
+import json
+import unittest
+import subprocess
+
+from six import StringIO
+
+from morphologist import batch
+from morphologist.core.tests.study import MockStudyTestCase
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.test_case = MockStudyTestCase()
+        self.test_case.create_study()
+        self.test_case.add_subjects()
+        self.study = self.test_case.study
+        self.study.save_to_backup_file()
+
+    def tearDown(self):
+        self.study.clear_results()
+
+    def run_batch(self, command, *args):
+        argv = ['morphologist', command, '-s', self.study.output_directory,
+                '--mock', '--backend', 'local_pool'] + list(args)
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            exit_code = batch.main(argv)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        return exit_code, json.loads(output)
+
+    def test_batch_does_not_import_qt(self):
+        code = ('import sys; import morphologist.batch; '
+                'print([m for m in sys.modules '
+                'if m.split(".")[0] in ("PyQt4", "PyQt5", "PySide", '
+                '"anatomist")])')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_run_and_status(self):
+        subject_id = self.test_case.get_a_subject_id()
+
+        exit_code, result = self.run_batch('run', '-S', subject_id)
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(list(result['subjects'].keys()), [subject_id])
+        self.assertEqual(result['subjects'][subject_id]['results'],
+                         'complete')
+        exit_code, result = self.run_batch('status')
+        self.assertEqual(sorted(result['subjects'].keys()),
+                         sorted(self.study.subjects.keys()))
+
+    def test_plan(self):
+        subject_id = self.test_case.get_a_subject_id()
+
+        exit_code, result = self.run_batch('plan', '-S', subject_id,
+                                           '-n', '2')
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(list(result['subjects'].keys()), [subject_id])
+        self.assertEqual(result['failing_subjects'], {})
+        self.assertTrue(result['jobs_n'] > 0)
+        self.assertTrue(0 < result['estimated_makespan']
+                        <= result['estimated_cpu_time'])
+        # nothing has been run
+        self.assertFalse(self.study.analyses[subject_id].has_some_results())
+
+    def test_unknown_subject(self):
+        exit_code, result = self.run_batch('run', '-S', 'unknown-subject')
+
+        self.assertEqual(exit_code, 2)
+        self.assertTrue('error' in result)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBatch)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from morphologist.core.file_index import FileSystemIndex
+
+
+class TestFileSystemIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        self.filename = os.path.join(self.directory, 'subject', 'image.nii')
+        os.mkdir(os.path.dirname(self.filename))
+        open(self.filename, 'w').close()
+        self.index = FileSystemIndex()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _age(self, path, seconds):
+        # pretend the path has not been modified for a while
+        mtime = os.stat(path).st_mtime - seconds
+        os.utime(path, (mtime, mtime))
+
+    def test_exists(self):
+        self.assert_(self.index.exists(self.filename))
+        self.assert_(self.index.exists(os.path.dirname(self.filename)))
+        self.assert_(not self.index.exists(self.filename + '.minf'))
+        self.assert_(not self.index.exists(
+            os.path.join(self.directory, 'other', 'image.nii')))
+        self.assert_(not self.index.exists(''))
+
+    def test_directory_modification(self):
+        subject_directory = os.path.dirname(self.filename)
+        self._age(subject_directory, 10)
+        self.assert_(self.index.exists(self.filename))
+        self.index.validity = 0.
+
+        os.remove(self.filename)
+        self._age(subject_directory, 5)
+
+        self.assert_(not self.index.exists(self.filename))
+
+    def test_invalidate(self):
+        self.assert_(not self.index.exists(self.filename + '.minf'))
+
+        open(self.filename + '.minf', 'w').close()
+        self.assert_(not self.index.exists(self.filename + '.minf'))
+        self.index.invalidate(self.directory)
+
+        self.assert_(self.index.exists(self.filename + '.minf'))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFileSystemIndex)
+    unittest.TextTestRunner(verbosity=2).run(suite)
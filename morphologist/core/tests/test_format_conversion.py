@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from soma import aims
+
+from morphologist.core.format_conversion import FormatConverter, \
+    FormatConversionError
+
+
+class TestFormatConverter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        self.converter = FormatConverter.from_directory(self.directory,
+                                                        processes_n=2)
+        self.conversions = []
+        for name in ('subject1', 'subject2', 'subject3'):
+            filename = os.path.join(self.directory, name + '.nii')
+            volume = aims.Volume(4, 4, 4, dtype='S16')
+            volume.fill(len(self.conversions))
+            aims.write(volume, filename)
+            self.conversions.append(
+                (filename, os.path.join(self.directory, name + '.ima')))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_convert(self):
+        self.converter.convert(self.conversions)
+
+        for n, (old_name, new_name) in enumerate(self.conversions):
+            self.assert_(not os.path.exists(old_name))
+            self.assertEqual(aims.read(new_name).value(0, 0, 0), n)
+        self.assert_(not self.converter.has_pending_conversion())
+
+    def test_resume(self):
+        missing = os.path.join(self.directory, 'subject4.nii')
+        conversions = self.conversions \
+            + [(missing, os.path.join(self.directory, 'subject4.ima'))]
+
+        self.assertRaises(FormatConversionError,
+                          self.converter.convert, conversions)
+        # nothing is removed until all the files are converted
+        for old_name, new_name in self.conversions:
+            self.assert_(os.path.exists(old_name))
+        self.assert_(self.converter.has_pending_conversion())
+
+        aims.write(aims.Volume(4, 4, 4, dtype='S16'), missing)
+        self.converter.resume()
+
+        for old_name, new_name in conversions:
+            self.assert_(not os.path.exists(old_name))
+            self.assert_(os.path.exists(new_name))
+        self.assert_(not self.converter.has_pending_conversion())
+
+    def test_rollback(self):
+        missing = os.path.join(self.directory, 'subject4.nii')
+        conversions = self.conversions \
+            + [(missing, os.path.join(self.directory, 'subject4.ima'))]
+        self.assertRaises(FormatConversionError,
+                          self.converter.convert, conversions)
+
+        self.assert_(not self.converter.can_rollback())
+        aims.write(aims.Volume(4, 4, 4, dtype='S16'), missing)
+        self.assert_(self.converter.can_rollback())
+        self.converter.rollback()
+
+        for old_name, new_name in conversions:
+            self.assert_(os.path.exists(old_name))
+            self.assert_(not os.path.exists(new_name))
+        self.assert_(not self.converter.has_pending_conversion())
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFormatConverter)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+import os
+import shutil
+import unittest
+
+from morphologist.core.study import Study
+from morphologist.core.subject import Subject
+from morphologist.core.importation import SubjectsImporter, \
+    ParallelSubjectsImporter
+from morphologist.core.tests import reset_directory
+
+
+class TestSubjectsImporter(unittest.TestCase):
+
+    def setUp(self):
+        tests_dir = os.environ.get('BRAINVISA_TEST_RUN_DATA_DIR')
+        if not tests_dir:
+            raise RuntimeError('BRAINVISA_TEST_RUN_DATA_DIR is not set')
+        output_directory = os.path.join(
+            tests_dir, 'tmp_tests_brainvisa/morphologist_test_importation')
+        reset_directory(output_directory)
+        self.study = Study(analysis_type='MockImportFailedAnalysis',
+                           study_name='importation',
+                           output_directory=output_directory)
+        input_filename = os.path.join(output_directory, 'foo')
+        self.subjects = [Subject(name, Subject.DEFAULT_GROUP, input_filename)
+                         for name in ('bla', 'failed_bla', 'blabla',
+                                      'blablabla', 'failed_blabla')]
+        self.study.add_subjects(self.subjects, import_data=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.study.output_directory)
+
+    def create_importer(self):
+        return SubjectsImporter(self.study)
+
+    def test_import_subjects(self):
+        notifications = []
+
+        def start_callback(subject):
+            notifications.append(('start', subject.id()))
+
+        def end_callback(subject, status_ok):
+            notifications.append(('end', subject.id(), status_ok))
+
+        failed = self.create_importer().import_subjects(
+            self.subjects, start_callback, end_callback)
+
+        failed_subjects = [subject for subject in self.subjects
+                           if subject.name.startswith('failed')]
+        self.assertEqual(failed, failed_subjects)
+        expected_notifications = []
+        for subject in self.subjects:
+            expected_notifications += [
+                ('start', subject.id()),
+                ('end', subject.id(), subject not in failed_subjects)]
+        self.assertEqual(notifications, expected_notifications)
+        for subject in self.subjects:
+            if subject in failed_subjects:
+                self.assert_(subject.id() not in self.study.subjects)
+                self.assert_(subject.id() not in self.study.analyses)
+            else:
+                self.assert_(subject.id() in self.study.subjects)
+                self.assert_(os.path.exists(subject.filename))
+
+
+class TestParallelSubjectsImporter(TestSubjectsImporter):
+
+    def create_importer(self):
+        return ParallelSubjectsImporter(self.study, 2)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSubjectsImporter)
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        TestParallelSubjectsImporter))
+    unittest.TextTestRunner(verbosity=2).run(suite)
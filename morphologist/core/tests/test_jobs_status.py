@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+import unittest
+
+from morphologist.core.jobs_status import JobsStatusTable
+
+
+NOT_STARTED = 0x0
+RUNNING = 0x1
+FAILED = 0x2
+SUCCESS = 0x4
+
+
+class TestJobsStatusTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = JobsStatusTable(NOT_STARTED)
+        self.table.add_job(1, 'subject1', 'step1')
+        self.table.add_job(2, 'subject1', 'step2')
+        self.table.add_job(3, 'subject1', 'step2')
+        self.table.add_job(4, 'subject2', 'step1')
+        self.decoded = []
+
+    def decode(self, raw_state):
+        self.decoded.append(raw_state)
+        return raw_state[0]
+
+    def test_sync_only_decodes_changed_jobs(self):
+        self.table.sync([(1, (RUNNING, None)), (2, (NOT_STARTED, None))],
+                        self.decode)
+        self.decoded = []
+        changes = self.table.sync([(1, (SUCCESS, 0)),
+                                   (2, (NOT_STARTED, None))], self.decode)
+
+        self.assertEqual(self.decoded, [(SUCCESS, 0)])
+        self.assertEqual(changes, [(1, RUNNING, SUCCESS)])
+
+    def test_unknown_jobs_are_ignored(self):
+        changes = self.table.sync([(12, (RUNNING, None))], self.decode)
+
+        self.assertEqual(changes, [])
+        self.assertEqual(self.decoded, [])
+
+    def test_aggregates(self):
+        self.table.sync([(1, (SUCCESS, 0)), (2, (RUNNING, None)),
+                         (4, (FAILED, 1))], self.decode)
+
+        self.assertEqual(self.table.counts(),
+                         {SUCCESS: 1, RUNNING: 1, FAILED: 1, NOT_STARTED: 1})
+        self.assertEqual(self.table.counts('subject1', 'step2'),
+                         {RUNNING: 1, NOT_STARTED: 1})
+        self.assertTrue(self.table.has_status(RUNNING, 'subject1'))
+        self.assertFalse(self.table.has_status(FAILED, 'subject1'))
+        self.assertTrue(self.table.has_status(FAILED, 'subject2', 'step1'))
+        self.assertEqual(self.table.step_ids('subject1', RUNNING), ['step2'])
+
+    def test_remove_subject(self):
+        self.table.sync([(4, (FAILED, 1))], self.decode)
+        self.table.remove_subject('subject2')
+
+        self.assertFalse(self.table.has_jobs('subject2'))
+        self.assertFalse(self.table.has_status(FAILED))
+        self.assertEqual(len(self.table), 3)
+
+    def test_job_ids(self):
+        self.assertEqual(self.table.job_ids('subject1', 'step2'), set([2, 3]))
+        self.assertEqual(self.table.job_ids('subject1'), set([1, 2, 3]))
+        self.assertEqual(self.table.job_step(4), ('subject2', 'step1'))
+
+    def test_job_covering_several_steps(self):
+        self.table.add_job(5, 'subject2', ('step2', 'step3', 'step2'))
+        self.table.sync([(5, (RUNNING, None))], self.decode)
+
+        self.assertEqual(self.table.job_step_ids(5),
+                         ('subject2', ('step2', 'step3')))
+        self.assertEqual(self.table.job_ids('subject2', 'step3'), set([5]))
+        self.assertEqual(self.table.counts('subject2'),
+                         {RUNNING: 1, NOT_STARTED: 1})
+        self.assertEqual(self.table.counts('subject2', 'step2'), {RUNNING: 1})
+        self.table.remove_job(5)
+        self.assertEqual(self.table.step_ids('subject2'), ['step1'])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestJobsStatusTable)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,166 @@
+from __future__ import absolute_import
+import sys
+import shutil
+import tempfile
+import threading
+import subprocess
+import unittest
+
+from soma_workflow.client import Job
+
+from morphologist.core.runner import Runner
+from morphologist.core.local_runner import LocalPoolRunner
+
+
+class MockFuture(object):
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def result(self):
+        return 0
+
+
+class MockExecutor(object):
+    ''' records the submitted jobs, which are over when finish is called '''
+
+    def __init__(self):
+        self.futures = {}
+
+    def submit(self, function, job_id):
+        future = MockFuture()
+        self.futures[job_id] = future
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+    def finish(self, job_id):
+        future = self.futures.pop(job_id)
+        for callback in future.callbacks:
+            callback(future)
+
+
+class TestLocalPoolRunnerAdmission(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = LocalPoolRunner(None)
+        self.runner._max_running_n = 2
+        self.runner._memory_budget = 1000
+        self.runner._tmp_directory = tempfile.mkdtemp(
+            prefix='morphologist_test_')
+        self.executor = MockExecutor()
+        self.runner._executor = self.executor
+
+    def tearDown(self):
+        shutil.rmtree(self.runner._tmp_directory, ignore_errors=True)
+
+    def _add_job(self, name, cpu_weight=1., memory=100, priority=0):
+        runner = self.runner
+        job_id = len(runner._jobs)
+        job = Job(['true'], name=name, priority=priority)
+        runner._jobs[job_id] = job
+        runner._job_loads[job_id] = (cpu_weight, memory)
+        runner._dependencies[job_id] = set()
+        runner._dependents[job_id] = set()
+        runner._states[job_id] = Runner.NOT_STARTED
+        with runner._condition:
+            runner._push_ready(job_id)
+        return job_id
+
+    def _start_ready_jobs(self):
+        with self.runner._condition:
+            self.runner._start_ready_jobs()
+
+    def _running_job_ids(self):
+        return sorted(self.executor.futures)
+
+    def test_memory_budget(self):
+        job1 = self._add_job('job1', memory=600)
+        self._add_job('job2', memory=600)
+
+        self._start_ready_jobs()
+
+        self.assertEqual(self._running_job_ids(), [job1])
+
+    def test_job_exceeding_the_budget_runs_alone(self):
+        job1 = self._add_job('job1', memory=2000)
+        job2 = self._add_job('job2')
+
+        self._start_ready_jobs()
+        self.assertEqual(self._running_job_ids(), [job1])
+        self.executor.finish(job1)
+        self.assertEqual(self._running_job_ids(), [job2])
+
+    def test_backfill(self):
+        running = self._add_job('running', priority=2)
+        self._start_ready_jobs()
+        heavy = self._add_job('heavy', cpu_weight=2., priority=1)
+        light = self._add_job('light')
+
+        self._start_ready_jobs()
+
+        self.assertEqual(self._running_job_ids(), [running, light])
+        self.assertEqual(self.runner._states[heavy], Runner.NOT_STARTED)
+
+    def test_waiting_job_is_not_starved(self):
+        self._add_job('light')
+        self._add_job('light')
+        self._start_ready_jobs()
+        heavy = self._add_job('heavy', cpu_weight=2., priority=1)
+        # a light job is always ready, and overtakes the heavy one as soon
+        # as a running job is over
+        for n in range(LocalPoolRunner.MAX_BACKFILL_SKIPS):
+            self._add_job('light')
+            self.executor.finish(self._running_job_ids()[0])
+            self.assertEqual(len(self._running_job_ids()), 2)
+        self._add_job('light')
+        self.executor.finish(self._running_job_ids()[0])
+
+        # the free resources are now kept for the heavy job
+        self.assertEqual(len(self._running_job_ids()), 1)
+        self.executor.finish(self._running_job_ids()[0])
+        self.assertEqual(self._running_job_ids(), [heavy])
+
+
+class TestLocalPoolRunnerProcesses(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = LocalPoolRunner(None)
+
+    def test_wait_process_with_concurrent_polls(self):
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(0.5)'])
+        polls = []
+        done = threading.Event()
+
+        def poll():
+            # as the stop and speculation code does
+            while not done.is_set():
+                with self.runner._condition:
+                    polls.append(process.poll())
+                done.wait(0.01)
+
+        thread = threading.Thread(target=poll)
+        thread.start()
+        try:
+            returncode, cpu_time, peak_rss = self.runner._wait_process(
+                process)
+        finally:
+            done.set()
+            thread.join()
+
+        self.assertEqual(returncode, 0)
+        self.assertEqual(process.poll(), 0)
+        self.assert_(set(polls) <= set([None, 0]))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestLocalPoolRunnerAdmission)
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        TestLocalPoolRunnerProcesses))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from morphologist.core.manifest import OutputManifest, file_checksum
+
+
+class TestOutputManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        self.outputs_directory = os.path.join(self.directory, 't1mri')
+        os.mkdir(self.outputs_directory)
+        self.filename = os.path.join(self.outputs_directory, 'image.nii')
+        with open(self.filename, 'w') as f:
+            f.write('image')
+        # pretend the directories have not been modified for a while
+        for directory in (self.directory, self.outputs_directory):
+            os.utime(directory, (1000000000.5, 1000000000.5))
+        self.manifest = OutputManifest.from_subject_directory(self.directory)
+        self.manifest.write({'step1': [self.filename], 'step2': []},
+                            ['step1'], False, 'hash',
+                            [self.outputs_directory], ['step1'],
+                            checksums=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read(self):
+        manifest = self.manifest.read('hash')
+
+        self.assertEqual(list(manifest['steps']['step1']['outputs']),
+                         [self.filename])
+        output = manifest['steps']['step1']['outputs'][self.filename]
+        self.assertEqual(output['size'], 5)
+        self.assertEqual(output['checksum'], file_checksum(self.filename))
+        self.assert_(manifest['steps']['step1']['complete'])
+        self.assert_(not manifest['steps']['step2']['complete'])
+        self.assertEqual(list(manifest['completion_dates']), ['step1'])
+
+    def test_changed_parameters(self):
+        self.assertEqual(self.manifest.read('other hash'), None)
+
+    def test_changed_directory(self):
+        os.remove(self.filename)
+
+        self.assertEqual(self.manifest.read('hash'), None)
+
+    def test_missing(self):
+        self.manifest.remove()
+
+        self.assertEqual(self.manifest.read('hash'), None)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestOutputManifest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from morphologist.core.organized_directory import scan_organized_directory
+
+
+class TestOrganizedDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        for groupname, subjectname, acquisition, filename in (
+                ('group1', 'subject1', 'default_acquisition', 'subject1.nii'),
+                ('group1', 'subject2', 'default_acquisition',
+                 'subject2.nii.gz'),
+                ('group1', 'subject2', 'other_acquisition', 'subject2.nii'),
+                ('group2', 'subject3', 'default_acquisition', 'other.nii'),
+                ('group2', 'subject4', 'default_acquisition', 'subject4.ima'),
+                ('.hidden', 'subject5', 'default_acquisition',
+                 'subject5.nii')):
+            acquisition_dir = os.path.join(self.directory, groupname,
+                                           subjectname, 't1mri', acquisition)
+            if not os.path.isdir(acquisition_dir):
+                os.makedirs(acquisition_dir)
+            open(os.path.join(acquisition_dir, filename), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_scan(self):
+        progress = []
+
+        found = list(scan_organized_directory(
+            self.directory, extensions=('nii', 'nii.gz', 'ima'), threads_n=3,
+            progress_callback=progress.append))
+
+        self.assertEqual([(groupname, subjectname,
+                           [extension for _, extension in images])
+                          for groupname, subjectname, images in found],
+                         [('group1', 'subject1', ['nii']),
+                          ('group1', 'subject2', ['nii.gz', 'nii']),
+                          ('group2', 'subject4', ['ima'])])
+        self.assertEqual(found[0][2][0][0], os.path.join(
+            self.directory, 'group1', 'subject1', 't1mri',
+            'default_acquisition', 'subject1.nii'))
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 1.)
+
+    def test_scan_acquisitions(self):
+        found = list(scan_organized_directory(
+            self.directory, acquisitions=['default_acquisition']))
+
+        self.assertEqual([subjectname for _, subjectname, _ in found],
+                         ['subject1'])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestOrganizedDirectory)
+    unittest.TextTestRunner(verbosity=2).run(suite)
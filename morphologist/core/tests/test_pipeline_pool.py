@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+import unittest
+
+from morphologist.core import pipeline_pool
+from morphologist.core.pipeline_pool import PipelinePool
+
+
+class MockPipeline(object):
+    pass
+
+
+class TestPipelinePool(unittest.TestCase):
+
+    def setUp(self):
+        self.built = []
+        self.pool = PipelinePool(self._build_pipeline, memory_cap=300)
+        # do not depend on the memory used by the test process
+        self.pool.instance_memory = 100
+
+    def _build_pipeline(self):
+        pipeline = MockPipeline()
+        self.built.append(pipeline)
+        return pipeline
+
+    def _set_state(self, subject_id, parameters=None):
+        pipeline = self.pool.get(subject_id, parameters)
+        if pipeline is None:
+            pipeline = self.pool.assign(subject_id)
+            pipeline.current_subject_id = subject_id
+            pipeline.current_parameters = parameters
+        return pipeline
+
+    def test_first_instance_is_assigned_first(self):
+        first = self.pool.first_instance()
+
+        self.assert_(self._set_state('subject1') is first)
+        self.assertEqual(len(self.built), 1)
+
+    def test_recently_used_subjects_are_kept(self):
+        pipelines = [self._set_state(subject_id)
+                     for subject_id in ('subject1', 'subject2', 'subject3')]
+
+        self.assertEqual(len(self.built), 3)
+        for subject_id, pipeline in zip(('subject1', 'subject2', 'subject3'),
+                                        pipelines):
+            self.assert_(self.pool.get(subject_id) is pipeline)
+        self.assertEqual(self.pool.hits, 3)
+        self.assertEqual(self.pool.misses, 3)
+
+    def test_least_recently_used_instance_is_reassigned(self):
+        pipeline1 = self._set_state('subject1')
+        self._set_state('subject2')
+        self._set_state('subject3')
+        self._set_state('subject2')
+
+        pipeline4 = self._set_state('subject4')
+
+        self.assertEqual(len(self.built), 3)
+        self.assert_(pipeline4 is pipeline1)
+        self.assert_(self.pool.get('subject1') is None)
+        self.assert_(self.pool.get('subject2') is not None)
+
+    def test_memory_cap(self):
+        self.pool.memory_cap = 50
+
+        pipeline1 = self._set_state('subject1')
+        pipeline2 = self._set_state('subject2')
+
+        self.assertEqual(self.pool.max_instances, 1)
+        self.assert_(pipeline1 is pipeline2)
+
+    def test_changed_parameters(self):
+        parameters = {'t1mri': 'subject1.nii'}
+        self._set_state('subject1', parameters)
+
+        self.assert_(self.pool.get('subject1', parameters) is not None)
+        self.assert_(self.pool.get('subject1',
+                                   {'t1mri': 'subject2.nii'}) is None)
+
+    def test_equal_parameters(self):
+        # parameters decoded again from the study
+        parameters = {'t1mri': 'subject1.nii'}
+        pipeline = self._set_state('subject1', parameters)
+        decoded_parameters = dict(parameters)
+
+        self.assert_(self.pool.get('subject1', decoded_parameters)
+                     is pipeline)
+        self.assert_(pipeline.current_parameters is decoded_parameters)
+
+    def test_forget(self):
+        pipeline = self._set_state('subject1')
+        self._set_state('subject2')
+
+        self.pool.forget('subject1')
+
+        self.assert_(self.pool.get('subject1') is None)
+        self.assert_(self.pool.get('subject2') is not None)
+        # the instance is free again
+        self.assert_(self._set_state('subject3') is pipeline)
+        self.assertEqual(len(self.built), 2)
+
+    def test_instance_memory(self):
+        memory = [1000]
+
+        def resident_memory():
+            return memory[0]
+
+        def build_pipeline():
+            # the first instance also loads the modules of the pipeline
+            memory[0] += len(self.built) == 0 and 500 or 50
+            return self._build_pipeline()
+
+        resident_memory_function = pipeline_pool._resident_memory
+        pipeline_pool._resident_memory = resident_memory
+        try:
+            pool = PipelinePool(build_pipeline, memory_cap=1000)
+            pool.first_instance()
+            self.assert_(pool.instance_memory is None)
+            pool.assign('subject1')
+            pool.assign('subject2')
+        finally:
+            pipeline_pool._resident_memory = resident_memory_function
+
+        self.assertEqual(pool.instance_memory, 50)
+        self.assertEqual(pool.max_instances, 20)
+
+    def test_statistics(self):
+        self._set_state('subject1')
+        self._set_state('subject1')
+        self._set_state('subject1')
+
+        statistics = self.pool.statistics()
+        self.assertEqual(statistics['hits'], 2)
+        self.assertEqual(statistics['misses'], 1)
+        self.assertAlmostEqual(statistics['hit_rate'], 2. / 3)
+        self.assertEqual(statistics['instances'], 1)
+        self.assertEqual(statistics['max_instances'], 3)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestPipelinePool)
+    unittest.TextTestRunner(verbosity=2).run(suite)
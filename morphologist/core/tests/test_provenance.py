@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+import traits.api as traits
+from capsul.api import Process, Pipeline
+
+from morphologist.core.provenance import StepsProvenance, \
+    disable_steps_with_unchanged_provenance
+
+
+class MockProcess(Process):
+
+    def __init__(self):
+        super(MockProcess, self).__init__()
+        self.add_trait('input', traits.File(output=False))
+        self.add_trait('threshold', traits.Int(1))
+        self.add_trait('output', traits.File(output=True))
+
+    def _run_process(self):
+        pass
+
+
+class MockPipeline(Pipeline):
+    # the parameters are exported below, under distinct names
+    do_autoexport_nodes_parameters = False
+
+    def pipeline_definition(self):
+        self.add_process('first', MockProcess())
+        self.add_process('second', MockProcess())
+        self.add_link('first.output->second.input')
+        self.export_parameter('first', 'input')
+        self.export_parameter('first', 'threshold', 'first_threshold')
+        self.export_parameter('first', 'output', 'first_output')
+        self.export_parameter('second', 'threshold')
+        self.export_parameter('second', 'output', 'second_output')
+        self.add_pipeline_step('step1', ['first'])
+        self.add_pipeline_step('step2', ['second'])
+
+
+class TestStepsProvenance(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        self.pipeline = MockPipeline()
+        self.pipeline.input = self._filename('input.nii')
+        self.pipeline.first_output = self._filename('first.nii')
+        self.pipeline.second_output = self._filename('second.nii')
+        self._write(self.pipeline.input)
+        self.provenance = StepsProvenance.from_subject_directory(
+            self.directory)
+        # first run of the steps
+        self._steps_to_run()
+        self._write(self.pipeline.first_output)
+        self._write(self.pipeline.second_output)
+        self.provenance.record(['step1', 'step2'])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _filename(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, filename, content='data'):
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    def _steps_to_run(self):
+        self.pipeline.enable_all_pipeline_steps()
+        return disable_steps_with_unchanged_provenance(self.pipeline,
+                                                       self.provenance)
+
+    def test_unchanged_steps_are_skipped(self):
+        self.assertEqual(self._steps_to_run(), set())
+        self.assert_(not self.pipeline.pipeline_steps.step1)
+        self.assert_(not self.pipeline.pipeline_steps.step2)
+
+    def test_changed_parameter(self):
+        self.pipeline.threshold = 2
+
+        self.assertEqual(self._steps_to_run(), set(['step2']))
+        self.assert_(not self.pipeline.pipeline_steps.step1)
+        self.assert_(self.pipeline.pipeline_steps.step2)
+
+    def test_changed_input_reruns_dependents(self):
+        self._write(self.pipeline.input, 'modified data')
+
+        self.assertEqual(self._steps_to_run(), set(['step1', 'step2']))
+
+    def test_missing_outputs(self):
+        os.unlink(self.pipeline.second_output)
+
+        self.assertEqual(self._steps_to_run(), set(['step2']))
+
+    def test_selected_steps(self):
+        self.pipeline.enable_all_pipeline_steps()
+        self.pipeline.pipeline_steps.step1 = False
+
+        # the hash of step2 does not depend on the selection of step1
+        self.assertEqual(disable_steps_with_unchanged_provenance(
+            self.pipeline, self.provenance), set())
+        self.assert_(not self.pipeline.pipeline_steps.step1)
+        self.assert_(not self.pipeline.pipeline_steps.step2)
+
+    def test_record(self):
+        self.pipeline.threshold = 2
+        self._steps_to_run()
+        self.assertEqual(list(self.provenance.load()['pending']), ['step2'])
+
+        self.provenance.record(['step2'])
+
+        self.assertEqual(self.provenance.load()['pending'], {})
+        self.assertEqual(self._steps_to_run(), set())
+
+    def test_steps_without_provenance(self):
+        os.unlink(self.provenance.filename)
+
+        self.assertEqual(self._steps_to_run(), set())
+        self.assertEqual(sorted(self.provenance.load()['recorded']),
+                         ['step1', 'step2'])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStepsProvenance)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,36 @@
+from __future__ import absolute_import
+import unittest
+
+from morphologist.core.retry import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        attempts = {'licence_step': 3}
+        self.policy = RetryPolicy(lambda step_id: attempts.get(step_id, 1),
+                                  delay=10., max_delay=25.,
+                                  reduce_concurrency=True)
+
+    def test_can_retry(self):
+        self.assertTrue(self.policy.can_retry('licence_step', 1))
+        self.assertTrue(self.policy.can_retry('licence_step', 2))
+        self.assertFalse(self.policy.can_retry('licence_step', 3))
+        self.assertFalse(self.policy.can_retry('other_step', 1))
+
+    def test_retry_delay(self):
+        self.assertEqual([self.policy.retry_delay(attempts)
+                          for attempts in (1, 2, 3)], [10., 20., 25.])
+
+    def test_reserved_memory(self):
+        self.assertEqual(self.policy.reserved_memory(500, 1, 4000), 1000)
+        self.assertEqual(self.policy.reserved_memory(500, 4, 4000), 4000)
+        # a job needing more than the budget keeps its own needs
+        self.assertEqual(self.policy.reserved_memory(5000, 1, 4000), 5000)
+        self.policy.reduce_concurrency = False
+        self.assertEqual(self.policy.reserved_memory(500, 1, 4000), 500)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRetryPolicy)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -6,6 +6,7 @@ import optparse
 
 from morphologist.core.runner import MissingInputFileError, \
     Runner, SomaWorkflowRunner
+from morphologist.core.local_runner import LocalPoolRunner
 from morphologist.core.tests.study import MockStudyTestCase
 
 
@@ -64,6 +65,20 @@ class TestRunnerOnSuccessStudy(TestRunner):
         self.assert_(not self.runner.has_failed(update_status=False))
         self.assert_output_files_exist()
 
+    def test_incremental_run(self):
+        selected_subject_id = self.test_case.get_a_subject_id()
+        self.runner.run(subject_ids=[selected_subject_id])
+        job_ids = self.runner._jobs_status.job_ids(selected_subject_id)
+        self.runner.run(incremental=True)
+
+        if self.runner.is_running(selected_subject_id):
+            self.assertEqual(
+                self.runner._jobs_status.job_ids(selected_subject_id),
+                job_ids)
+        self.runner.wait()
+        self.assert_(not self.runner.has_failed(update_status=False))
+        self.assert_output_files_exist()
+
     def test_stop(self):
         self.runner.run()
         time.sleep(1)
@@ -71,6 +86,18 @@ class TestRunnerOnSuccessStudy(TestRunner):
 
         self.assert_(not self.runner.is_running(update_status=False))
 
+    def test_stop_subject(self):
+        stopped_subject_id = self.test_case.get_a_subject_id()
+        self.runner.run()
+        self.runner.stop(stopped_subject_id)
+
+        self.assert_(not self.runner.is_running(stopped_subject_id))
+        self.runner.wait()
+        for subject_id in self.study.subjects:
+            if subject_id != stopped_subject_id:
+                self.assert_(self.study.has_all_results([subject_id]))
+        self.assert_output_files_exist_only_for_succeed_steps_after_stop()
+
     def test_clear_state_after_immediate_interruption(self):
         self.runner.run()
         self.runner.stop()
@@ -138,6 +165,37 @@ class TestSomaWorkflowRunner(TestRunnerOnSuccessStudy):
     def create_runner(self, study):
         return SomaWorkflowRunner(study)
 
+    def test_attach_after_restart(self):
+        selected_subject_id = self.test_case.get_a_subject_id()
+        self.runner.run(subject_ids=[selected_subject_id])
+        job_ids = self.runner._jobs_status.job_ids(selected_subject_id)
+
+        # as if the study was reopened in a new session
+        runner = self.create_runner(self.study)
+        self.assert_(runner.attach())
+        self.assertEqual(runner._jobs_status.job_ids(selected_subject_id),
+                         job_ids)
+        runner.wait()
+        self.assert_(not runner.has_failed())
+        self.assert_(self.study.has_all_results([selected_subject_id]))
+
+    def test_attach_to_ended_jobs(self):
+        selected_subject_id = self.test_case.get_a_subject_id()
+        self.runner.run(subject_ids=[selected_subject_id])
+        self.runner.wait()
+
+        runner = self.create_runner(self.study)
+        self.assert_(runner.attach())
+        # the ended jobs are not reported as newly completed
+        self.assertEqual(runner._update_jobs_status(), [])
+        self.assert_(not runner.is_running())
+
+
+class TestLocalPoolRunner(TestRunnerOnSuccessStudy):
+
+    def create_runner(self, study):
+        return LocalPoolRunner(study)
+
 
 if __name__=='__main__':
     parser = optparse.OptionParser()
@@ -148,6 +206,8 @@ if __name__=='__main__':
     if options.test is None:
         suite = unittest.TestLoader().loadTestsFromTestCase(
             TestSomaWorkflowRunner)
+        suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+            TestLocalPoolRunner))
         unittest.TextTestRunner(verbosity=2).run(suite)
     else:
         test_suite = unittest.TestSuite([TestSomaWorkflowRunner(options.test)])
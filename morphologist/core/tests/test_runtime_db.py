@@ -0,0 +1,48 @@
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from morphologist.core.runtime_db import StepRuntimeDatabase
+
+
+class TestStepRuntimeDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        self.runtime_db = StepRuntimeDatabase(
+            os.path.join(self.directory, StepRuntimeDatabase.FILENAME))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_empty_database(self):
+        self.assertFalse(self.runtime_db.exists())
+        self.assertEqual(self.runtime_db.percentiles(), {})
+
+    def test_percentiles(self):
+        for i, wall_time in enumerate([10., 20., 30., 40., 50.]):
+            self.runtime_db.add_record('step1', 'subject%d' % i, wall_time,
+                                       cpu_time=wall_time / 2., host='host1',
+                                       dimensions=(256, 256, 128))
+        self.runtime_db.add_record('step2', 'subject0', 100., host='host2')
+
+        percentiles = self.runtime_db.percentiles((50, 90))
+        self.assertEqual(percentiles['step1'], {50: 30., 90: 46.})
+        self.assertEqual(percentiles['step2'], {50: 100., 90: 100.})
+        self.assertEqual(
+            self.runtime_db.percentiles((50, ), 'cpu_time')['step1'],
+            {50: 15.})
+        self.assertEqual(list(self.runtime_db.percentiles(
+            host='host2').keys()), ['step2'])
+        self.assertEqual(len(self.runtime_db.records(
+            dimensions=(256, 256, 128))), 5)
+        self.assertEqual(self.runtime_db.median_durations(),
+                         {'step1': 30., 'step2': 100.})
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestStepRuntimeDatabase)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,210 @@
+from __future__ import absolute_import
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+from soma_workflow.client import Workflow, Job, Group, TemporaryPath
+from capsul.api import Pipeline
+from capsul.pipeline import pipeline_workflow
+
+from morphologist.core.scheduling import critical_path_lengths, \
+    set_jobs_priorities, simulate_makespan, fuse_short_jobs, \
+    job_step_ids, CRITICAL_PATH_PRIORITIES, LONGEST_SUBJECT_FIRST_PRIORITIES
+from morphologist.core.job_chain import split_commands, split_parameters, \
+    chain_parameters, main as job_chain_main
+
+
+DURATIONS = {'short': 10, 'long': 100}
+
+
+def job_duration(job):
+    return sum([DURATIONS[step_id] for step_id in job_step_ids(job)])
+
+
+class TestScheduling(unittest.TestCase):
+
+    def setUp(self):
+        # subject1: short -> short, subject2: short -> long -> long
+        self.jobs = {}
+        jobs = []
+        dependencies = []
+        groups = []
+        for subject_id, steps in (('subject1', ['short', 'short']),
+                                  ('subject2', ['short', 'long', 'long'])):
+            subject_jobs = []
+            for i, step_id in enumerate(steps):
+                job = Job(['true'], name='%s_%d' % (subject_id, i))
+                # not assigned by Job.__init__
+                job.user_storage = step_id
+                subject_jobs.append(job)
+            self.jobs[subject_id] = subject_jobs
+            jobs += subject_jobs
+            dependencies += list(zip(subject_jobs[:-1], subject_jobs[1:]))
+            group = Group(subject_jobs, name=subject_id)
+            group.user_storage = subject_id
+            groups.append(group)
+        self.workflow = Workflow(jobs=jobs, dependencies=dependencies,
+                                 root_group=groups)
+
+    def test_critical_path_lengths(self):
+        lengths = critical_path_lengths(self.workflow, job_duration)
+
+        self.assertEqual([lengths[job] for job in self.jobs['subject1']],
+                         [20, 10])
+        self.assertEqual([lengths[job] for job in self.jobs['subject2']],
+                         [210, 200, 100])
+
+    def test_critical_path_priorities(self):
+        set_jobs_priorities(self.workflow, CRITICAL_PATH_PRIORITIES,
+                            job_duration)
+
+        self.assertTrue(self.jobs['subject2'][0].priority
+                        > self.jobs['subject1'][0].priority)
+
+    def test_longest_subject_first_priorities(self):
+        set_jobs_priorities(self.workflow, LONGEST_SUBJECT_FIRST_PRIORITIES,
+                            job_duration)
+
+        self.assertEqual([job.priority for job in self.jobs['subject2']],
+                         [100] * 3)
+        self.assertEqual([job.priority for job in self.jobs['subject1']],
+                         [0] * 2)
+
+    def test_simulate_makespan(self):
+        self.assertEqual(simulate_makespan(self.workflow, job_duration, 1),
+                         230)
+        self.assertEqual(simulate_makespan(self.workflow, job_duration, 2),
+                         210)
+        self.assertEqual(simulate_makespan(Workflow(jobs=[]), job_duration,
+                                           4), 0)
+
+    def test_fuse_short_jobs(self):
+        fused_n = fuse_short_jobs(self.workflow, job_duration, 30)
+
+        # subject1 short jobs are fused, subject2 long jobs are kept
+        self.assertEqual(fused_n, 2)
+        self.assertEqual(len(self.workflow.jobs), 4)
+        fused_job = self.workflow.root_group[0].elements[0]
+        self.assertEqual(self.workflow.root_group[0].elements, [fused_job])
+        self.assertEqual(job_step_ids(fused_job), ['short', 'short'])
+        self.assertEqual(split_commands(fused_job.command[3:]),
+                         [['true'], ['true']])
+        self.assertEqual(len(self.workflow.dependencies), 2)
+        self.assertEqual(critical_path_lengths(
+            self.workflow, job_duration)[fused_job], 20)
+
+    def test_fusion_duration_threshold(self):
+        self.assertEqual(fuse_short_jobs(self.workflow, job_duration, 15), 0)
+        self.assertEqual(len(self.workflow.jobs), 5)
+
+
+
+class LinearPipeline(Pipeline):
+
+    def pipeline_definition(self):
+        for name in ('node1', 'node2', 'node3'):
+            self.add_process(
+                name, 'capsul.pipeline.test.test_pipeline.DummyProcess')
+        self.add_link('node1.output_image->node2.input_image')
+        self.add_link('node2.output_image->node3.input_image')
+        self.export_parameter('node1', 'input_image')
+        self.export_parameter('node3', 'output_image')
+        self.add_pipeline_step('step1', ['node1'])
+        self.add_pipeline_step('step2', ['node2'])
+        self.add_pipeline_step('step3', ['node3'])
+
+
+class TestCapsulJobsFusion(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        pipeline = LinearPipeline()
+        pipeline.input_image = os.path.join(self.directory, 'input.nii')
+        pipeline.output_image = os.path.join(self.directory, 'output.nii')
+        self.workflow = pipeline_workflow.workflow_from_pipeline(pipeline)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fuse_capsul_jobs(self):
+        # capsul jobs get their parameters from an input parameters file,
+        # the output directories creation job runs in another configuration
+        jobs = [job for job in self.workflow.jobs
+                if getattr(job, 'use_input_params_file', False)]
+        self.assertEqual(len(jobs), 3)
+        other_jobs = [job for job in self.workflow.jobs if job not in jobs]
+        jobs.sort(key=job_step_ids)
+
+        fused_n = fuse_short_jobs(self.workflow, lambda job: 1., 10.)
+
+        self.assertEqual(fused_n, 3)
+        fused_jobs = [job for job in self.workflow.jobs
+                      if job not in other_jobs]
+        self.assertEqual(len(fused_jobs), 1)
+        fused_job = fused_jobs[0]
+        self.assertEqual(job_step_ids(fused_job), ['step1', 'step2', 'step3'])
+        self.assertEqual(split_commands(fused_job.command[3:]),
+                         [job.command for job in jobs])
+        self.assert_(fused_job.use_input_params_file)
+        jobs_params_conf = split_parameters(
+            {'parameters': fused_job.param_dict})
+        self.assertEqual([jobs_params_conf[index]['parameters']
+                          for index in range(3)],
+                         [job.param_dict for job in jobs])
+        # the temporary files produced in the chain are not its inputs
+        self.assert_(not [item for item in fused_job.referenced_input_files
+                          if isinstance(item, TemporaryPath)])
+
+
+class TestJobChain(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        os.environ.pop('SOMAWF_INPUT_PARAMS', None)
+
+    def _copy_input_params_command(self, name):
+        # command copying its input parameters file, if any
+        return [sys.executable, '-c',
+                'import os, shutil; '
+                'filename = os.environ.get("SOMAWF_INPUT_PARAMS"); '
+                'filename and shutil.copy(filename, %r)'
+                % os.path.join(self.directory, name)]
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, name)) as f:
+            return json.load(f)
+
+    def test_input_parameters(self):
+        params_file = os.path.join(self.directory, 'chain_params.json')
+        with open(params_file, 'w') as f:
+            json.dump({'parameters': chain_parameters(
+                           [{'threshold': 1}, None, {'threshold': 3}]),
+                       'configuration_dict': {'spm': 12}}, f)
+        os.environ['SOMAWF_INPUT_PARAMS'] = params_file
+        args = ['job_chain']
+        for name in ('job0', 'job1', 'job2'):
+            args += ['--morphologist-next-job--'] \
+                + self._copy_input_params_command(name)
+
+        self.assertEqual(job_chain_main(args), 0)
+
+        self.assertEqual(self._read('job0'),
+                         {'parameters': {'threshold': 1},
+                          'configuration_dict': {'spm': 12}})
+        self.assert_(not os.path.exists(os.path.join(self.directory,
+                                                     'job1')))
+        self.assertEqual(self._read('job2')['parameters'], {'threshold': 3})
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestScheduling)
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        TestCapsulJobsFusion))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(TestJobChain))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+import unittest
+
+from morphologist.core.runner import SomaWorkflowRunner
+
+
+class MockWorkflowController(object):
+    ''' records the calls made by the runner '''
+
+    def __init__(self):
+        self.calls = []
+
+    def stop_jobs(self, workflow_id, job_ids):
+        self.calls.append(('stop_jobs', workflow_id, sorted(job_ids)))
+
+    def wait_job(self, job_ids):
+        self.calls.append(('wait_job', sorted(job_ids)))
+
+    def workflow_elements_status(self, workflow_id):
+        return [], [], 'workflow_done', []
+
+    def transfer_files(self, engine_paths, buffer_size):
+        pass
+
+
+class TestSomaWorkflowRunnerStop(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = SomaWorkflowRunner(None)
+        self.controller = MockWorkflowController()
+        self.runner._workflow_controller = self.controller
+        # two live workflows, the second one submitted incrementally
+        self.runner._register_jobs([(1, 'subject1', 'step1'),
+                                    (2, 'subject1', 'step2')], 10)
+        self.runner._register_jobs([(3, 'subject2', 'step1'),
+                                    (4, 'subject2', 'step2')], 11)
+
+    def test_jobs_are_stopped_by_workflow(self):
+        self.runner._jobs_stop(set([2, 3, 4]))
+
+        self.assertEqual(self.controller.calls,
+                         [('stop_jobs', 10, [2]),
+                          ('stop_jobs', 11, [3, 4]),
+                          ('wait_job', [2, 3, 4])])
+
+    def test_other_workflows_are_left_running(self):
+        self.runner._jobs_stop(set([1]))
+
+        self.assertEqual(self.controller.calls,
+                         [('stop_jobs', 10, [1]), ('wait_job', [1])])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestSomaWorkflowRunnerStop)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,116 @@
+from __future__ import absolute_import
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from soma_workflow.client import Job
+
+from morphologist.core.speculation import StragglerDetector, \
+    SpeculativeOutputs
+
+
+def create_job(name, step_ids):
+    job = Job(['true'], name=name)
+    # not assigned by Job.__init__
+    job.user_storage = step_ids
+    return job
+
+
+class TestStragglerDetector(unittest.TestCase):
+
+    def test_threshold(self):
+        detector = StragglerDetector({'step1': 30., 'step2': 100.})
+        job = create_job('job', 'step2')
+        fused_job = create_job('fused', ['step1', 'step2'])
+        unknown_job = create_job('unknown', ['step1', 'step3'])
+
+        self.assertEqual(detector.threshold(job), 100.)
+        self.assertEqual(detector.threshold(fused_job), 130.)
+        self.assertEqual(detector.threshold(unknown_job), None)
+
+
+class TestSpeculativeOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        self.subject_directory = os.path.join(self.directory, 'subject')
+        os.mkdir(self.subject_directory)
+        self.input_file = os.path.join(self.subject_directory, 'input.txt')
+        self.output_file = os.path.join(self.subject_directory, 'output.txt')
+        with open(self.input_file, 'w') as f:
+            f.write('input')
+        since = time.time() + 1
+        # partial output of the original job
+        with open(self.output_file, 'w') as f:
+            f.write('partial')
+        os.utime(self.output_file, (since + 1, since + 1))
+        self.outputs = SpeculativeOutputs(
+            self.directory, os.path.join(self.directory, '.staging'), since)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_redirect(self):
+        command = self.outputs.redirect(['cat', self.input_file,
+                                         self.output_file])
+
+        self.assertEqual(command[0], 'cat')
+        self.assertTrue(command[2].startswith(
+            self.outputs.staging_directory))
+        self.assertTrue(self.outputs.can_isolate())
+        self.outputs.redirect('--output=%s' % self.output_file)
+        self.assertFalse(self.outputs.can_isolate())
+
+    def test_prepare_and_commit(self):
+        command = self.outputs.redirect(['cat', self.input_file,
+                                         self.output_file])
+        self.outputs.prepare()
+
+        # inputs are visible to the copy, outputs of the original job are not
+        with open(command[1]) as f:
+            self.assertEqual(f.read(), 'input')
+        self.assertFalse(os.path.exists(command[2]))
+        with open(command[2], 'w') as f:
+            f.write('complete')
+        committed = self.outputs.commit()
+
+        self.assertEqual(committed, [self.output_file])
+        with open(self.output_file) as f:
+            self.assertEqual(f.read(), 'complete')
+        with open(self.input_file) as f:
+            self.assertEqual(f.read(), 'input')
+        self.assertFalse(os.path.exists(self.outputs.staging_directory))
+
+    def test_outputs_of_a_former_run_are_not_overwritten(self):
+        # rerun of a step: its outputs exist before the original job starts
+        former_output = os.path.join(self.subject_directory, 'former.nii')
+        for filename in (former_output, former_output + '.minf'):
+            with open(filename, 'w') as f:
+                f.write('former')
+        command = self.outputs.redirect(['cat', self.input_file,
+                                         former_output])
+        self.outputs.prepare()
+
+        for filename in (command[2], command[2] + '.minf'):
+            self.assertFalse(os.path.islink(filename))
+            with open(filename, 'w') as f:
+                f.write('copy')
+        for filename in (former_output, former_output + '.minf'):
+            with open(filename) as f:
+                self.assertEqual(f.read(), 'former')
+        committed = self.outputs.commit()
+
+        # the unchanged input is not committed
+        self.assertEqual(sorted(committed),
+                         [former_output, former_output + '.minf'])
+        with open(former_output) as f:
+            self.assertEqual(f.read(), 'copy')
+
+
+if __name__ == '__main__':
+    suite = unittest.TestSuite()
+    for test_case in (TestStragglerDetector, TestSpeculativeOutputs):
+        suite.addTests(unittest.TestLoader().loadTestsFromTestCase(test_case))
+    unittest.TextTestRunner(verbosity=2).run(suite)
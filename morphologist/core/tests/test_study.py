@@ -8,9 +8,14 @@ import filecmp
 import shutil
 import six
 
+from soma import aims
+
 from morphologist.core.study import SubjectExistsError
 from morphologist.core.subject import Subject
 from morphologist.core.study import Study
+from morphologist.core.study_format import convert_study_file
+from morphologist.core.format_conversion import FormatConverter, \
+    FormatConversionError
 from morphologist.core.tests.study import MockStudyTestCase
 from morphologist.core.tests.mocks.study import MockStudy
 
@@ -54,6 +59,123 @@ class TestStudy(unittest.TestCase):
 
         self.assert_(filecmp.cmp(studyfilepath, studyfilepath2))
 
+    def test_load_previous_format(self):
+        self.test_case.add_subjects()
+        self.study.save_to_backup_file()
+        convert_study_file(self.study.backup_filepath, version='0.5')
+
+        loaded_study = Study.from_file(self.study.backup_filepath)
+
+        self.assertEqual(loaded_study.serialize(), self.study.serialize())
+
+    def test_lazy_analyses(self):
+        self.test_case.add_subjects()
+        self.study.save_to_backup_file()
+        subject_ids = list(self.study.subjects.keys())
+
+        loaded_study = Study.from_file(self.study.backup_filepath)
+        loaded_study.analyses.max_decoded = 1
+
+        self.assertEqual(list(loaded_study.analyses.keys()), subject_ids)
+        self.assert_(not [subject_id for subject_id in subject_ids
+                          if loaded_study.analyses.is_decoded(subject_id)])
+        for subject_id in subject_ids:
+            analysis = loaded_study.analyses[subject_id]
+            self.assertEqual(analysis.parameters,
+                             self.study.analyses[subject_id].parameters)
+        # only the last accessed analysis is kept
+        self.assertEqual([subject_id for subject_id in subject_ids
+                          if loaded_study.analyses.is_decoded(subject_id)],
+                         subject_ids[-1:])
+        self.assertEqual(loaded_study.serialize(), self.study.serialize())
+
+    def test_lazy_analyses_dropped(self):
+        self.test_case.add_subjects()
+        self.study.save_to_backup_file()
+        subject_ids = list(self.study.subjects.keys())
+
+        loaded_study = Study.from_file(self.study.backup_filepath)
+        analyses = loaded_study.analyses
+        analyses.max_decoded = 1
+
+        def stored_form(subject_id):
+            return analyses._deltas.get(subject_id,
+                                        analyses._serialized.get(subject_id))
+
+        analysis = analyses[subject_ids[0]]
+        serialized = stored_form(subject_ids[0])
+        for subject_id in subject_ids[1:]:
+            analyses[subject_id]
+
+        # unchanged parameters are not encoded again
+        self.assert_(stored_form(subject_ids[0]) is serialized)
+        # a dropped analysis still referenced is not decoded again
+        self.assert_(analyses[subject_ids[0]] is analysis)
+        analysis.parameters = self.study.analyses[subject_ids[-1]].parameters
+        self.assertEqual(
+            analyses.serialized_parameters(subject_ids[0]),
+            self.study.analyses.serialized_parameters(subject_ids[-1]))
+
+    def _interrupt_format_conversion(self, formats):
+        directory = self.study.output_directory
+        conversions = []
+        for name in ('subject1', 'subject2'):
+            filename = os.path.join(directory, name + '.nii')
+            aims.write(aims.Volume(4, 4, 4, dtype='S16'), filename)
+            conversions.append(
+                (filename, os.path.join(directory, name + '.ima')))
+        missing = os.path.join(directory, 'subject3.nii')
+        conversions.append(
+            (missing, os.path.join(directory, 'subject3.ima')))
+        converter = FormatConverter.from_directory(directory)
+        self.assertRaises(FormatConversionError, converter.convert,
+                          conversions, None, formats)
+        aims.write(aims.Volume(4, 4, 4, dtype='S16'), missing)
+        return converter, conversions
+
+    def test_resume_format_conversion_on_load(self):
+        self.test_case.add_subjects()
+        self.study.save_to_backup_file()
+        converter, conversions = self._interrupt_format_conversion(
+            [self.study.volumes_format, self.study.meshes_format])
+
+        Study.from_file(self.study.backup_filepath)
+
+        self.assert_(not converter.has_pending_conversion())
+        for old_name, new_name in conversions:
+            self.assert_(not os.path.exists(old_name))
+            self.assert_(os.path.exists(new_name))
+
+    def test_cancel_format_conversion_on_load(self):
+        self.test_case.add_subjects()
+        self.study.save_to_backup_file()
+        # the study has not been saved with the new formats
+        converter, conversions = self._interrupt_format_conversion(
+            ['GIS', 'MESH'])
+
+        Study.from_file(self.study.backup_filepath)
+
+        self.assert_(not converter.has_pending_conversion())
+        for old_name, new_name in conversions:
+            self.assert_(os.path.exists(old_name))
+            self.assert_(not os.path.exists(new_name))
+
+    def test_add_subjects(self):
+        self.test_case.add_subjects()
+        new_study = Study(analysis_type=self.study.analysis_type,
+                          study_name=self.study.study_name,
+                          output_directory=self.study.output_directory)
+
+        new_study.add_subjects(
+            [Subject(subject.name, subject.groupname, subject.filename)
+             for subject in self.study.subjects.values()],
+            import_data=False)
+
+        self._assert_same_studies(new_study, self.study)
+        for subject_id, analysis in six.iteritems(self.study.analyses):
+            self.assertEqual(new_study.analyses[subject_id].parameters,
+                             analysis.parameters)
+
     def test_has_subjects(self):
         self.assert_(not self.study.has_subjects())
 
@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+import unittest
+
+from morphologist.core import study_format
+
+
+class TestStudyFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.serialized = {
+            'study_format_version': '0.5',
+            'study_name': 'study',
+            'subjects': {
+                'center1-subject1': {'name': 'subject1',
+                                     'groupname': 'center1'},
+                'center2-subject2': {'name': 'subject2',
+                                     'groupname': 'center2'}},
+            'parameters': {
+                'center1-subject1': {'state': {
+                    't1mri': '${output_directory}/center1/subject1/'
+                             't1mri/default_acquisition/subject1.nii',
+                    'capsul_attributes': {'center': 'center1',
+                                          'subject': 'subject1'},
+                    'fix_random_seed': False}},
+                'center2-subject2': {'state': {
+                    't1mri': '${output_directory}/center2/subject2/'
+                             't1mri/default_acquisition/subject2.nii',
+                    'capsul_attributes': {'center': 'center2',
+                                          'subject': 'subject2'},
+                    'fix_random_seed': True,
+                    'anterior_commissure': [10., 20., 30.]}}}}
+
+    def test_parameters_delta(self):
+        template = {'a': {'b': 1, 'c': [1, 2]}, 'd': 'x'}
+        parameters = {'a': {'b': 1., 'c': [1, 2]}, 'e': 'y'}
+
+        delta = study_format.parameters_delta(template, parameters)
+
+        self.assertEqual(sorted(delta['set']), [[['a', 'b'], 1.],
+                                                [['e'], 'y']])
+        self.assertEqual(delta['unset'], [['d']])
+        self.assertEqual(study_format.apply_parameters_delta(template, delta),
+                         parameters)
+        self.assertEqual(study_format.parameters_delta(template, template),
+                         {})
+
+    def test_compact_and_expand_study(self):
+        compact = study_format.compact_study(self.serialized)
+
+        self.assertEqual(compact['study_format_version'], '0.6')
+        self.assertEqual(
+            compact['parameters_template']['state']['t1mri'],
+            '${output_directory}/${group}/${subject}/'
+            't1mri/default_acquisition/${subject}.nii')
+        self.assertEqual(compact['parameters']['center1-subject1'], {})
+        self.assertEqual(
+            sorted(compact['parameters']['center2-subject2']['set']),
+            [[['state', 'anterior_commissure'], [10., 20., 30.]],
+             [['state', 'fix_random_seed'], True]])
+        self.assertEqual(study_format.expand_study(compact), self.serialized)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStudyFormat)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from morphologist.core.study_store import SQLiteStudyStore
+
+
+class TestSQLiteStudyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        self.store = SQLiteStudyStore.from_directory(self.directory)
+        self.serialized = {
+            'study_format_version': '0.6',
+            'study_name': 'study',
+            'parameters_template': {'state': {'t1mri': '${subject}.nii'}},
+            'subjects': {},
+            'parameters': {}}
+        for groupname, name in (('center1', 'subject1'),
+                                ('center1', 'subject2'),
+                                ('center2', 'subject3')):
+            subject_id = '%s-%s' % (groupname, name)
+            self.serialized['subjects'][subject_id] = {
+                'name': name, 'groupname': groupname,
+                'filename': '%s.nii' % name}
+            self.serialized['parameters'][subject_id] = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        self.store.save(self.serialized)
+
+        loaded = SQLiteStudyStore.from_directory(self.directory).load()
+
+        self.assertEqual(loaded, self.serialized)
+
+    def test_incremental_save(self):
+        self.store.save(self.serialized)
+        statements = []
+        connect = self.store._connect
+
+        def traced_connect():
+            connection = connect()
+            connection.set_trace_callback(statements.append)
+            return connection
+
+        self.store._connect = traced_connect
+        self.serialized['study_name'] = 'renamed study'
+        del self.serialized['subjects']['center1-subject2']
+        del self.serialized['parameters']['center1-subject2']
+        self.store.save(self.serialized)
+
+        writes = [statement for statement in statements
+                  if statement.startswith(('INSERT', 'DELETE'))]
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(SQLiteStudyStore(self.store.filename).load(),
+                         self.serialized)
+
+    def test_subject_ids(self):
+        self.store.save(self.serialized)
+
+        self.assertEqual(self.store.subject_ids(groupname='center1'),
+                         ['center1-subject1', 'center1-subject2'])
+        self.assertEqual(self.store.subject_ids(name='subject3'),
+                         ['center2-subject3'])
+
+    def test_read_while_writing(self):
+        self.store.save(self.serialized)
+        writer = sqlite3.connect(self.store.filename)
+        try:
+            writer.execute('BEGIN IMMEDIATE')
+            writer.execute("DELETE FROM subjects")
+
+            loaded = SQLiteStudyStore(self.store.filename).load()
+        finally:
+            writer.rollback()
+            writer.close()
+
+        self.assertEqual(loaded, self.serialized)
+
+    def test_runs(self):
+        self.store.add_run(['center1-subject1', 'center2-subject3'],
+                           ['step1'], 'local_pool', date=1.)
+        self.store.add_run(['center1-subject1'], date=2.)
+
+        runs = self.store.runs('center1-subject1')
+
+        self.assertEqual([(run['date'], run['step_ids'], run['backend'])
+                          for run in runs],
+                         [(1., ['step1'], 'local_pool'), (2., None, None)])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSQLiteStudyStore)
+    unittest.TextTestRunner(verbosity=2).run(suite)
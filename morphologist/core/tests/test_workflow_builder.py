@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from soma_workflow.client import Workflow, Job
+from capsul.pipeline import pipeline_workflow
+
+from morphologist.core.scheduling import job_step_ids
+from morphologist.core.workflow_builder import merge_subject_workflows, \
+    _fragment_to_dict, _fragment_from_dict
+from morphologist.core.tests.test_scheduling import LinearPipeline
+
+
+class MockStudy(object):
+
+    def __init__(self, subject_ids):
+        self.study_name = 'mock_study'
+        self.subjects = dict([(subject_id, subject_id)
+                              for subject_id in subject_ids])
+
+
+class TestMergeSubjectWorkflows(unittest.TestCase):
+
+    def setUp(self):
+        self.subject_ids = ['subject1', 'subject2', 'subject3']
+        self.study = MockStudy(self.subject_ids)
+
+    def create_fragment(self, jobs_n):
+        jobs = [Job(['true'], name='job%d' % i) for i in range(jobs_n)]
+        dependencies = list(zip(jobs[:-1], jobs[1:]))
+        return Workflow(jobs=jobs, dependencies=dependencies)
+
+    def test_merge_order_and_priorities(self):
+        fragments = [(subject_id, self.create_fragment(2))
+                     for subject_id in self.subject_ids]
+
+        workflow = merge_subject_workflows(self.study, fragments)
+
+        self.assertEqual([group.user_storage
+                          for group in workflow.root_group],
+                         self.subject_ids)
+        self.assertEqual([job.priority for job in workflow.jobs],
+                         [200, 200, 100, 100, 0, 0])
+        self.assertEqual(len(workflow.dependencies), 3)
+
+    def test_subjects_without_jobs_are_skipped(self):
+        fragments = [('subject1', self.create_fragment(1)),
+                     ('subject2', self.create_fragment(0)),
+                     ('subject3', self.create_fragment(1))]
+
+        workflow = merge_subject_workflows(self.study, fragments)
+
+        self.assertEqual([group.user_storage
+                          for group in workflow.root_group],
+                         ['subject1', 'subject3'])
+        self.assertEqual([job.priority for job in workflow.jobs], [200, 100])
+
+
+class TestFragmentTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='morphologist_test_')
+        pipeline = LinearPipeline()
+        pipeline.input_image = os.path.join(self.directory, 'input.nii')
+        pipeline.output_image = os.path.join(self.directory, 'output.nii')
+        self.workflow = pipeline_workflow.workflow_from_pipeline(pipeline)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_step_ids_are_kept(self):
+        # as sent back by the workers of the ParallelWorkflowBuilder
+        fragment = _fragment_from_dict(pickle.loads(pickle.dumps(
+            _fragment_to_dict(self.workflow))))
+
+        self.assertEqual([job.name for job in fragment.jobs],
+                         [job.name for job in self.workflow.jobs])
+        self.assertEqual([job_step_ids(job) for job in fragment.jobs],
+                         [job_step_ids(job) for job in self.workflow.jobs])
+        self.assert_(['step1'] in [job_step_ids(job)
+                                   for job in fragment.jobs])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+        TestMergeSubjectWorkflows)
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(
+        TestFragmentTransfer))
+    unittest.TextTestRunner(verbosity=2).run(suite)
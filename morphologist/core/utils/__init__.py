@@ -1,15 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import collections
+import multiprocessing
 import os
 import re
 from six.moves import range
 from collections import OrderedDict
-from soma.qt_gui.qtThread import QtThreadCall
 from soma.functiontools import partial
 
-from morphologist.core.gui.qt_backend import QtCore, QtGui, loadUi 
-
 
 class BidiMap(collections.abc.MutableMapping):
     '''Bi-directional map'''
@@ -198,19 +196,16 @@ def create_filename_compatible_string(base_string):
     return re.sub("[^a-zA-Z0-9\-_]", "_", base_string)
 
 
-class FuncQThread(QtCore.QThread):
-
-    def __init__(self, func, args=(), kwargs={}):
-        super(FuncQThread, self).__init__()
-        self._func = func
-        self._args = args
-        self._kwargs = kwargs
-        self.res = None
-
-    def run(self):
-        try:
-            self.res = self._func(*self._args, **self._kwargs)
-        except Exception as e:
-            # print('Exception:', e)
-            import traceback
-            traceback.print_exc()
+def create_process_pool(processes_n, initializer=None, initargs=()):
+    ''' multiprocessing pool whose processes are not forked from the
+    calling process, which may run Qt or other threads: they are forked
+    from a server process (forkserver), or spawned where it is not
+    available. Python 2 has no start methods: its pools are forked.
+    '''
+    if not hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.Pool(processes_n, initializer, initargs)
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+    else:
+        context = multiprocessing.get_context('spawn')
+    return context.Pool(processes_n, initializer, initargs)
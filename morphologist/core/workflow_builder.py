@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import print_function
+
+from __future__ import absolute_import
+import importlib
+
+from soma_workflow.client import Workflow, Job, Group
+
+from capsul.pipeline import pipeline_workflow
+from capsul.pipeline import pipeline_tools
+
+from morphologist.core.settings import settings
+from morphologist.core.scheduling import LINEAR_PRIORITIES, \
+    set_jobs_priorities, make_job_duration, fuse_short_jobs
+from morphologist.core.runtime_db import StepRuntimeDatabase
+from morphologist.core.provenance import EXISTING_OUTPUTS_SKIP, \
+    PROVENANCE_SKIP, disable_steps_with_unchanged_provenance
+from morphologist.core.utils import create_process_pool
+
+
+class MissingInputFileError(Exception):
+    pass
+
+
+class MissingModelsError(MissingInputFileError):
+    pass
+
+
+def check_missing_models(pipeline, missing):
+    if 'SulciRecognition.SPAM_recognition09.global_recognition' in missing:
+        node = missing[
+            'SulciRecognition.SPAM_recognition09.global_recognition']
+        model = [m[0] for m in node if m[0] == 'model']
+        if model:
+            raise MissingModelsError(
+                "SPAM recognition models are not installed.")
+
+
+def study_workflow_name(study):
+    return 'Morphologist UI - %s' % study.study_name
+
+
+def build_subject_workflow(study, subject_id, step_ids=None,
+                           skip_mode=EXISTING_OUTPUTS_SKIP):
+    ''' Build the workflow fragment of a subject, using the pipeline of its
+    analysis. Jobs get a priority of 0: the subjects priorities are set when
+    merging the fragments (see merge_subject_workflows).
+
+    If step_ids is given, only these pipeline steps are run. Among them, the
+    steps whose outputs exist are not run, or, in PROVENANCE_SKIP mode, the
+    steps whose inputs and parameters have not changed either (see
+    provenance.disable_steps_with_unchanged_provenance).
+    '''
+    analysis = study.analyses[subject_id]
+    subject = study.subjects[subject_id]
+
+    analysis.set_parameters(subject)
+    #analysis.propagate_parameters()
+    pipeline = analysis.pipeline
+    pipeline.enable_all_pipeline_steps()
+    if step_ids is not None:
+        for step_id in pipeline.pipeline_steps.user_traits():
+            if step_id not in step_ids:
+                setattr(pipeline.pipeline_steps, step_id, False)
+    # force highest priority normalization method
+    # FIXME: specific knowledge of Morphologist should not be used here.
+    pipeline.Normalization_select_Normalization_pipeline = 'NormalizeSPM'
+    steps_provenance = analysis.steps_provenance()
+    if skip_mode == PROVENANCE_SKIP and steps_provenance is not None:
+        disable_steps_with_unchanged_provenance(pipeline, steps_provenance)
+    else:
+        pipeline_tools.disable_runtime_steps_with_existing_outputs(pipeline)
+
+    missing = pipeline_tools.nodes_with_missing_inputs(pipeline)
+    if missing:
+        check_missing_models(pipeline, missing)
+        print('MISSING INPUTS IN NODES:', missing)
+        raise MissingInputFileError("subject: %s" % subject_id)
+
+    return pipeline_workflow.workflow_from_pipeline(
+        pipeline, study_config=study, jobs_priority=0)
+
+
+def merge_subject_workflows(study, fragments):
+    '''
+    Merge subjects workflow fragments into a single workflow, in which each
+    subject has its own group (its user_storage is the subject id).
+
+    Parameters
+    ----------
+    study: Study
+    fragments: list
+        (subject_id, workflow) pairs, in the subjects order. The first
+        subjects get the highest jobs priorities, subjects without any job
+        are skipped.
+    '''
+    workflow = Workflow(name=study_workflow_name(study), jobs=[])
+    workflow.root_group = []
+    workflow.param_links = {}
+
+    priority = (len(fragments) - 1) * 100
+    for subject_id, wf in fragments:
+        jobs = [j for j in wf.jobs if isinstance(j, Job)]
+        if len(jobs) == 0:
+            continue
+        for job in jobs:
+            job.priority = (job.priority or 0) + priority
+        priority -= 100
+        subject = study.subjects[subject_id]
+        workflow.jobs += wf.jobs
+        workflow.dependencies += wf.dependencies
+        workflow.param_links.update(getattr(wf, 'param_links', None) or {})
+        group = Group(wf.root_group, name='Morphologist %s' % str(subject))
+        group.user_storage = subject_id
+        workflow.root_group.append(group) # += wf.root_group
+        workflow.groups += [group] + wf.groups
+
+    return workflow
+
+
+class WorkflowBuilder(object):
+    ''' Build the workflow of a set of subjects of a study, one subject
+    after the other, on the study template pipeline.
+
+    Jobs priorities are set according to priorities_mode (see
+    scheduling.set_jobs_priorities). step_durations (step_id -> duration)
+    may give known steps durations, overriding the analysis estimates.
+
+    If fusion_max_duration is set, the chains of short jobs of each subject
+    lasting less than this duration (in seconds) are fused into single jobs
+    (see scheduling.fuse_short_jobs).
+
+    skip_mode selects the steps which are not run again (see
+    build_subject_workflow).
+    '''
+
+    def __init__(self, study, priorities_mode=LINEAR_PRIORITIES,
+                 step_durations=None, fusion_max_duration=0,
+                 skip_mode=EXISTING_OUTPUTS_SKIP):
+        self._study = study
+        self._priorities_mode = priorities_mode
+        self._step_durations = step_durations
+        self._fusion_max_duration = fusion_max_duration
+        self._skip_mode = skip_mode
+
+    def build(self, subject_ids, step_ids=None):
+        return self.merge(self.build_fragments(subject_ids, step_ids))
+
+    def build_fragments(self, subject_ids, step_ids=None, errors=None):
+        ''' Build the workflow fragments of the subjects: a list of
+        (subject_id, workflow) pairs, in the subjects order.
+
+        If errors is a dict, the subjects with missing inputs are skipped,
+        and their MissingInputFileError is stored in it (subject_id ->
+        error). Otherwise the error of the first one is raised.
+        '''
+        fragments = []
+        for subject_id in subject_ids:
+            try:
+                workflow = build_subject_workflow(self._study, subject_id,
+                                                  step_ids, self._skip_mode)
+            except MissingInputFileError as e:
+                if errors is None:
+                    raise
+                errors[subject_id] = e
+                continue
+            fragments.append((subject_id, workflow))
+        return fragments
+
+    def merge(self, fragments):
+        job_duration = self.job_duration()
+        if self._fusion_max_duration:
+            for _, fragment in fragments:
+                fuse_short_jobs(fragment, job_duration,
+                                self._fusion_max_duration)
+        workflow = merge_subject_workflows(self._study, fragments)
+        set_jobs_priorities(workflow, self._priorities_mode, job_duration)
+        return workflow
+
+    def job_duration(self):
+        ''' Job -> estimated duration function used to set the priorities
+        '''
+        return make_job_duration(self._study.analysis_cls(),
+                                 self._step_durations)
+
+
+class ParallelWorkflowBuilder(WorkflowBuilder):
+    '''
+    Build the subjects workflow fragments in a pool of worker processes.
+
+    Each worker loads its own copy of the study (thus its own pipeline
+    instance) once, then builds the fragments of the subjects it is given.
+    Fragments are sent back as soma-workflow dictionaries, with the step ids
+    of their jobs (see _fragment_to_dict), and merged in the subjects order,
+    so the resulting workflow and its priorities are the same as with the
+    serial builder.
+    '''
+
+    def __init__(self, study, processes_n, priorities_mode=LINEAR_PRIORITIES,
+                 step_durations=None, fusion_max_duration=0,
+                 skip_mode=EXISTING_OUTPUTS_SKIP):
+        super(ParallelWorkflowBuilder, self).__init__(
+            study, priorities_mode, step_durations, fusion_max_duration,
+            skip_mode)
+        self._processes_n = processes_n
+
+    def build_fragments(self, subject_ids, step_ids=None, errors=None):
+        subject_ids = list(subject_ids)
+        study = self._study
+        initargs = (study.analysis_cls().__module__, study.serialize(),
+                    study.output_directory)
+        chunksize = max(1, len(subject_ids) // (self._processes_n * 4))
+        pool = create_process_pool(self._processes_n,
+                                   initializer=_init_builder_process,
+                                   initargs=initargs)
+        try:
+            results = list(pool.imap(
+                _build_workflow_dict,
+                [(subject_id, step_ids, self._skip_mode)
+                 for subject_id in subject_ids],
+                chunksize))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        fragments = []
+        for subject_id, (fragment_dict, error) in zip(subject_ids, results):
+            if error is not None:
+                if errors is None:
+                    raise error
+                errors[subject_id] = error
+                continue
+            fragments.append((subject_id, _fragment_from_dict(fragment_dict)))
+        return fragments
+
+
+# below this number of subjects per process, the cost of loading the study
+# in the workers is not worth it
+MIN_SUBJECTS_PER_PROCESS = 10
+
+
+def create_workflow_builder(study, subjects_n):
+    ''' Create the workflow builder suited to build the workflow of
+    subjects_n subjects, according to the runner settings.
+    '''
+    priorities_mode = settings.runner.priorities_mode
+    fusion_max_duration = settings.runner.fusion_max_duration
+    step_durations = None
+    if priorities_mode != LINEAR_PRIORITIES or fusion_max_duration:
+        # prefer the durations measured in previous runs to the estimates
+        runtime_db = StepRuntimeDatabase.from_study(study)
+        if runtime_db.exists():
+            step_durations = runtime_db.median_durations()
+    skip_mode = settings.runner.skip_mode
+    processes_n = settings.runner.workflow_builders_n
+    if processes_n.is_auto:
+        processes_n = min(processes_n, subjects_n // MIN_SUBJECTS_PER_PROCESS)
+    if processes_n > 1:
+        return ParallelWorkflowBuilder(study, processes_n, priorities_mode,
+                                       step_durations, fusion_max_duration,
+                                       skip_mode)
+    return WorkflowBuilder(study, priorities_mode, step_durations,
+                           fusion_max_duration, skip_mode)
+
+
+_builder_study = None
+
+
+def _init_builder_process(analysis_module, serialized_study,
+                          output_directory):
+    global _builder_study
+    # registers the analysis class in the AnalysisFactory
+    importlib.import_module(analysis_module)
+    from morphologist.core.study import Study
+    _builder_study = Study.unserialize(serialized_study, output_directory)
+
+
+def _build_workflow_dict(args):
+    subject_id, step_ids, skip_mode = args
+    try:
+        workflow = build_subject_workflow(_builder_study, subject_id,
+                                          step_ids, skip_mode)
+    except MissingInputFileError as e:
+        # sent back to the parent process, which decides what to do with it
+        return None, e
+    return _fragment_to_dict(workflow), None
+
+
+def _fragment_to_dict(workflow):
+    ''' picklable form of a workflow fragment. Workflow.to_dict does not
+    keep the user_storage of the jobs (their step ids), which is sent
+    alongside, in the jobs order.
+    '''
+    return workflow.to_dict(), [job.user_storage for job in workflow.jobs]
+
+
+def _fragment_from_dict(fragment_dict):
+    workflow_dict, jobs_user_storage = fragment_dict
+    workflow = Workflow.from_dict(workflow_dict)
+    # Workflow.from_dict rebuilds the jobs in the order of Workflow.to_dict
+    for job, user_storage in zip(workflow.jobs, jobs_user_storage):
+        job.user_storage = user_storage
+    return workflow
@@ -7,8 +7,9 @@ import six
 
 from morphologist.core.constants import ALL_SUBJECTS
 from morphologist.core.settings import settings
-from morphologist.core.utils import FuncQThread, QtThreadCall, partial
-from morphologist.core.runner import SomaWorkflowRunner
+from morphologist.core.utils import partial
+from morphologist.core.gui.utils import FuncQThread, QtThreadCall
+from morphologist.core.runner import create_runner
 from morphologist.core.study import Study, StudySerializationError
 from morphologist.core.analysis import AnalysisFactory
 from morphologist.core.gui.study_model import LazyStudyModel
@@ -284,7 +285,14 @@ class MainWindow(QtGui.QMainWindow):
         QtGui.QApplication.instance().restoreOverrideCursor()
 
     def _create_runner(self, study):
-        return SomaWorkflowRunner(study)
+        runner = create_runner(study)
+        if study.has_subjects():
+            try:
+                # follow again the analyses left running in the background
+                runner.attach()
+            except Exception as e:
+                print('could not attach to the running analyses:', e)
+        return runner
 
     # this slot is automagically connected
     @QtCore.Slot()
@@ -422,13 +430,26 @@ class MainWindow(QtGui.QMainWindow):
         return title
 
     def closeEvent(self, event):
-        msg = 'Stop current running analysis and quit ?'
-        if self._runner_still_running_after_stopping_asked_to_user(msg):
+        if self.runner.DETACHABLE and self.runner.is_running():
+            title = 'Analyses are currently running'
+            msg = 'Stop current running analysis before quitting ?\n' \
+                'Otherwise they go on running in the background, and are ' \
+                'followed again when the study is reopened.'
+            answer = QtGui.QMessageBox.question(self, title, msg,
+                QtGui.QMessageBox.Yes | QtGui.QMessageBox.No
+                | QtGui.QMessageBox.Cancel)
+            if answer == QtGui.QMessageBox.Cancel:
+                event.ignore()
+                return
+            if answer == QtGui.QMessageBox.Yes:
+                self.runner.stop()
+        elif self._runner_still_running_after_stopping_asked_to_user(
+                'Stop current running analysis and quit ?'):
             event.ignore()
-        else:
-            if hasattr(self, 'browser'):
-                del self.browser
-            event.accept()
+            return
+        if hasattr(self, 'browser'):
+            del self.browser
+        event.accept()
 
     # this slot is automagically connected
     @QtCore.Slot()
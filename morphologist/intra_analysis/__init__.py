@@ -10,7 +10,7 @@ from morphologist.core.analysis import SharedPipelineAnalysis, \
 from morphologist.intra_analysis.steps import \
     BiasCorrection, HistogramAnalysis, BrainSegmentation, SplitBrain, \
     GreyWhite, SpatialNormalization, Grey, GreySurface, WhiteSurface, Sulci, \
-    SulciLabelling, Morphometry
+    SulciLabelling, Morphometry, STEPS_RESOURCES
 from morphologist.intra_analysis.parameters import IntraAnalysisParameterNames
 
 # CAPSUL
@@ -22,6 +22,8 @@ from morphologist.capsul.morphologist import Morphologist
 
 class IntraAnalysis(SharedPipelineAnalysis):
 
+    steps_resources = STEPS_RESOURCES
+
     def __init__(self, study):
         super(IntraAnalysis, self).__init__(study)
 
@@ -1,5 +1,5 @@
 from __future__ import absolute_import
-from morphologist.core.steps import StepHelp
+from morphologist.core.steps import StepHelp, StepResources
 
 
 class SpatialNormalization(StepHelp):
@@ -194,3 +194,43 @@ class Morphometry(StepHelp):
         #if self.inputs.normalized:
             #command.append('--normalized')
         #return command
+
+
+# resources of the pipeline steps (see IntraAnalysis.build_pipeline).
+# Durations (in seconds), peak memory and outputs size (in MB) are rough
+# estimates for a 1mm T1 image. The SPM normalization may fail on Matlab
+# licences contention, the sulci recognition when memory is short: they
+# are given several attempts.
+STEPS_RESOURCES = {
+    'orientation':
+        StepResources(duration=120, memory=2000, output_size=40,
+                      max_attempts=3),
+    'bias_correction':
+        StepResources(duration=90, memory=1000, output_size=60),
+    'histogram_analysis':
+        StepResources(duration=10, memory=300, output_size=1),
+    'brain_extraction':
+        StepResources(duration=40, memory=600, output_size=10),
+    'hemispheres_split':
+        StepResources(duration=30, memory=600, output_size=10),
+}
+for side in ('left', 'right'):
+    STEPS_RESOURCES.update({
+        'grey_white_segmentation_%s' % side:
+            StepResources(duration=30, memory=600, output_size=8),
+        'grey_white_topology_%s' % side:
+            StepResources(duration=60, memory=800, output_size=4),
+        'white_mesh_%s' % side:
+            StepResources(duration=60, memory=800, output_size=10),
+        'pial_mesh_%s' % side:
+            StepResources(duration=90, memory=1200, output_size=12),
+        'sulci_skeleton_%s' % side:
+            StepResources(duration=60, memory=600, output_size=10),
+        'sulci_%s' % side:
+            StepResources(duration=150, memory=1200, output_size=15),
+        # SPAM recognition
+        'sulci_labelling_%s' % side:
+            StepResources(duration=600, memory=3000, output_size=5,
+                          max_attempts=2),
+    })
+del side